@@ -67,7 +67,7 @@ except ImportError as e:
 
 # Fallback agent for deployment issues
 class SimpleAgent:
-    def process_query(self, question):
+    def process_query(self, question, depth="Standard"):
         current_date = datetime.now().strftime("%Y-%m-%d")
         return {
             "answer": f"""
@@ -294,22 +294,46 @@ def main():
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
-                steps = [
-                    "Analyzing query intent and context...",
-                    "Searching latest web developments...",
-                    "Querying internal knowledge base...",
-                    "Cross-referencing sources...",
-                    "Synthesizing comprehensive analysis...",
-                    "Formatting final report..."
-                ]
+                stage_labels = {
+                    "intent": "Analyzing query intent and context",
+                    "web": "Searching latest web developments",
+                    "internal": "Querying internal knowledge base",
+                    "synthesis": "Synthesizing comprehensive analysis"
+                }
+                finished_stages = set()
                 
-                for i, step in enumerate(steps):
-                    status_text.text(f"🔄 {step}")
-                    progress_bar.progress((i + 1) * 16)
-                    time.sleep(0.3)  # Reduced for better UX
+                def show_progress(event):
+                    """Advance the progress bar from the agent's stage events"""
+                    if event['stage'] == 'cache':
+                        if event['status'] == 'done':
+                            progress_bar.progress(100)
+                            status_text.text("♻️ Reusing a recent report for a similar question")
+                        return
+                    label = stage_labels.get(event['stage'], event['stage'])
+                    if event['status'] == 'start':
+                        status_text.text(f"🔄 {label}...")
+                        return
+                    finished_stages.add(event['stage'])
+                    progress_bar.progress(int(100 * len(finished_stages) / len(stage_labels)))
+                    if event['status'] == 'done':
+                        status_text.text(f"✅ {label} ({event['seconds']:.1f}s)")
+                    elif event['status'] == 'failed':
+                        status_text.text(f"⚠️ {label}: {event['reason']}")
                 
+                started_at = time.perf_counter()
                 try:
-                    result = st.session_state.agent.process_query(user_question)
+                    agent = st.session_state.agent
+                    if hasattr(agent, 'stream_query'):
+                        # Render the report as it is generated
+                        result = agent.stream_query(user_question, depth=research_depth, on_event=show_progress)
+                        report_view = st.empty()
+                        streamed = ""
+                        for chunk in result['answer_stream']:
+                            streamed += chunk
+                            report_view.markdown(streamed + "▌")
+                        report_view.empty()
+                    else:
+                        result = agent.process_query(user_question, depth=research_depth)
                     st.session_state.research_count += 1
                     
                     # Add to conversation
@@ -317,14 +341,16 @@ def main():
                         'question': user_question,
                         'answer': result['answer'],
                         'sources': result['sources_used'],
+                        'web_results': result.get('web_results', []) if include_sources else [],
+                        'internal_results': result.get('internal_results', []) if include_sources else [],
                         'timestamp': time.time(),
                         'research_id': f"res_{st.session_state.research_count:04d}",
-                        'depth': research_depth
+                        'depth': research_depth,
+                        'cache': result.get('cache')
                     })
                     
                     progress_bar.progress(100)
-                    status_text.success(" Research analysis complete!")
-                    time.sleep(0.5)
+                    status_text.success(f" Research analysis complete! ({time.perf_counter() - started_at:.1f}s)")
                     
                 except Exception as e:
                     progress_bar.progress(100)
@@ -400,8 +426,20 @@ def main():
                     st.caption(f"**ID:** {exchange['research_id']}")
                 
                 # Answer display
+                if exchange.get('cache'):
+                    st.caption(f"♻️ Reused report for a similar question: *{exchange['cache']['question']}* "
+                               f"(similarity {exchange['cache']['similarity']:.2f})")
                 st.markdown(exchange['answer'])
                 
+                # Source listing, rendered from the structured records
+                searcher = getattr(st.session_state.agent, 'searcher', None)
+                if exchange.get('web_results') and searcher is not None:
+                    st.markdown(searcher.render_markdown(exchange['web_results'], exchange['question']))
+                if exchange.get('internal_results'):
+                    st.markdown("## 📚 Internal Sources")
+                    for doc in exchange['internal_results']:
+                        st.markdown(f"- **{doc['metadata'].get('source', 'Internal')}**: {doc['content'][:150]}...")
+                
                 # Actions
                 col_act1, col_act2 = st.columns(2)
                 with col_act1:
@@ -0,0 +1,30 @@
+import os
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# Requests aprocess_query/astream_query serve at once on one event loop
+MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', '32'))
+# Threads for blocking Serper, Gemini and Chroma calls made from async code.
+# The loop's default executor has only min(32, cpus + 4) threads, which on a
+# small pod would cap in-flight requests well below MAX_CONCURRENT_REQUESTS.
+ASYNC_IO_WORKERS = int(os.getenv('ASYNC_IO_WORKERS', str(MAX_CONCURRENT_REQUESTS)))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_io_executor():
+    """Process-wide pool for blocking I/O started from the event loop"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ASYNC_IO_WORKERS, thread_name_prefix="async-io")
+        return _executor
+
+async def run_blocking(function, *args, **kwargs):
+    """asyncio.to_thread on the dedicated I/O pool; context variables (e.g. the trace span) carry over"""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, function, *args, **kwargs)
+    return await loop.run_in_executor(get_io_executor(), call)
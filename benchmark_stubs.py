@@ -0,0 +1,151 @@
+"""Local HTTP stand-ins for Serper and Gemini
+
+They let benchmarks drive the real FreeSearchClient and FreeAIClient code
+paths (HTTP, JSON parsing, retries, caching) with a fixed, reproducible
+latency and no API quota.
+"""
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+INTENT_REPLY = {
+    "needs_web": True,
+    "needs_internal": True,
+    "confidence": "high",
+    "reasoning": "Benchmark stub",
+    "filters": {}
+}
+
+def serper_payload(query, num=7):
+    """Serper-shaped search response for query"""
+    return {
+        "searchParameters": {"q": query},
+        "organic": [
+            {
+                "title": f"Stub result {i} for {query}",
+                "snippet": f"Stub snippet {i} about {query}, with enough text to look like a real search result.",
+                "link": f"https://stub.local/{i}",
+                "position": i
+            }
+            for i in range(1, num + 1)
+        ]
+    }
+
+def gemini_payload(text):
+    """generateContent response carrying text"""
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0
+        }]
+    }
+
+def gemini_reply(prompt):
+    """Intent JSON for intent prompts, a short report otherwise"""
+    if "Return ONLY valid JSON" in prompt:
+        return json.dumps(INTENT_REPLY)
+    return "## Executive Summary\nBenchmark stub report.\n\n## Key Findings\n- Finding one\n- Finding two\n"
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"    # keep-alive, like the real services
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)) or 0)
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+        time.sleep(server.latency)
+        with server.lock:
+            server.in_flight -= 1
+            server.requests += 1
+            fail = server.fail_next > 0
+            if fail:
+                server.fail_next -= 1
+        if fail:
+            self._send(503, {"error": "stub overloaded"})
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            self._send(400, {"error": "invalid JSON"})
+            return
+
+        if ":generateContent" in self.path or ":streamGenerateContent" in self.path:
+            prompt = " ".join(
+                part.get("text", "") for content in request.get("contents", []) for part in content.get("parts", [])
+            )
+            text = gemini_reply(prompt)
+            if ":streamGenerateContent" in self.path:
+                # REST streaming returns a JSON array of partial responses
+                lines = text.splitlines(keepends=True)
+                self._send(200, [gemini_payload(line) for line in lines])
+            else:
+                self._send(200, gemini_payload(text))
+        else:
+            self._send(200, serper_payload(request.get("q", ""), int(request.get("num", 7))))
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubServer:
+    """Threaded stub server on a free localhost port
+
+    Serves Serper searches on any path and Gemini generateContent /
+    streamGenerateContent calls, each after `latency` seconds. fail(n)
+    makes the next n requests return 503; peak_in_flight records the
+    highest concurrency the clients reached.
+    """
+
+    def __init__(self, latency=0.05):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.lock = threading.Lock()
+        self.httpd.requests = 0
+        self.httpd.in_flight = 0
+        self.httpd.peak_in_flight = 0
+        self.httpd.fail_next = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def peak_in_flight(self):
+        """Most requests the stub was serving at the same moment"""
+        return self.httpd.peak_in_flight
+
+    def fail(self, count):
+        with self.httpd.lock:
+            self.httpd.fail_next = count
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
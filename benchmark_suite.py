@@ -0,0 +1,489 @@
+"""Benchmarks for the research pipeline
+
+Run the pipeline benchmarks (microbenchmarks, end-to-end and load against
+local Serper/Gemini stubs) and write a JSON report:
+    python benchmark_suite.py --output benchmark_results.json
+
+Fail on regressions against a stored report:
+    python benchmark_suite.py --baseline benchmark_baseline.json
+
+Other suites: --suite startup|async|recall|batch|all
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Add current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import chroma_manager
+from benchmark_stubs import StubServer
+from test_config import TEST_CONFIG
+
+WORDS = (
+    "battery cell energy density cloud migration cost uptime quantum processor qubit compliance "
+    "regulation market share revenue growth supply chain logistics sensor platform analytics "
+    "security threat detection hydrogen storage efficiency satellite contract robotics navigation"
+).split()
+
+def benchmark_startup(agents=3):
+    """Cold start: build several agents and count how often the embedding model is loaded"""
+    chroma_manager.reset_registry()
+    model_loads = []
+    real_loader = chroma_manager.SentenceTransformer
+
+    def counting_loader(model_name, *args, **kwargs):
+        model_loads.append(model_name)
+        return real_loader(model_name, *args, **kwargs)
+
+    chroma_manager.SentenceTransformer = counting_loader
+    try:
+        start = time.perf_counter()
+        from free_contextual_agent import FreeContextualAgent
+        import_seconds = time.perf_counter() - start
+
+        init_seconds = []
+        for _ in range(agents):
+            start = time.perf_counter()
+            chroma_manager.initialize_sample_data()
+            FreeContextualAgent()
+            init_seconds.append(time.perf_counter() - start)
+    finally:
+        chroma_manager.SentenceTransformer = real_loader
+
+    return {
+        "model_loads": len(model_loads),
+        "import_seconds": round(import_seconds, 4),
+        "first_agent_seconds": round(init_seconds[0], 4),
+        "warm_agent_seconds": round(sum(init_seconds[1:]) / max(len(init_seconds) - 1, 1), 4)
+    }
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(np.ceil(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def latency_summary(durations):
+    """n, mean and p50/p95/p99 in milliseconds for durations in seconds"""
+    millis = [duration * 1000 for duration in durations]
+    return {
+        "n": len(millis),
+        "mean_ms": round(sum(millis) / len(millis), 3) if millis else 0.0,
+        "p50_ms": round(percentile(millis, 50), 3),
+        "p95_ms": round(percentile(millis, 95), 3),
+        "p99_ms": round(percentile(millis, 99), 3)
+    }
+
+def time_calls(function, arguments, warmup=()):
+    """Durations in seconds of function(argument) for each argument, after untimed warmup calls"""
+    for argument in warmup:
+        function(argument)
+    durations = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(argument)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def synthetic_documents(count, seed=11, words=40):
+    """Reproducible pseudo-documents drawn from a small domain vocabulary"""
+    rng = random.Random(seed)
+    return [f"Report {i}: " + " ".join(rng.choice(WORDS) for _ in range(words)) for i in range(count)]
+
+def synthetic_questions(count, seed=13):
+    """Distinct questions, so caches don't hide the work being measured"""
+    rng = random.Random(seed)
+    return [f"What is the latest on our {rng.choice(WORDS)} {rng.choice(WORDS)} work, case {i}?" for i in range(count)]
+
+def synthetic_corpus(documents=5000, queries=200, dim=384, clusters=50, seed=7):
+    """Clustered unit vectors shaped like sentence embeddings, plus queries near random documents"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    corpus = centers[rng.integers(clusters, size=documents)] + rng.normal(scale=0.6, size=(documents, dim))
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    probes = corpus[rng.integers(documents, size=queries)] + rng.normal(scale=0.3, size=(queries, dim))
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+    return corpus.astype(np.float32), probes.astype(np.float32)
+
+def benchmark_recall_latency(documents=5000, queries=200, k=10, dim=384, profiles=None):
+    """Recall@k against exact search and query latency for each retrieval profile"""
+    corpus, probes = synthetic_corpus(documents, queries, dim)
+    # Exact top-k by brute-force cosine similarity
+    truth = np.argsort(-(probes @ corpus.T), axis=1)[:, :k]
+    ids = [f"doc{i}" for i in range(documents)]
+
+    results = {}
+    for profile in profiles or list(chroma_manager.RETRIEVAL_PROFILES):
+        db_path = tempfile.mkdtemp(prefix="bench_chroma_")
+        try:
+            client = chroma_manager.chromadb.PersistentClient(path=db_path)
+            start = time.perf_counter()
+            collection = client.create_collection("recall_bench", metadata=chroma_manager.collection_metadata(profile))
+            for offset in range(0, documents, 1000):
+                collection.add(ids=ids[offset:offset + 1000], embeddings=corpus[offset:offset + 1000].tolist())
+            build_seconds = time.perf_counter() - start
+
+            n_candidates = chroma_manager.candidate_count(k, documents, profile)
+            latencies = []
+            recalls = []
+            for probe, expected in zip(probes, truth):
+                start = time.perf_counter()
+                found = collection.query(query_embeddings=[probe.tolist()], n_results=n_candidates, include=[])
+                latencies.append((time.perf_counter() - start) * 1000)
+                top = {int(doc_id[3:]) for doc_id in found['ids'][0][:k]}
+                recalls.append(len(top & set(expected.tolist())) / k)
+        finally:
+            shutil.rmtree(db_path, ignore_errors=True)
+
+        results[profile] = {
+            "recall_at_k": round(float(np.mean(recalls)), 4),
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "build_seconds": round(build_seconds, 2),
+            "candidates": n_candidates
+        }
+    return {"documents": documents, "queries": queries, "k": k, "profiles": results}
+
+class StubSearcher:
+    """Local stand-in for FreeSearchClient with a fixed network latency"""
+
+    def __init__(self, latency=0.2):
+        self.latency = latency
+        self.calls = 0
+
+    def records(self, question):
+        self.calls += 1
+        return [{"title": f"Web result for {question}", "snippet": "Stub snippet", "url": "https://stub.local/1", "rank": 1, "score": 1.0}]
+
+    def search(self, question):
+        time.sleep(self.latency)
+        return self.records(question)
+
+    async def asearch(self, question):
+        await asyncio.sleep(self.latency)
+        return self.records(question)
+
+class StubAI:
+    """Local stand-in for FreeAIClient with fixed intent and synthesis latencies"""
+
+    use_api = False
+    intent = '{"needs_web": true, "needs_internal": true}'
+
+    def __init__(self, intent_latency=0.3, synthesis_latency=1.0):
+        self.intent_latency = intent_latency
+        self.synthesis_latency = synthesis_latency
+
+    def analyze_intent(self, question):
+        time.sleep(self.intent_latency)
+        return self.intent
+
+    async def aanalyze_intent(self, question):
+        await asyncio.sleep(self.intent_latency)
+        return self.intent
+
+    def synthesize_answer(self, question, web_data, internal_data):
+        time.sleep(self.synthesis_latency)
+        return f"Report for {question}"
+
+    async def asynthesize_answer(self, question, web_data, internal_data):
+        await asyncio.sleep(self.synthesis_latency)
+        return f"Report for {question}"
+
+class StubChroma:
+    """In-memory stand-in for ChromaManager"""
+
+    def hybrid_search(self, query, n_results=5, filters=None):
+        return [{"content": f"Internal note on {query}", "metadata": {}, "score": 1.0}]
+
+    def batch_hybrid_search(self, queries, n_results=5, filters=None):
+        return [self.hybrid_search(query) for query in queries]
+
+    def get_collection_stats(self):
+        return 1
+
+def benchmark_async_throughput(requests=40, serper_latency=0.2, gemini_latency=0.5):
+    """Load test: sequential process_query vs concurrent aprocess_query on the real clients
+
+    FreeSearchClient and FreeAIClient talk HTTP to local Serper/Gemini stubs,
+    so the result includes the blocking client calls and the executor that
+    runs them; peak_*_in_flight shows how many calls actually overlapped.
+    """
+    with local_stubs(serper_latency, gemini_latency) as (serper, gemini):
+        agent = make_stub_agent(StubChroma())
+
+        # A sequential baseline over every request would take minutes; time a sample
+        sample = [f"Sequential question {i}" for i in range(min(3, requests))]
+        start = time.perf_counter()
+        for question in sample:
+            agent.process_query(question)
+        sequential_rps = len(sample) / (time.perf_counter() - start)
+
+        questions = [f"Concurrent question {i}" for i in range(requests)]
+
+        async def run_all():
+            return await asyncio.gather(*(agent.aprocess_query(question) for question in questions))
+
+        start = time.perf_counter()
+        asyncio.run(run_all())
+        async_seconds = time.perf_counter() - start
+        async_rps = requests / async_seconds
+
+        return {
+            "requests": requests,
+            "sequential_rps": round(sequential_rps, 2),
+            "async_rps": round(async_rps, 2),
+            "async_seconds": round(async_seconds, 3),
+            "speedup": round(async_rps / sequential_rps, 1),
+            "peak_serper_in_flight": serper.peak_in_flight,
+            "peak_gemini_in_flight": gemini.peak_in_flight
+        }
+
+def benchmark_batch_throughput(sizes=(8, 32, 128), topics=16, intent_latency=0.05, search_latency=0.2, synthesis_latency=0.2):
+    """Throughput of process_batch by batch size against a process_query loop, on local stubs
+
+    Questions cycle through a fixed set of topics, so larger batches repeat
+    web queries the way nightly reports do.
+    """
+    from free_contextual_agent import FreeContextualAgent
+
+    def make_agent():
+        return FreeContextualAgent(
+            searcher=StubSearcher(search_latency),
+            ai=StubAI(intent_latency, synthesis_latency),
+            chroma=StubChroma()
+        )
+
+    sample = [f"Question about topic {i}" for i in range(3)]
+    agent = make_agent()
+    start = time.perf_counter()
+    for question in sample:
+        agent.process_query(question)
+    loop_rps = len(sample) / (time.perf_counter() - start)
+
+    batches = {}
+    for size in sizes:
+        agent = make_agent()
+        questions = [f"Question about topic {i % topics}" for i in range(size)]
+        start = time.perf_counter()
+        completed = sum(1 for _ in agent.process_batch(questions))
+        seconds = time.perf_counter() - start
+        batches[size] = {
+            "rps": round(completed / seconds, 2),
+            "seconds": round(seconds, 3),
+            "web_searches": agent.searcher.calls
+        }
+    return {"loop_rps": round(loop_rps, 2), "batches": batches}
+
+def benchmark_chroma(db_path, documents=500, batch=100, queries=100):
+    """add_documents per batch, then search and hybrid_search per query"""
+    manager = chroma_manager.ChromaManager(db_path=db_path, collection_name="benchmark_kb")
+    corpus = synthetic_documents(documents)
+    batches = [corpus[offset:offset + batch] for offset in range(0, documents, batch)]
+    add = time_calls(manager.add_documents, batches)
+    questions = synthetic_questions(queries)
+    # The query embedding cache would hide encoding cost; use a different question set per method
+    search = time_calls(manager.search, questions, warmup=["warmup"])
+    hybrid = time_calls(manager.hybrid_search, synthetic_questions(queries, seed=17))
+    results = {
+        "add_documents": dict(latency_summary(add), batch=batch, docs_per_second=round(documents / sum(add), 1)),
+        "search": latency_summary(search),
+        "hybrid_search": latency_summary(hybrid)
+    }
+    return results, manager
+
+def benchmark_mock_clients(queries=200):
+    """FreeSearchClient.enhanced_mock_search and FreeAIClient._enhanced_mock_intent"""
+    from free_search_client import FreeSearchClient
+    from free_ai_client import FreeAIClient
+
+    questions = synthetic_questions(queries)
+    searcher = FreeSearchClient()
+    ai = FreeAIClient()
+    return {
+        "enhanced_mock_search": latency_summary(time_calls(searcher.enhanced_mock_search, questions, warmup=questions[:2])),
+        "mock_intent": latency_summary(time_calls(ai._enhanced_mock_intent, questions, warmup=questions[:2]))
+    }
+
+@contextmanager
+def local_stubs(serper_latency=0.05, gemini_latency=0.15):
+    """Point FreeSearchClient and FreeAIClient at local Serper and Gemini stubs
+
+    Yields (serper, gemini) StubServers. Clients created inside the block
+    use the stubs over real HTTP; the search result cache is disabled so
+    every search reaches the stub.
+    """
+    import free_search_client
+    import free_ai_client
+
+    saved_env = {key: os.environ.get(key) for key in ('SERPER_API_KEY', 'GEMINI_API_KEY')}
+    saved = (free_search_client.SERPER_URL, free_search_client.SEARCH_CACHE_PATH, free_ai_client.GEMINI_API_ENDPOINT)
+    with StubServer(serper_latency) as serper, StubServer(gemini_latency) as gemini:
+        os.environ.update(SERPER_API_KEY='benchmark-stub', GEMINI_API_KEY='benchmark-stub')
+        free_search_client.SERPER_URL = f"{serper.url}/search"
+        free_search_client.SEARCH_CACHE_PATH = ''
+        free_ai_client.GEMINI_API_ENDPOINT = gemini.url
+        try:
+            yield serper, gemini
+        finally:
+            free_search_client.SERPER_URL, free_search_client.SEARCH_CACHE_PATH, free_ai_client.GEMINI_API_ENDPOINT = saved
+            for key, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+def make_stub_agent(manager):
+    """Agent on the real clients (inside local_stubs) with free-tier pacing lifted"""
+    from free_contextual_agent import FreeContextualAgent
+    from free_search_client import FreeSearchClient
+    from free_ai_client import FreeAIClient
+    from rate_limiter import RateLimiter
+
+    ai = FreeAIClient()
+    # Measure the pipeline, not the 60 RPM quota
+    ai.rate_limiter = RateLimiter(rpm=1e6, tpm=1e9, burst=1e4)
+    return FreeContextualAgent(searcher=FreeSearchClient(), ai=ai, chroma=manager)
+
+def load_test(agent, users, requests_per_user):
+    """Closed-loop load generator: each of `users` threads sends requests back to back"""
+    durations = []
+    errors = []
+    lock = threading.Lock()
+
+    def user(user_id):
+        for request in range(requests_per_user):
+            question = f"Latest market trends versus our internal research, user {user_id} request {request}"
+            start = time.perf_counter()
+            try:
+                agent.process_query(question)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                durations.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(user, range(users)))
+    seconds = time.perf_counter() - start
+    return dict(latency_summary(durations), users=users, errors=len(errors), rps=round(len(durations) / seconds, 2))
+
+def run_benchmarks(quick=False):
+    """Microbenchmarks, end-to-end process_query and a load test; returns a JSON-ready report"""
+    performance = TEST_CONFIG["performance"]
+    scale = 5 if quick else 1
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    saved_cache_path = os.environ.get('EMBEDDING_CACHE_PATH')
+    os.environ['EMBEDDING_CACHE_PATH'] = os.path.join(work_dir, "embedding_cache")
+    try:
+        results, manager = benchmark_chroma(os.path.join(work_dir, "chroma"), 500 // scale, 100 // scale, 100 // scale)
+        results.update(benchmark_mock_clients(200 // scale))
+        with local_stubs() as (serper, gemini):
+            agent = make_stub_agent(manager)
+            end_to_end = time_calls(agent.process_query, synthetic_questions(20 // scale, seed=19), warmup=["Warm up question"])
+            results["process_query"] = latency_summary(end_to_end)
+            results["load"] = load_test(agent, performance["concurrent_users"], 10 // scale)
+            results["stub_requests"] = {"serper": serper.requests, "gemini": gemini.requests}
+    finally:
+        if saved_cache_path is None:
+            os.environ.pop('EMBEDDING_CACHE_PATH', None)
+        else:
+            os.environ['EMBEDDING_CACHE_PATH'] = saved_cache_path
+        chroma_manager.reset_registry()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    max_ms = performance["max_response_time"] * 1000
+    results["process_query"]["within_max_response_time"] = results["process_query"]["p99_ms"] <= max_ms
+    results["load"]["within_max_response_time"] = results["load"]["p99_ms"] <= max_ms
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "quick": quick,
+            "max_response_time_s": performance["max_response_time"],
+            "concurrent_users": performance["concurrent_users"]
+        },
+        "results": results
+    }
+
+def compare_to_baseline(report, baseline, tolerance=0.2, min_delta_ms=1.0):
+    """Percentiles that got slower than the baseline by more than tolerance (and min_delta_ms)"""
+    regressions = []
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if metric not in current or metric not in previous:
+                continue
+            before, after = previous[metric], current[metric]
+            if after - before > max(before * tolerance, min_delta_ms):
+                regressions.append({
+                    "benchmark": name,
+                    "metric": metric,
+                    "baseline": before,
+                    "current": after,
+                    "change": round(after / before - 1, 3) if before else None
+                })
+    return regressions
+
+def run_legacy_suite(suite):
+    if suite in ("startup", "all"):
+        print("⚡ Running startup benchmark...")
+        startup = benchmark_startup()
+        print(json.dumps(startup, indent=2))
+        if startup["model_loads"] == 1:
+            print("✅ Embedding model loaded exactly once")
+        else:
+            print(f"❌ Embedding model loaded {startup['model_loads']} times")
+    if suite in ("async", "all"):
+        print("\n⚡ Running async throughput load test...")
+        print(json.dumps(benchmark_async_throughput(), indent=2))
+    if suite in ("recall", "all"):
+        print("\n⚡ Running recall@k vs latency benchmark per retrieval profile...")
+        print(json.dumps(benchmark_recall_latency(), indent=2))
+    if suite in ("batch", "all"):
+        print("\n⚡ Running batch throughput benchmark...")
+        print(json.dumps(benchmark_batch_throughput(), indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Research pipeline benchmarks")
+    parser.add_argument("--suite", default="pipeline", choices=["pipeline", "startup", "async", "recall", "batch", "all"])
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the pipeline report")
+    parser.add_argument("--baseline", help="pipeline report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown per percentile, 0.2 = 20%%")
+    parser.add_argument("--quick", action="store_true", help="smaller workloads for a fast smoke run")
+    args = parser.parse_args()
+
+    run_legacy_suite(args.suite)
+    if args.suite in ("pipeline", "all"):
+        print("\n⚡ Running pipeline benchmarks against local stubs...")
+        report = run_benchmarks(quick=args.quick)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(json.dumps(report["results"], indent=2))
+        print(f"📄 Report written to {args.output}")
+
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+            if regressions:
+                for regression in regressions:
+                    print(f"❌ {regression['benchmark']} {regression['metric']}: "
+                          f"{regression['baseline']}ms -> {regression['current']}ms")
+                sys.exit(1)
+            print(f"✅ No regressions against {args.baseline}")
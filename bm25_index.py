@@ -0,0 +1,166 @@
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter
+from journal import Journal
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-']\w+)*")
+
+def tokenize(text):
+    """Lower-cased word tokens; keeps figures like 2.5 and names like solid-state intact"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """On-disk BM25 inverted index kept next to the Chroma collection
+
+    save() appends the documents changed since the last save to a journal
+    and only rewrites the full snapshot when the journal outgrows it. The
+    postings stay in memory for search. With path=None the index lives in
+    memory only.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.RLock()
+        self.doc_terms = {}      # doc_id -> {term: tf}
+        self.doc_lengths = {}    # doc_id -> token count
+        self.postings = {}       # term -> {doc_id: tf}
+        self.total_length = 0
+        self.journal = Journal(path)
+        self.changed = set()     # doc_ids added or removed since the last save
+        self.load()
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_terms
+
+    def add(self, doc_id, text):
+        """Index (or re-index) a document"""
+        tokens = tokenize(text)
+        with self.lock:
+            self._set(doc_id, dict(Counter(tokens)), len(tokens))
+            self.changed.add(doc_id)
+
+    def remove(self, doc_id):
+        """Drop a document from the index"""
+        with self.lock:
+            self._drop(doc_id)
+            self.changed.add(doc_id)
+
+    def _set(self, doc_id, term_freqs, length):
+        if doc_id in self.doc_terms:
+            self._drop(doc_id)
+        self.doc_terms[doc_id] = term_freqs
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+        for term, tf in term_freqs.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def _drop(self, doc_id):
+        term_freqs = self.doc_terms.pop(doc_id, None)
+        if term_freqs is None:
+            return
+        self.total_length -= self.doc_lengths.pop(doc_id, 0)
+        for term in term_freqs:
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+
+    def search(self, query, n_results=10, candidate_ids=None):
+        """Return [(doc_id, score)] ordered by BM25 score"""
+        with self.lock:
+            n_docs = len(self.doc_terms)
+            if not n_docs:
+                return []
+            avg_length = self.total_length / n_docs or 1.0
+            scores = {}
+            for term in set(tokenize(query)):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                if candidate_ids is None:
+                    matches = docs.items()
+                elif len(candidate_ids) < len(docs):
+                    # Small filtered subsets: probe the postings per candidate instead of scanning them
+                    matches = [(doc_id, docs[doc_id]) for doc_id in candidate_ids if doc_id in docs]
+                else:
+                    matches = [(doc_id, tf) for doc_id, tf in docs.items() if doc_id in candidate_ids]
+                for doc_id, tf in matches:
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:n_results]
+
+    def save(self, compact=False):
+        """Persist changes since the last save; compact=True rewrites the snapshot"""
+        if not self.path:
+            return
+        with self.lock:
+            if not self.changed and not compact:
+                return
+            self.journal.append([
+                {"id": doc_id, "terms": self.doc_terms.get(doc_id), "length": self.doc_lengths.get(doc_id, 0)}
+                for doc_id in self.changed
+            ])
+            self.changed.clear()
+            if compact or self.journal.should_compact(len(self.doc_terms)):
+                self.journal.write_snapshot({"k1": self.k1, "b": self.b, "docs": self.doc_terms, "lengths": self.doc_lengths})
+
+    def load(self):
+        """Load the snapshot and replay the journal, if they exist"""
+        if not self.path:
+            return
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Could not load BM25 index, rebuilding: {e}")
+                return
+        with self.lock:
+            self.doc_terms, self.doc_lengths, self.postings, self.total_length = {}, {}, {}, 0
+            lengths = data.get("lengths", {})
+            for doc_id, term_freqs in data.get("docs", {}).items():
+                self._set(doc_id, term_freqs, lengths.get(doc_id, sum(term_freqs.values())))
+            for entry in self.journal.replay():
+                if entry["terms"] is None:
+                    self._drop(entry["id"])
+                else:
+                    self._set(entry["id"], entry["terms"], entry["length"])
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse several ranked id lists into {doc_id: score}"""
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return fused
+
+def weighted_fusion(vector_scores, keyword_scores, alpha=0.5):
+    """Min-max normalise both score maps and blend them; alpha weights the vector side"""
+    def normalise(scores):
+        if not scores:
+            return {}
+        low, high = min(scores.values()), max(scores.values())
+        span = high - low
+        if not span:
+            return {doc_id: 1.0 for doc_id in scores}
+        return {doc_id: (score - low) / span for doc_id, score in scores.items()}
+
+    vector_norm = normalise(vector_scores)
+    keyword_norm = normalise(keyword_scores)
+    return {
+        doc_id: alpha * vector_norm.get(doc_id, 0.0) + (1 - alpha) * keyword_norm.get(doc_id, 0.0)
+        for doc_id in set(vector_norm) | set(keyword_norm)
+    }
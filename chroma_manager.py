@@ -1,71 +1,580 @@
 import os
+import json
+import hashlib
+import threading
+from itertools import islice, repeat, tee
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import chromadb
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
+from bm25_index import BM25Index, reciprocal_rank_fusion, weighted_fusion
+from metadata_index import MetadataIndex, to_where
+from chunker import iter_chunks, DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS
+from caching import LRUCache, normalize_text
+from embedding_store import EmbeddingStore
+from journal import Journal
+import tracing
 
 load_dotenv()
 
+DEFAULT_EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+DEFAULT_COLLECTION = 'knowledge_base'
+DEFAULT_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '64'))
+# Metadata fields a question can name to narrow internal search, e.g. "project Ares"
+FILTER_FIELDS = [field.strip() for field in os.getenv('FILTER_FIELDS', 'project,quarter,region').split(',') if field.strip()]
+# Score multiplier per facet a question mentions without naming its field, e.g. "quantum advances"
+FACET_BOOST = float(os.getenv('FACET_BOOST', '1.5'))
+
+# Named HNSW settings trading recall for latency. The hnsw:* keys are fixed
+# when a collection is created; candidate_multiplier and min_candidates size
+# the vector over-fetch per query (hnswlib searches with ef = max(search_ef, k),
+# so a larger fetch also widens the search).
+RETRIEVAL_PROFILES = {
+    "fast": {
+        "hnsw:space": "cosine", "hnsw:M": 8, "hnsw:construction_ef": 64, "hnsw:search_ef": 16,
+        "candidate_multiplier": 2, "min_candidates": 10
+    },
+    "balanced": {
+        "hnsw:space": "cosine", "hnsw:M": 16, "hnsw:construction_ef": 128, "hnsw:search_ef": 64,
+        "candidate_multiplier": 4, "min_candidates": 20
+    },
+    "high-recall": {
+        "hnsw:space": "cosine", "hnsw:M": 32, "hnsw:construction_ef": 256, "hnsw:search_ef": 256,
+        "candidate_multiplier": 8, "min_candidates": 50
+    }
+}
+DEFAULT_PROFILE = os.getenv('RETRIEVAL_PROFILE', 'balanced')
+
+# Process-wide registry so the embedding model and Chroma client are loaded once
+_registry_lock = threading.Lock()
+# Separate from _registry_lock: building a manager takes that lock for its client and embedder
+_manager_lock = threading.Lock()
+_embedders = {}
+_clients = {}
+_managers = {}
+_embedding_stores = {}
+
+# Query embeddings are shared across managers, keyed by (model name, normalized query)
+query_embedding_cache = LRUCache(
+    maxsize=int(os.getenv('QUERY_CACHE_SIZE', '512')),
+    ttl=float(os.getenv('QUERY_CACHE_TTL', '0')) or None
+)
+
+def get_embedder(model_name=DEFAULT_EMBEDDING_MODEL):
+    """Return the shared SentenceTransformer for model_name, loading it on first use"""
+    with _registry_lock:
+        embedder = _embedders.get(model_name)
+        if embedder is None:
+            embedder = SentenceTransformer(model_name)
+            _embedders[model_name] = embedder
+        return embedder
+
+def embed_query(query, model_name=DEFAULT_EMBEDDING_MODEL):
+    """Encode a query with the shared embedder, reusing cached embeddings for repeated questions"""
+    key = (model_name, normalize_text(query))
+    with tracing.span("embedding", queries=1) as span:
+        embedding = query_embedding_cache.get(key)
+        span.set(cache="miss" if embedding is None else "hit")
+        if embedding is None:
+            embedding = get_embedder(model_name).encode([query]).tolist()[0]
+            query_embedding_cache.set(key, embedding)
+    return embedding
+
+def embed_queries(queries, model_name=DEFAULT_EMBEDDING_MODEL):
+    """embed_query for many queries; every uncached one is encoded in a single call"""
+    keys = [(model_name, normalize_text(query)) for query in queries]
+    embeddings = [query_embedding_cache.get(key) for key in keys]
+    missing = {}
+    for i, (key, embedding) in enumerate(zip(keys, embeddings)):
+        if embedding is None:
+            missing.setdefault(key, []).append(i)
+    with tracing.span("embedding", queries=len(queries), cache="miss" if missing else "hit") as span:
+        if missing:
+            span.set(encoded=len(missing))
+            encoded = get_embedder(model_name).encode([queries[rows[0]] for rows in missing.values()]).tolist()
+            for (key, rows), embedding in zip(missing.items(), encoded):
+                query_embedding_cache.set(key, embedding)
+                for i in rows:
+                    embeddings[i] = embedding
+    return embeddings
+
+def get_client(db_path=None):
+    """Return the shared PersistentClient for db_path"""
+    db_path = os.path.abspath(db_path or os.getenv('CHROMA_DB_PATH', './chroma_db'))
+    with _registry_lock:
+        client = _clients.get(db_path)
+        if client is None:
+            client = chromadb.PersistentClient(path=db_path)
+            _clients[db_path] = client
+        return client
+
+def get_embedding_store(model_name=DEFAULT_EMBEDDING_MODEL, directory=None):
+    """Return the shared persistent embedding cache, or None when disabled
+    
+    EMBEDDING_CACHE_PATH (default ./embedding_cache) sets the directory; an
+    empty value disables the cache.
+    """
+    if directory is None:
+        directory = os.getenv('EMBEDDING_CACHE_PATH', './embedding_cache')
+    if not directory:
+        return None
+    key = (os.path.abspath(directory), model_name)
+    with _registry_lock:
+        store = _embedding_stores.get(key)
+        if store is None:
+            store = EmbeddingStore(directory, model_name)
+            _embedding_stores[key] = store
+        return store
+
+def get_profile(name=None):
+    """Settings for a retrieval profile; unknown names fall back to balanced"""
+    name = name or DEFAULT_PROFILE
+    if name not in RETRIEVAL_PROFILES:
+        print(f"⚠️ Unknown retrieval profile '{name}', using balanced")
+        name = "balanced"
+    return name, RETRIEVAL_PROFILES[name]
+
+def collection_metadata(profile=None):
+    """Chroma collection metadata that builds the index for a profile"""
+    name, settings = get_profile(profile)
+    metadata = {key: value for key, value in settings.items() if key.startswith("hnsw:")}
+    metadata["retrieval_profile"] = name
+    return metadata
+
+def candidate_count(n_results, total, profile=None):
+    """Vector candidates to fetch for n_results under a profile, capped at total"""
+    _, settings = get_profile(profile)
+    return min(max(n_results * settings["candidate_multiplier"], settings["min_candidates"]), total)
+
+def get_chroma_manager(db_path=None, collection_name=DEFAULT_COLLECTION, model_name=DEFAULT_EMBEDDING_MODEL, profile=None):
+    """Return the shared ChromaManager for (db_path, collection, model)
+    
+    One manager per collection keeps its keyword, metadata and manifest
+    files consistent. profile only applies when the manager is first
+    created; pass profile to hybrid_search to change the over-fetch per query.
+    """
+    key = (os.path.abspath(db_path or os.getenv('CHROMA_DB_PATH', './chroma_db')), collection_name, model_name)
+    with _manager_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = ChromaManager(db_path=db_path, collection_name=collection_name, model_name=model_name, profile=profile)
+            _managers[key] = manager
+        return manager
+
+def reset_registry():
+    """Drop all shared embedders, clients and managers (used by tests and benchmarks)"""
+    with _manager_lock:
+        _managers.clear()
+    with _registry_lock:
+        _embedders.clear()
+        _clients.clear()
+        _embedding_stores.clear()
+    query_embedding_cache.clear()
+
+def content_hash(text):
+    """SHA-256 of a document's text"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def make_document_id(text, source_path=None, chunk_index=None):
+    """Stable document ID
+    
+    Documents with a source path are keyed by that path (and chunk index),
+    so an edited file replaces its previous version; documents without one
+    are keyed by their content hash.
+    """
+    if source_path:
+        key = f"path:{source_path}" if chunk_index is None else f"path:{source_path}#{chunk_index}"
+        return "doc_" + hashlib.sha256(key.encode('utf-8')).hexdigest()[:24]
+    return "doc_" + content_hash(text)[:24]
+
+class IngestManifest:
+    """Maps document ID -> content hash for everything already embedded
+    
+    Saves are journaled like the keyword index, so a save writes only the
+    IDs recorded or forgotten since the previous one.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.hashes = {}
+        self.journal = Journal(path)
+        self.changed = set()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.hashes = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Could not load ingest manifest: {e}")
+                return
+        for entry in self.journal.replay():
+            if entry["hash"] is None:
+                self.hashes.pop(entry["id"], None)
+            else:
+                self.hashes[entry["id"]] = entry["hash"]
+    
+    def is_current(self, doc_id, digest):
+        return self.hashes.get(doc_id) == digest
+    
+    def record(self, doc_id, digest):
+        self.hashes[doc_id] = digest
+        self.changed.add(doc_id)
+    
+    def forget(self, doc_id):
+        self.hashes.pop(doc_id, None)
+        self.changed.add(doc_id)
+    
+    def save(self):
+        if not self.changed:
+            return
+        self.journal.append([{"id": doc_id, "hash": self.hashes.get(doc_id)} for doc_id in self.changed])
+        self.changed.clear()
+        if self.journal.should_compact(len(self.hashes)):
+            self.journal.write_snapshot(self.hashes)
+
 class ChromaManager:
-    def __init__(self):
-        self.db_path = os.getenv('CHROMA_DB_PATH', './chroma_db')
-        self.client = chromadb.PersistentClient(path=self.db_path)
-        self.embedder = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, db_path=None, collection_name=DEFAULT_COLLECTION, model_name=DEFAULT_EMBEDDING_MODEL, profile=None):
+        self.db_path = db_path or os.getenv('CHROMA_DB_PATH', './chroma_db')
+        self.model_name = model_name
+        self.profile = get_profile(profile)[0]
+        self.client = get_client(self.db_path)
+        self.embedder = get_embedder(model_name)
+        self.embedding_store = get_embedding_store(model_name)
         
-        self.collection = self.client.get_or_create_collection("knowledge_base")
+        # Index parameters only apply when the collection is created; an
+        # existing collection keeps the ones it was built with (passing
+        # metadata to get_or_create_collection would overwrite its record)
+        try:
+            self.collection = self.client.get_collection(collection_name)
+        except ValueError:
+            self.collection = self.client.get_or_create_collection(collection_name, metadata=collection_metadata(self.profile))
+        built_with = (self.collection.metadata or {}).get("retrieval_profile")
+        if built_with != self.profile:
+            print(f"ℹ️  Collection '{collection_name}' index was built with profile {built_with or 'default'}; "
+                  f"call rebuild_index() to apply {self.profile} index settings")
+        self.bm25 = BM25Index(os.path.join(self.db_path, f"bm25_{collection_name}.json"))
+        self.metadata_index = MetadataIndex(os.path.join(self.db_path, f"metadata_{collection_name}.json"))
+        self.manifest = IngestManifest(os.path.join(self.db_path, f"manifest_{collection_name}.json"))
+        if len(self.bm25) < self.collection.count() or len(self.metadata_index) < self.collection.count():
+            self.rebuild_keyword_index()
         print("✅ ChromaDB initialized successfully!")
     
-    def add_documents(self, documents, metadatas=None, ids=None):
-        """Add documents to ChromaDB"""
-        if not documents:
-            return
+    def rebuild_keyword_index(self, batch_size=1000):
+        """Rebuild the BM25 and metadata indexes from the collection, a page at a time"""
+        for offset in range(0, self.collection.count(), batch_size):
+            stored = self.collection.get(include=['documents', 'metadatas'], limit=batch_size, offset=offset)
+            for doc_id, doc, metadata in zip(stored['ids'], stored['documents'], stored['metadatas']):
+                self.bm25.add(doc_id, doc or "")
+                self.metadata_index.add(doc_id, metadata)
+        self.bm25.save(compact=True)
+        self.metadata_index.save(compact=True)
+    
+    def rebuild_index(self, profile=None, batch_size=1000):
+        """Re-create the collection with a profile's HNSW settings, reusing the stored embeddings
         
-        embeddings = self.embedder.encode(documents).tolist()
+        The copy is built under a temporary name. The original is renamed
+        aside, the copy takes its name, and only then is the original
+        dropped; if the swap fails the original gets its name back.
+        Run it while nothing is ingesting into the collection.
+        """
+        profile = get_profile(profile or self.profile)[0]
+        name = self.collection.name
+        temp_name = f"{name}_rebuild"
+        previous_name = f"{name}_previous"
+        for stale in (temp_name, previous_name):
+            try:
+                self.client.delete_collection(stale)
+            except ValueError:
+                pass
+        rebuilt = self.client.create_collection(temp_name, metadata=collection_metadata(profile))
+        for offset in range(0, self.collection.count(), batch_size):
+            batch = self.collection.get(include=['embeddings', 'documents', 'metadatas'], limit=batch_size, offset=offset)
+            if batch['ids']:
+                rebuilt.add(ids=batch['ids'], embeddings=batch['embeddings'],
+                            documents=batch['documents'], metadatas=batch['metadatas'])
+        self.collection.modify(name=previous_name)
+        try:
+            rebuilt.modify(name=name)
+        except Exception:
+            self.collection.modify(name=name)
+            raise
+        self.client.delete_collection(previous_name)
+        self.collection = rebuilt
+        self.profile = profile
+        print(f"✅ Rebuilt '{name}' with {profile} index settings ({rebuilt.count()} documents)")
+        return self.get_index_settings()
+    
+    def add_documents(self, documents, metadatas=None, ids=None, batch_size=None):
+        """Upsert documents into ChromaDB, skipping ones that are unchanged
         
-        if not ids:
-            ids = [f"doc_{i}" for i in range(len(documents))]
+        documents, metadatas and ids may be any iterables (e.g. generators).
+        They are consumed in batches of batch_size; each batch is written on a
+        background thread while the next one is being encoded, so at most two
+        batches are held in memory at a time.
+        
+        Without explicit ids, IDs come from make_document_id using the
+        metadata 'path' when present. Documents whose content hash matches
+        the ingest manifest are not re-embedded.
+        """
+        batch_size = batch_size or DEFAULT_BATCH_SIZE
+        records = zip(
+            documents,
+            metadatas if metadatas is not None else repeat(None),
+            ids if ids is not None else repeat(None)
+        )
+        stats = {"skipped": 0}
+        changed = self._changed_records(records, stats)
         
-        self.collection.add(
+        added = 0
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            while True:
+                batch = list(islice(changed, batch_size))
+                if not batch:
+                    break
+                batch_docs, batch_metadatas, batch_ids, batch_hashes = (list(column) for column in zip(*batch))
+                embeddings = self._encode_documents(batch_docs, batch_hashes)
+                if pending is not None:
+                    pending.result()
+                pending = writer.submit(self._write_batch, batch_docs, batch_metadatas, batch_ids, batch_hashes, embeddings)
+                added += len(batch_docs)
+            if pending is not None:
+                pending.result()
+        
+        if added:
+            self.bm25.save()
+            self.metadata_index.save()
+            self.manifest.save()
+            print(f"✅ Added {added} documents to knowledge base")
+        if stats["skipped"]:
+            print(f"ℹ️  Skipped {stats['skipped']} unchanged documents")
+        return added
+    
+    def _encode_documents(self, documents, hashes):
+        """Encode documents, reusing vectors from the persistent embedding cache"""
+        if self.embedding_store is None:
+            return self.embedder.encode(documents).tolist()
+        
+        cached = self.embedding_store.get_many(hashes)
+        missing = [i for i in range(len(documents)) if i not in cached]
+        if missing:
+            encoded = self.embedder.encode([documents[i] for i in missing])
+            self.embedding_store.put_many([hashes[i] for i in missing], encoded)
+            cached.update(zip(missing, encoded))
+        return np.stack([cached[i] for i in range(len(documents))]).astype(np.float32).tolist()
+    
+    def _changed_records(self, records, stats):
+        """Yield (doc, metadata, id, hash) for new or modified documents only"""
+        seen = set()
+        for doc, metadata, doc_id in records:
+            digest = content_hash(doc)
+            if doc_id is None:
+                doc_id = make_document_id(doc, (metadata or {}).get('path'), (metadata or {}).get('chunk_index'))
+            if doc_id in seen or self.manifest.is_current(doc_id, digest):
+                stats["skipped"] += 1
+                continue
+            seen.add(doc_id)
+            yield doc, dict(metadata or {}, content_hash=digest), doc_id, digest
+    
+    def _write_batch(self, documents, metadatas, ids, hashes, embeddings):
+        """Write one encoded batch to the collection, keyword index and manifest"""
+        self.collection.upsert(
             embeddings=embeddings,
             documents=documents,
-            metadatas=metadatas or [{}] * len(documents),
+            metadatas=metadatas,
             ids=ids
         )
-        print(f"✅ Added {len(documents)} documents to knowledge base")
+        for doc_id, doc, metadata, digest in zip(ids, documents, metadatas, hashes):
+            self.bm25.add(doc_id, doc)
+            self.metadata_index.add(doc_id, metadata)
+            self.manifest.record(doc_id, digest)
     
-    def search(self, query, n_results=5):
-        """Enhanced search with more results"""
-        query_embedding = self.embedder.encode([query]).tolist()
+    def delete_documents(self, ids):
+        """Remove documents from the collection, keyword index and manifest"""
+        if not ids:
+            return
+        self.collection.delete(ids=ids)
+        for doc_id in ids:
+            self.bm25.remove(doc_id)
+            self.metadata_index.remove(doc_id)
+            self.manifest.forget(doc_id)
+        self.bm25.save()
+        self.metadata_index.save()
+        self.manifest.save()
+    
+    def prune_chunks(self, parent_id, chunk_count):
+        """Delete chunks left over from a longer previous version of a document"""
+        stale = self.collection.get(
+            where={"$and": [{"parent_id": parent_id}, {"chunk_index": {"$gte": chunk_count}}]},
+            include=[]
+        )
+        self.delete_documents(stale['ids'])
+    
+    def embed_query(self, query):
+        """Encode a query, reusing cached embeddings for repeated questions"""
+        return embed_query(query, self.model_name)
+    
+    def get_cache_stats(self):
+        """Hit/miss counters for the query embedding cache"""
+        return query_embedding_cache.stats()
+    
+    def search_many(self, queries, n_results=5, filters=None):
+        """search for several queries sharing filters: one encode call and one multi-query request"""
+        return self.collection.query(
+            query_embeddings=embed_queries(queries, self.model_name),
+            n_results=n_results,
+            where=to_where(filters) if filters else None
+        )
+    
+    def search(self, query, n_results=5, filters=None):
+        """Enhanced search with more results
+        
+        filters maps metadata fields to a value or a list of accepted values,
+        e.g. {"project": "Ares"}; they are pushed down to Chroma as a where clause.
+        """
+        query_embedding = [self.embed_query(query)]
         
         results = self.collection.query(
             query_embeddings=query_embedding,
-            n_results=n_results
+            n_results=n_results,
+            where=to_where(filters) if filters else None
         )
         
         return results
     
-    def hybrid_search(self, query, n_results=5):
-        """Enhanced hybrid search"""
-        results = self.search(query, n_results)
+    def extract_filters(self, text, fields=None):
+        """Metadata filters for facet values a question names, e.g. {"project": "Ares"}"""
+        return self.metadata_index.extract_filters(text, fields or FILTER_FIELDS)
+    
+    def extract_boosts(self, text, fields=None):
+        """Facet values a question mentions without naming the field, used to rank rather than filter"""
+        return self.metadata_index.extract_boosts(text, fields or FILTER_FIELDS)
+    
+    def hybrid_search(self, query, n_results=5, fusion='rrf', alpha=0.5, collapse_chunks=True, filters=None, profile=None, boosts=None):
+        """Hybrid search fusing vector similarity with BM25 keyword matches
+        
+        fusion='rrf' uses reciprocal-rank fusion, fusion='weighted' blends
+        min-max normalised scores with alpha weighting the vector side.
+        With collapse_chunks, only the best-scoring chunk of each parent
+        document is returned. With filters, the metadata index resolves the
+        matching subset first and both retrievers only rank inside it;
+        fields or values the index has never seen are ignored. profile
+        overrides the manager's retrieval profile for this query's
+        candidate over-fetch. boosts ({field: value}) keeps every document
+        but multiplies the score of matching ones by FACET_BOOST per field.
+        """
+        filters, candidate_ids, n_candidates = self._candidates(n_results, filters, profile)
+        if not n_candidates:
+            return []
+        results = self.search(query, n_candidates, filters)
+        return self._fuse(query, results, 0, n_results, n_candidates, candidate_ids, fusion, alpha, collapse_chunks, boosts)
+    
+    def batch_hybrid_search(self, queries, n_results=5, filters=None, fusion='rrf', alpha=0.5, collapse_chunks=True, profile=None, boosts=None):
+        """hybrid_search for many queries at once, returning one result list per query
+        
+        filters and boosts are optional lists aligned with queries. All queries are
+        encoded in one call, and queries sharing the same filters go to
+        Chroma as a single multi-query request.
+        """
+        filters = filters or [None] * len(queries)
+        boosts = boosts or [None] * len(queries)
+        groups = {}
+        for i, query_filters in enumerate(filters):
+            plan = self._candidates(n_results, query_filters, profile)
+            key = json.dumps(plan[0], sort_keys=True)
+            groups.setdefault(key, (plan, []))[1].append(i)
+        
+        embed_queries(queries, self.model_name)    # warm the query cache with a single encode call
+        batch_results = [[] for _ in queries]
+        for (query_filters, candidate_ids, n_candidates), rows in groups.values():
+            if not n_candidates:
+                continue
+            results = self.search_many([queries[i] for i in rows], n_candidates, query_filters)
+            for row, i in enumerate(rows):
+                batch_results[i] = self._fuse(queries[i], results, row, n_results, n_candidates, candidate_ids, fusion, alpha, collapse_chunks, boosts[i])
+        return batch_results
+    
+    def _candidates(self, n_results, filters, profile):
+        """(normalized filters, candidate ids or None, vector candidates to fetch)"""
+        filters = self.metadata_index.normalize_filters(filters) if filters else None
+        candidate_ids = self.metadata_index.match(filters) if filters else None
+        total = len(candidate_ids) if filters else self.collection.count()
+        return filters, candidate_ids, candidate_count(n_results, total, profile or self.profile) if total else 0
+    
+    def _fuse(self, query, results, row, n_results, n_candidates, candidate_ids, fusion, alpha, collapse_chunks, boosts=None):
+        """Fuse row `row` of a Chroma query result with BM25 hits for query"""
+        documents = {}
+        vector_ranking = []
+        vector_scores = {}
+        if results['ids']:
+            for i, doc_id in enumerate(results['ids'][row]):
+                metadata = results['metadatas'][row][i] if results['metadatas'] else {}
+                documents[doc_id] = (results['documents'][row][i], metadata)
+                vector_ranking.append(doc_id)
+                vector_scores[doc_id] = 1.0 / (1.0 + results['distances'][row][i])
+        
+        keyword_hits = self.bm25.search(query, n_candidates, candidate_ids)
+        keyword_scores = dict(keyword_hits)
+        
+        if fusion == 'weighted':
+            fused = weighted_fusion(vector_scores, keyword_scores, alpha)
+        else:
+            fused = reciprocal_rank_fusion([vector_ranking, [doc_id for doc_id, _ in keyword_hits]])
+        if boosts:
+            for doc_id, matches in self.metadata_index.boosted(self.metadata_index.normalize_filters(boosts)).items():
+                if doc_id in fused:
+                    fused[doc_id] *= FACET_BOOST ** matches
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+        if not collapse_chunks:
+            ranked = ranked[:n_results]
+        
+        # Keyword-only hits were never returned by the vector query
+        missing = [doc_id for doc_id, _ in ranked if doc_id not in documents]
+        if missing:
+            fetched = self.collection.get(ids=missing, include=['documents', 'metadatas'])
+            for i, doc_id in enumerate(fetched['ids']):
+                documents[doc_id] = (fetched['documents'][i], fetched['metadatas'][i])
         
         formatted_results = []
-        if results['documents']:
-            for i, doc in enumerate(results['documents'][0]):
-                metadata = results['metadatas'][0][i] if results['metadatas'] else {}
-                formatted_results.append({
-                    'content': doc,
-                    'metadata': metadata,
-                    'score': 1.0
-                })
+        seen_parents = set()
+        for doc_id, score in ranked:
+            if len(formatted_results) >= n_results:
+                break
+            if doc_id not in documents:
+                continue
+            doc, metadata = documents[doc_id]
+            if collapse_chunks:
+                parent_id = (metadata or {}).get('parent_id', doc_id)
+                if parent_id in seen_parents:
+                    continue
+                seen_parents.add(parent_id)
+            formatted_results.append({
+                'id': doc_id,
+                'content': doc,
+                'metadata': metadata or {},
+                'score': score,
+                'vector_score': vector_scores.get(doc_id, 0.0),
+                'keyword_score': keyword_scores.get(doc_id, 0.0)
+            })
         
         return formatted_results
 
     def get_collection_stats(self):
         """Get statistics about the knowledge base"""
         return self.collection.count()
+    
+    def get_index_settings(self):
+        """Profile in use and the HNSW parameters the collection was built with"""
+        metadata = self.collection.metadata or {}
+        return {
+            "profile": self.profile,
+            "built_with": metadata.get("retrieval_profile"),
+            "index": {key: value for key, value in metadata.items() if key.startswith("hnsw:")}
+        }
 
 # Expanded sample data with 25+ documents across multiple domains
 def initialize_sample_data():
-    manager = ChromaManager()
+    manager = get_chroma_manager()
     
     # Expanded sample documents - 25 documents across multiple domains
     sample_docs = [
@@ -159,40 +668,70 @@ def initialize_sample_data():
         {"source": "internal", "type": "hr", "department": "Talent", "completion": "75%", "domain": "workforce", "hiring": "200"}
     ]
     
-    # Only add if collection is empty or small
-    current_count = manager.get_collection_stats()
-    if current_count < 20:  # Only add if we have less than 20 documents
-        manager.add_documents(sample_docs, sample_metadata)
-        print(f"✅ Expanded knowledge base loaded with {len(sample_docs)} internal documents")
+    # Earlier versions stored the samples as doc_0..doc_24; drop those copies so
+    # they aren't duplicated under content-addressed IDs
+    legacy = manager.collection.get(ids=[f"doc_{i}" for i in range(len(sample_docs))], include=['documents'])
+    samples = set(sample_docs)
+    stale = [doc_id for doc_id, doc in zip(legacy['ids'], legacy['documents']) if doc in samples]
+    if stale:
+        manager.delete_documents(stale)
+        print(f"🔄 Re-keying {len(stale)} sample documents stored under legacy IDs")
+    
+    # Content-addressed IDs make this a no-op when the samples are already loaded
+    added = manager.add_documents(sample_docs, sample_metadata)
+    if added:
+        print(f"✅ Expanded knowledge base loaded with {added} internal documents")
         print("📊 Domains covered: Technology, Business, Research, Operations")
     else:
-        print(f"ℹ️  Knowledge base already contains {current_count} documents")
+        print(f"ℹ️  Knowledge base already contains {manager.get_collection_stats()} documents")
 
 # Enhanced document processor for adding custom documents
-def add_custom_documents(file_paths):
-    """Add custom documents to the knowledge base"""
-    manager = ChromaManager()
-    
-    documents = []
-    metadatas = []
+def iter_text_files(file_paths, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS, chunk_counts=None):
+    """Lazily yield (chunk, metadata) for each readable .txt file
     
+    Each file is split with iter_chunks; chunks carry their parent document
+    ID and position. If chunk_counts is a dict it receives parent_id -> count.
+    Files are read line by line, once to count their chunks and once to
+    yield them, so a large file is never held in memory whole.
+    """
     for file_path in file_paths:
         if os.path.exists(file_path):
             # Simple text file reading
             if file_path.endswith('.txt'):
+                path = os.path.abspath(file_path)
+                parent_id = make_document_id(None, path)
                 with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    documents.append(content)
-                    metadatas.append({
-                        "source": "custom",
-                        "filename": os.path.basename(file_path),
-                        "type": "document",
-                        "added_date": "2024-01-01"
-                    })
-    
-    if documents:
-        manager.add_documents(documents, metadatas)
-        print(f"✅ Added {len(documents)} custom documents to knowledge base")
+                    chunk_count = sum(1 for _ in iter_chunks(f, max_tokens, overlap_tokens))
+                if chunk_counts is not None:
+                    chunk_counts[parent_id] = chunk_count
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    for index, chunk in enumerate(iter_chunks(f, max_tokens, overlap_tokens)):
+                        yield chunk, {
+                            "source": "custom",
+                            "path": path,
+                            "filename": os.path.basename(file_path),
+                            "type": "document",
+                            "added_date": "2024-01-01",
+                            "parent_id": parent_id,
+                            "chunk_index": index,
+                            "chunk_count": chunk_count
+                        }
+
+def add_custom_documents(file_paths, batch_size=None, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    """Add custom documents to the knowledge base as chunks, streaming files in batches"""
+    manager = get_chroma_manager()
+    
+    chunk_counts = {}
+    contents, metadatas = tee(iter_text_files(file_paths, max_tokens, overlap_tokens, chunk_counts))
+    documents = (content for content, _ in contents)
+    metadatas = (metadata for _, metadata in metadatas)
+    
+    added = manager.add_documents(documents, metadatas, batch_size=batch_size)
+    for parent_id, chunk_count in chunk_counts.items():
+        manager.prune_chunks(parent_id, chunk_count)
+    if added:
+        print(f"✅ Added {added} chunks from {len(chunk_counts)} custom documents to knowledge base")
+    return added
 
 if __name__ == "__main__":
     initialize_sample_data()
@@ -0,0 +1,156 @@
+import io
+import re
+from itertools import chain
+
+DEFAULT_CHUNK_TOKENS = 200   # all-MiniLM-L6-v2 truncates at 256 word pieces
+DEFAULT_OVERLAP_TOKENS = 40
+
+PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text):
+    """Cheap token estimate: words and punctuation marks"""
+    return len(TOKEN_PATTERN.findall(text))
+
+def split_sentences(paragraph):
+    """Split a paragraph into sentences"""
+    return [sentence.strip() for sentence in SENTENCE_SPLIT.split(paragraph) if sentence.strip()]
+
+def _split_long_sentence(sentence, max_tokens):
+    """Hard-split a sentence that alone exceeds the budget on word boundaries"""
+    words = sentence.split()
+    piece = []
+    for word in words:
+        if piece and estimate_tokens(" ".join(piece + [word])) > max_tokens:
+            yield " ".join(piece)
+            piece = []
+        piece.append(word)
+    if piece:
+        yield " ".join(piece)
+
+def _iter_sentences(lines, max_tokens):
+    """Yield (sentence, ends_paragraph) for text read line by line
+
+    Uses the same paragraph and sentence boundaries as splitting the whole
+    text at once, but holds only the current unfinished sentence.
+    """
+    buffer = ""
+    held = None
+    after_newline = False
+    for line in chain(lines, [None]):
+        # A whitespace-only line after a newline closes the paragraph, like PARAGRAPH_SPLIT
+        ends_paragraph = line is None or (after_newline and line.endswith("\n") and not line.strip())
+        if ends_paragraph:
+            complete, buffer = SENTENCE_SPLIT.split(buffer), ""
+        else:
+            buffer += line
+            *complete, buffer = SENTENCE_SPLIT.split(buffer)
+        after_newline = line is not None and line.endswith("\n")
+        for sentence in complete:
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            parts = _split_long_sentence(sentence, max_tokens) if estimate_tokens(sentence) > max_tokens else [sentence]
+            for part in parts:
+                if held is not None:
+                    yield held, False
+                held = part
+        if ends_paragraph and held is not None:
+            yield held, True
+            held = None
+
+def iter_chunks(lines, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    """chunk_text over an iterable of lines, e.g. an open file
+
+    Chunks are yielded as they are completed. Besides the chunk being built,
+    at most one paragraph's worth of sentences (max_tokens) and the current
+    unfinished sentence are held, so memory does not grow with the file.
+    """
+    lines = iter(lines)
+    head = []
+    head_tokens = 0
+    for line in lines:
+        head.append(line)
+        head_tokens += estimate_tokens(line)
+        if head_tokens > max_tokens:
+            break
+    else:
+        text = "".join(head).strip()
+        if text:
+            yield text
+        return
+
+    current = []          # [(sentence, tokens, ends_paragraph)]
+    current_tokens = 0
+    carried_count = 0     # leading items of current already emitted as overlap
+
+    def flush():
+        nonlocal current, current_tokens, carried_count
+        # Nothing but overlap from the previous chunk: emitting it would duplicate that chunk's tail
+        if len(current) <= carried_count:
+            return None
+        chunk = ""
+        for sentence, _, ends_paragraph in current:
+            chunk += sentence + ("\n\n" if ends_paragraph else " ")
+
+        # Carry whole trailing sentences forward as overlap
+        carried = []
+        carried_tokens = 0
+        for item in reversed(current):
+            if carried_tokens + item[1] > overlap_tokens:
+                break
+            carried.insert(0, item)
+            carried_tokens += item[1]
+        if len(carried) == len(current):
+            carried, carried_tokens = [], 0
+        current, current_tokens, carried_count = carried, carried_tokens, len(carried)
+        return chunk.strip()
+
+    # Sentences of a paragraph are held until it is known whether it fits in one chunk
+    deciding = True
+    pending = []
+    pending_tokens = 0
+    for sentence, ends_paragraph in _iter_sentences(chain(head, lines), max_tokens):
+        item = (sentence, estimate_tokens(sentence), ends_paragraph)
+        if deciding:
+            pending.append(item)
+            pending_tokens += item[1]
+            if not ends_paragraph and pending_tokens <= max_tokens:
+                continue
+            # Start a fresh chunk rather than splitting a paragraph that would fit on its own
+            if current and pending_tokens <= max_tokens and current_tokens + pending_tokens > max_tokens:
+                chunk = flush()
+                if chunk:
+                    yield chunk
+                current, current_tokens, carried_count = [], 0, 0
+            items, pending, pending_tokens = pending, [], 0
+        else:
+            items = [item]
+
+        for sentence, tokens, last in items:
+            if current and current_tokens + tokens > max_tokens:
+                chunk = flush()
+                if chunk:
+                    yield chunk
+                # Overlap can still leave no room; drop it rather than exceed the budget
+                while current and current_tokens + tokens > max_tokens:
+                    current_tokens -= current.pop(0)[1]
+                    carried_count -= 1
+            current.append((sentence, tokens, last))
+            current_tokens += tokens
+        deciding = ends_paragraph
+
+    chunk = flush()
+    if chunk:
+        yield chunk
+
+def chunk_text(text, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    """Split text into chunks of at most max_tokens
+
+    Paragraph boundaries are preferred over sentence boundaries, and a chunk
+    never ends mid-sentence unless a single sentence is over budget. The
+    trailing sentences of each chunk (up to overlap_tokens) are repeated at
+    the start of the next one.
+    """
+    return list(iter_chunks(io.StringIO(text), max_tokens, overlap_tokens))
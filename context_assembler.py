@@ -0,0 +1,120 @@
+import os
+from bm25_index import tokenize
+from chunker import estimate_tokens
+
+# Token budget for retrieved context per Research Depth level
+DEPTH_BUDGETS = {
+    "Quick": int(os.getenv('CONTEXT_BUDGET_QUICK', '400')),
+    "Standard": int(os.getenv('CONTEXT_BUDGET_STANDARD', '900')),
+    "Comprehensive": int(os.getenv('CONTEXT_BUDGET_COMPREHENSIVE', '2000'))
+}
+DEFAULT_DEPTH = "Standard"
+DUPLICATE_THRESHOLD = float(os.getenv('CONTEXT_DUPLICATE_THRESHOLD', '0.8'))
+MIN_PASSAGE_TOKENS = 30   # don't bother truncating a passage to less than this
+
+def budget_for_depth(depth):
+    """Token budget for a Research Depth level, falling back to Standard"""
+    return DEPTH_BUDGETS.get(depth, DEPTH_BUDGETS[DEFAULT_DEPTH])
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text on a word boundary so it fits in max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept = []
+    used = 1    # room for the ellipsis
+    for word in text.split():
+        tokens = estimate_tokens(word)
+        if used + tokens > max_tokens:
+            break
+        kept.append(word)
+        used += tokens
+    return " ".join(kept) + "…"
+
+def similarity(a, b):
+    """Jaccard overlap of two token sets"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class ContextAssembler:
+    """Pack the best web and internal passages into a fixed token budget
+
+    Passages are ranked by their retrieval score (normalised per source so
+    web and internal hits are comparable), near-duplicates are dropped, and
+    the survivors are added in rank order until the budget is spent. A
+    passage that doesn't fit is truncated if enough room is left for it.
+    """
+
+    def __init__(self, budget_tokens, duplicate_threshold=DUPLICATE_THRESHOLD):
+        self.budget_tokens = budget_tokens
+        self.duplicate_threshold = duplicate_threshold
+
+    @classmethod
+    def for_depth(cls, depth):
+        return cls(budget_for_depth(depth))
+
+    def _passages(self, source, records, text_field):
+        scores = [record.get('score') or 0.0 for record in records]
+        top = max(scores, default=0.0)
+        passages = []
+        for position, (record, score) in enumerate(zip(records, scores)):
+            # Without usable scores fall back to the order the source returned
+            relevance = score / top if top > 0 else 1.0 / (position + 1)
+            passages.append({
+                "source": source,
+                "position": position,
+                "record": record,
+                "field": text_field,
+                "relevance": relevance,
+                "terms": set(tokenize(record.get(text_field, "")))
+            })
+        return passages
+
+    def _cost(self, passage):
+        record = passage["record"]
+        if passage["source"] == "web":
+            return estimate_tokens(f"{record.get('title', '')} {record.get('snippet', '')} {record.get('url', '')}")
+        return estimate_tokens(record.get('content', ''))
+
+    def assemble(self, web_results, internal_results):
+        """Return (web_selected, internal_selected, stats)
+
+        Selected records keep their source's original order; truncated
+        records are copies, the inputs are never modified.
+        """
+        passages = self._passages("web", web_results, "snippet") + self._passages("internal", internal_results, "content")
+        passages.sort(key=lambda passage: (-passage["relevance"], passage["position"]))
+
+        selected = []
+        remaining = self.budget_tokens
+        duplicates = 0
+        truncated = 0
+        for passage in passages:
+            if any(similarity(passage["terms"], kept["terms"]) >= self.duplicate_threshold for kept in selected):
+                duplicates += 1
+                continue
+            cost = self._cost(passage)
+            if cost > remaining:
+                overhead = cost - estimate_tokens(passage["record"].get(passage["field"], ""))
+                room = remaining - overhead
+                if room < MIN_PASSAGE_TOKENS:
+                    continue
+                field = passage["field"]
+                passage["record"] = dict(passage["record"], **{field: truncate_to_tokens(passage["record"][field], room)})
+                cost = self._cost(passage)
+                truncated += 1
+            selected.append(passage)
+            remaining -= cost
+
+        selected.sort(key=lambda passage: passage["position"])
+        web_selected = [passage["record"] for passage in selected if passage["source"] == "web"]
+        internal_selected = [passage["record"] for passage in selected if passage["source"] == "internal"]
+        stats = {
+            "budget_tokens": self.budget_tokens,
+            "used_tokens": self.budget_tokens - remaining,
+            "passages": len(selected),
+            "duplicates": duplicates,
+            "truncated": truncated,
+            "dropped": len(passages) - len(selected) - duplicates
+        }
+        return web_selected, internal_selected, stats
@@ -0,0 +1,96 @@
+import os
+import re
+import json
+import threading
+import numpy as np
+
+class EmbeddingStore:
+    """Persistent embedding cache keyed by text hash, one store per model
+
+    Vectors live in an append-only float32 matrix (<model>.f32) that is read
+    through a memory map; <model>.idx lists the text hash of each row in the
+    same order. Wiping or switching Chroma collections leaves it intact.
+    """
+
+    def __init__(self, directory, model_name):
+        self.directory = directory
+        self.model_name = model_name
+        safe_name = re.sub(r"[^\w.-]", "_", model_name)
+        self.matrix_path = os.path.join(directory, f"{safe_name}.f32")
+        self.index_path = os.path.join(directory, f"{safe_name}.idx")
+        self.meta_path = os.path.join(directory, f"{safe_name}.meta.json")
+        self.lock = threading.Lock()
+        self.rows = {}       # text hash -> row number
+        self.dim = None
+        self._matrix = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            self.dim = json.load(f)["dim"]
+        hashes = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                hashes = f.read().split()
+        stored_rows = os.path.getsize(self.matrix_path) // (4 * self.dim) if os.path.exists(self.matrix_path) else 0
+        # A crash between the two appends can leave one file ahead of the other
+        usable = min(len(hashes), stored_rows)
+        self.rows = {digest: row for row, digest in enumerate(hashes[:usable])}
+        if usable < len(hashes) or usable < stored_rows:
+            self._truncate(usable, hashes[:usable])
+
+    def _truncate(self, rows, hashes):
+        # Append mode creates a missing data file, leaving zero rows and an empty index
+        with open(self.matrix_path, 'ab') as f:
+            f.truncate(rows * 4 * self.dim)
+        with open(self.index_path, 'w', encoding='utf-8') as f:
+            f.write("".join(f"{digest}\n" for digest in hashes))
+
+    def _matrix_view(self):
+        """Memory-mapped view of every stored row"""
+        n_rows = len(self.rows)
+        if self._matrix is None or self._matrix.shape[0] != n_rows:
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r', shape=(n_rows, self.dim))
+        return self._matrix
+
+    def get_many(self, hashes):
+        """Return {position: vector} for every hash already in the store"""
+        with self.lock:
+            positions = [(i, self.rows[digest]) for i, digest in enumerate(hashes) if digest in self.rows]
+            if not positions:
+                return {}
+            matrix = self._matrix_view()
+            return {i: np.array(matrix[row]) for i, row in positions}
+
+    def put_many(self, hashes, vectors):
+        """Append vectors for hashes not yet stored"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({"model": self.model_name, "dim": self.dim}, f)
+            new_rows = []
+            new_hashes = []
+            seen = set(self.rows)
+            for digest, vector in zip(hashes, vectors):
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                new_rows.append(vector)
+                new_hashes.append(digest)
+            if not new_rows:
+                return
+            with open(self.matrix_path, 'ab') as f:
+                f.write(np.stack(new_rows).astype(np.float32).tobytes())
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write("".join(f"{digest}\n" for digest in new_hashes))
+            start = len(self.rows)
+            for offset, digest in enumerate(new_hashes):
+                self.rows[digest] = start + offset
@@ -1,62 +1,278 @@
 import os
+import re
 import json
+import hashlib
 import google.generativeai as genai
 from dotenv import load_dotenv
 from datetime import datetime
+from caching import LRUCache, SQLiteCache, TieredCache, normalize_text
+from chunker import estimate_tokens
+from rate_limiter import get_rate_limiter, key_id
+from tracing import annotate, active as tracing_active
+from async_io import run_blocking
 
 load_dotenv()
 
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-pro')
+# Alternative Gemini endpoint (e.g. a local stub for benchmarks); reached over REST
+GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT', '')
+# Cached LLM responses; set LLM_CACHE_PATH to also keep them in SQLite across restarts
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '256'))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', str(24 * 3600)))
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '')
+INTENT_CACHE_SIZE = int(os.getenv('INTENT_CACHE_SIZE', '1024'))
+INTENT_CACHE_TTL = float(os.getenv('INTENT_CACHE_TTL', str(7 * 24 * 3600)))
+
+try:
+    from intent_router import IntentRouter
+except ImportError as e:
+    print(f"⚠️ Local intent router unavailable: {e}")
+    IntentRouter = None
+
+def llm_cache_key(model_name, prompt, settings=None):
+    """Cache key for one LLM call: model, prompt hash and generation settings"""
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    payload = json.dumps({"model": model_name, "prompt": prompt_hash, "settings": settings or {}}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def make_llm_cache(maxsize, ttl, path=None):
+    """LRU cache for LLM output, backed by SQLite when a path is given"""
+    persistent = None
+    if path:
+        try:
+            persistent = SQLiteCache(path, ttl=ttl, max_entries=maxsize * 20)
+        except Exception as e:
+            print(f"⚠️ LLM cache disabled persistence: {e}")
+    return TieredCache(LRUCache(maxsize, ttl), persistent)
+
 class FreeAIClient:
     def __init__(self):
         api_key = os.getenv('GEMINI_API_KEY')
+        self.model_name = GEMINI_MODEL
+        self.generation_config = {}
+        # The REST transport has no async client, so async calls run the sync one on a thread
+        self.rest_transport = False
         if api_key and api_key != "your_free_gemini_key_here":
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-pro')
+            if GEMINI_API_ENDPOINT:
+                self.rest_transport = True
+                genai.configure(api_key=api_key, transport='rest', client_options={'api_endpoint': GEMINI_API_ENDPOINT})
+            else:
+                genai.configure(api_key=api_key)
+            self.model = genai.GenerativeModel(self.model_name)
             self.use_api = True
             print("✅ Using Google Gemini API (Free Tier)")
         else:
             self.use_api = False
             print("🔄 Using enhanced mock AI responses")
+        
+        # Calls queue for free-tier quota instead of failing over to mock reports
+        self.rate_limiter = get_rate_limiter() if self.use_api else None
+        self.rate_key = key_id(api_key)
+        
+        # Confident questions are routed locally; only unsure ones reach the LLM
+        self.router = IntentRouter() if IntentRouter and os.getenv('INTENT_ROUTER', '1') != '0' else None
+        # Intents are small and very reusable, so they get their own cache keyed by question
+        self.intent_cache = make_llm_cache(INTENT_CACHE_SIZE, INTENT_CACHE_TTL, f"{LLM_CACHE_PATH}.intents" if LLM_CACHE_PATH else None)
+        self.response_cache = make_llm_cache(LLM_CACHE_SIZE, LLM_CACHE_TTL, LLM_CACHE_PATH)
     
     def analyze_intent(self, user_question):
         """Enhanced intent analysis with better context understanding"""
         
+        routed = self._route_intent(user_question)
+        if routed:
+            annotate(source="router")
+            return routed
+        
         if self.use_api:
             try:
-                prompt = f"""
-                Analyze this research question in depth and determine the optimal information sources needed.
-                
-                QUESTION: "{user_question}"
-                
-                Consider these aspects:
-                1. Time sensitivity - does it need recent/current information?
-                2. Organizational context - does it mention "our", "internal", "company"?
-                3. Technical depth - does it require specialized/internal knowledge?
-                4. Comparative analysis - does it ask for comparisons?
-                5. Action orientation - does it require recommendations?
-                
-                Return ONLY valid JSON:
-                {{
-                    "needs_web": boolean,
-                    "needs_internal": boolean,
-                    "confidence": "high/medium/low",
-                    "reasoning": "detailed explanation",
-                    "web_query": "optimized search query for web",
-                    "internal_query": "optimized search query for internal docs",
-                    "question_type": "technical/strategic/comparative/regulatory/trends",
-                    "expected_sections": ["section1", "section2", ...]
-                }}
-                """
-                response = self.model.generate_content(prompt)
-                return self._clean_json_response(response.text)
+                prompt = self._create_intent_prompt(user_question)
+                reply = self._generate(prompt, self.intent_cache, self._intent_key(user_question), self._is_intent_json)
+                return self._clean_json_response(reply)
             except Exception as e:
                 print(f"❌ Gemini API error: {e}")
+                annotate(fallback=f"gemini error: {e}")
         
+        annotate(source="mock")
         return self._enhanced_mock_intent(user_question)
     
+    async def aanalyze_intent(self, user_question):
+        """Async variant of analyze_intent"""
+        
+        routed = await run_blocking(self._route_intent, user_question)
+        if routed:
+            annotate(source="router")
+            return routed
+        
+        if self.use_api:
+            try:
+                prompt = self._create_intent_prompt(user_question)
+                reply = await self._agenerate(prompt, self.intent_cache, self._intent_key(user_question), self._is_intent_json)
+                return self._clean_json_response(reply)
+            except Exception as e:
+                print(f"❌ Gemini API error: {e}")
+                annotate(fallback=f"gemini error: {e}")
+        
+        annotate(source="mock")
+        return self._enhanced_mock_intent(user_question)
+    
+    def _intent_key(self, user_question):
+        """Keyed by normalized question and the prompt template, so a changed prompt doesn't serve old intents"""
+        template = self._create_intent_prompt("{question}")
+        return llm_cache_key(self.model_name, f"{template}\nintent:{normalize_text(user_question)}", self.generation_config)
+    
+    def _is_intent_json(self, text):
+        """True when a reply holds a JSON object; anything else is not worth caching"""
+        match = re.search(r'\{.*\}', text or "", re.DOTALL)
+        try:
+            return bool(match) and isinstance(json.loads(match.group()), dict)
+        except ValueError:
+            return False
+    
+    def _generation_kwargs(self):
+        return {"generation_config": self.generation_config} if self.generation_config else {}
+    
+    def _throttle(self, prompt):
+        """Wait for rate-limit quota; returns the tokens reserved for the prompt"""
+        reserved = estimate_tokens(prompt)
+        if self.rate_limiter is not None:
+            waited = self.rate_limiter.acquire(reserved, key=self.rate_key)
+            if waited > 0.05:
+                print(f"⏳ Waited {waited:.1f}s for Gemini quota")
+        return reserved
+    
+    async def _athrottle(self, prompt):
+        """Async variant of _throttle"""
+        reserved = estimate_tokens(prompt)
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aacquire(reserved, key=self.rate_key)
+        return reserved
+    
+    def _charge(self, reserved, output):
+        """Account for the generated tokens once the response ends"""
+        if self.rate_limiter is not None:
+            self.rate_limiter.record(reserved + estimate_tokens(output), reserved, key=self.rate_key)
+    
+    def _annotate_call(self, prompt, text, reserved):
+        """Record an uncached LLM call on the active trace span"""
+        if not tracing_active():
+            return
+        annotate(
+            source="gemini", cache="miss",
+            tokens_in=reserved, tokens_out=estimate_tokens(text),
+            bytes_in=len(prompt.encode('utf-8')), bytes_out=len(text.encode('utf-8'))
+        )
+    
+    def _generate(self, prompt, cache=None, key=None, cacheable=None):
+        """generate_content through a cache and the rate limiter; returns the response text
+
+        cacheable, if given, decides whether a fresh response may be cached.
+        """
+        cache = self.response_cache if cache is None else cache
+        key = key or llm_cache_key(self.model_name, prompt, self.generation_config)
+        cached = cache.get(key)
+        if cached is not None:
+            annotate(source="gemini", cache="hit")
+            return cached
+        reserved = self._throttle(prompt)
+        text = self.model.generate_content(prompt, **self._generation_kwargs()).text
+        self._charge(reserved, text)
+        self._annotate_call(prompt, text, reserved)
+        if cacheable is None or cacheable(text):
+            cache.set(key, text)
+        return text
+    
+    async def _agenerate(self, prompt, cache=None, key=None, cacheable=None):
+        """Async variant of _generate"""
+        cache = self.response_cache if cache is None else cache
+        key = key or llm_cache_key(self.model_name, prompt, self.generation_config)
+        cached = cache.get(key)
+        if cached is not None:
+            annotate(source="gemini", cache="hit")
+            return cached
+        reserved = await self._athrottle(prompt)
+        if self.rest_transport:
+            response = await run_blocking(self.model.generate_content, prompt, **self._generation_kwargs())
+        else:
+            response = await self.model.generate_content_async(prompt, **self._generation_kwargs())
+        self._charge(reserved, response.text)
+        self._annotate_call(prompt, response.text, reserved)
+        if cacheable is None or cacheable(response.text):
+            cache.set(key, response.text)
+        return response.text
+    
+    async def _astream_chunks(self, prompt):
+        """Streamed generate_content chunks, read on a worker thread over the REST transport"""
+        if not self.rest_transport:
+            response = await self.model.generate_content_async(prompt, stream=True, **self._generation_kwargs())
+            async for chunk in response:
+                yield chunk
+            return
+        response = await run_blocking(self.model.generate_content, prompt, stream=True, **self._generation_kwargs())
+        chunks = iter(response)
+        while True:
+            chunk = await run_blocking(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    
+    def get_rate_limit_stats(self):
+        """Per-key request, token and queueing counters"""
+        return self.rate_limiter.stats() if self.rate_limiter is not None else {}
+    
+    def get_cache_stats(self):
+        """Hit-rate metrics for the intent and response caches"""
+        return {"intent": self.intent_cache.stats(), "response": self.response_cache.stats()}
+    
+    def _route_intent(self, user_question):
+        """Intent JSON from the local router, or None when it is unsure or unavailable"""
+        if self.router is None:
+            return None
+        try:
+            routed = self.router.route(user_question)
+        except Exception as e:
+            print(f"⚠️ Local intent router failed, disabling it: {e}")
+            self.router = None
+            return None
+        if routed is None:
+            return None
+        
+        intent = json.loads(self._enhanced_mock_intent(user_question))
+        intent.update(routed)
+        intent["reasoning"] = f"Local router: {routed['route']} (p={routed['route_probability']})"
+        return json.dumps(intent, indent=2)
+    
+    def _create_intent_prompt(self, user_question):
+        """Prompt asking the model which sources a question needs"""
+        return f"""
+        Analyze this research question in depth and determine the optimal information sources needed.
+        
+        QUESTION: "{user_question}"
+        
+        Consider these aspects:
+        1. Time sensitivity - does it need recent/current information?
+        2. Organizational context - does it mention "our", "internal", "company"?
+        3. Technical depth - does it require specialized/internal knowledge?
+        4. Comparative analysis - does it ask for comparisons?
+        5. Action orientation - does it require recommendations?
+        
+        Return ONLY valid JSON:
+        {{
+            "needs_web": boolean,
+            "needs_internal": boolean,
+            "confidence": "high/medium/low",
+            "reasoning": "detailed explanation",
+            "web_query": "optimized search query for web",
+            "internal_query": "optimized search query for internal docs",
+            "question_type": "technical/strategic/comparative/regulatory/trends",
+            "expected_sections": ["section1", "section2", ...],
+            "filters": {{"project": "...", "quarter": "...", "region": "..."}}
+        }}
+        
+        Only include a filters field the question explicitly names (e.g. "project Ares" gives "project": "Ares"); use {{}} if none.
+        """
+    
     def _clean_json_response(self, text):
         """Extract and clean JSON from AI response"""
-        import re
         try:
             json_match = re.search(r'\{.*\}', text, re.DOTALL)
             if json_match:
@@ -121,13 +337,102 @@ class FreeAIClient:
         if self.use_api:
             try:
                 prompt = self._create_enhanced_research_prompt(user_question, web_data, internal_data)
-                response = self.model.generate_content(prompt)
-                return response.text
+                return self._generate(prompt)
+            except Exception as e:
+                print(f"❌ Gemini API synthesis error: {e}")
+                annotate(fallback=f"gemini error: {e}")
+        
+        annotate(source="mock")
+        return self._enhanced_research_report(user_question, web_data, internal_data)
+    
+    async def asynthesize_answer(self, user_question, web_data, internal_data):
+        """Async variant of synthesize_answer"""
+        
+        if self.use_api:
+            try:
+                prompt = self._create_enhanced_research_prompt(user_question, web_data, internal_data)
+                return await self._agenerate(prompt)
             except Exception as e:
                 print(f"❌ Gemini API synthesis error: {e}")
+                annotate(fallback=f"gemini error: {e}")
         
+        annotate(source="mock")
         return self._enhanced_research_report(user_question, web_data, internal_data)
     
+    def stream_answer(self, user_question, web_data, internal_data):
+        """Streaming variant of synthesize_answer: yields report text as it is generated"""
+        
+        if self.use_api:
+            streamed = False
+            try:
+                prompt = self._create_enhanced_research_prompt(user_question, web_data, internal_data)
+                key = llm_cache_key(self.model_name, prompt, self.generation_config)
+                cached = self.response_cache.get(key)
+                if cached is not None:
+                    yield from self._stream_text(cached)
+                    return
+                parts = []
+                reserved = self._throttle(prompt)
+                try:
+                    for chunk in self.model.generate_content(prompt, stream=True, **self._generation_kwargs()):
+                        if chunk.text:
+                            streamed = True
+                            parts.append(chunk.text)
+                            yield chunk.text
+                finally:
+                    # Charged even when the consumer stops early or the stream fails
+                    self._charge(reserved, "".join(parts))
+                # Only a complete report is cached
+                self.response_cache.set(key, "".join(parts))
+                return
+            except Exception as e:
+                print(f"❌ Gemini API streaming error: {e}")
+                if streamed:
+                    yield "\n\n*⚠️ Report generation was interrupted.*\n"
+                    return
+        
+        yield from self._stream_text(self._enhanced_research_report(user_question, web_data, internal_data))
+    
+    async def astream_answer(self, user_question, web_data, internal_data):
+        """Async variant of stream_answer"""
+        
+        if self.use_api:
+            streamed = False
+            try:
+                prompt = self._create_enhanced_research_prompt(user_question, web_data, internal_data)
+                key = llm_cache_key(self.model_name, prompt, self.generation_config)
+                cached = self.response_cache.get(key)
+                if cached is not None:
+                    for chunk in self._stream_text(cached):
+                        yield chunk
+                    return
+                parts = []
+                reserved = await self._athrottle(prompt)
+                try:
+                    async for chunk in self._astream_chunks(prompt):
+                        if chunk.text:
+                            streamed = True
+                            parts.append(chunk.text)
+                            yield chunk.text
+                finally:
+                    # Charged even when the consumer stops early or the stream fails
+                    self._charge(reserved, "".join(parts))
+                # Only a complete report is cached
+                self.response_cache.set(key, "".join(parts))
+                return
+            except Exception as e:
+                print(f"❌ Gemini API streaming error: {e}")
+                if streamed:
+                    yield "\n\n*⚠️ Report generation was interrupted.*\n"
+                    return
+        
+        for chunk in self._stream_text(self._enhanced_research_report(user_question, web_data, internal_data)):
+            yield chunk
+    
+    def _stream_text(self, text):
+        """Yield a finished report line by line so mock output streams like the API"""
+        yield from text.splitlines(keepends=True)
+    
     def _create_enhanced_research_prompt(self, user_question, web_data, internal_data):
         """Create sophisticated prompt for professional research reports"""
         
@@ -1,21 +1,45 @@
 import os
 import json
 import re
+import time
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed, wait, FIRST_COMPLETED
+from contextlib import contextmanager, nullcontext
 from dotenv import load_dotenv
+import tracing
+from async_io import MAX_CONCURRENT_REQUESTS, run_blocking
 
 load_dotenv()
 
+# Per-source deadlines (seconds) for the parallel gather step
+WEB_SEARCH_TIMEOUT = float(os.getenv('WEB_SEARCH_TIMEOUT', '12'))
+INTERNAL_SEARCH_TIMEOUT = float(os.getenv('INTERNAL_SEARCH_TIMEOUT', '5'))
+# Worker threads for the network calls of one process_batch run
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+
 # Import other components
 try:
     from free_search_client import FreeSearchClient
     from free_ai_client import FreeAIClient
-    from chroma_manager import ChromaManager, initialize_sample_data
+    from chroma_manager import ChromaManager, get_chroma_manager, initialize_sample_data
+    from context_assembler import ContextAssembler, DEFAULT_DEPTH
+    from semantic_cache import SemanticAnswerCache
+    from caching import normalize_text
+    from rate_limiter import priority, BATCH
+    from chunker import estimate_tokens
 except ImportError as e:
     print(f"Import error: {e}")
     # Create dummy classes for testing
     class FreeSearchClient:
         def query(self, question):
             return f"Mock web results for: {question}"
+        def search(self, question):
+            return [{"title": "Mock web result", "snippet": question, "url": "", "rank": 1, "score": 0.0}]
+        async def aquery(self, question):
+            return self.query(question)
+        async def asearch(self, question):
+            return self.search(question)
     
     class FreeAIClient:
         def __init__(self):
@@ -24,6 +48,14 @@ except ImportError as e:
             return '{"needs_web": true, "needs_internal": true}'
         def synthesize_answer(self, question, web_data, internal_data):
             return f"Answer to: {question}\nWeb: {web_data[:100]}...\nInternal: {internal_data[:100]}..."
+        async def aanalyze_intent(self, question):
+            return self.analyze_intent(question)
+        async def asynthesize_answer(self, question, web_data, internal_data):
+            return self.synthesize_answer(question, web_data, internal_data)
+        def stream_answer(self, question, web_data, internal_data):
+            yield self.synthesize_answer(question, web_data, internal_data)
+        async def astream_answer(self, question, web_data, internal_data):
+            yield self.synthesize_answer(question, web_data, internal_data)
     
     class ChromaManager:
         def __init__(self):
@@ -32,13 +64,152 @@ except ImportError as e:
             return [{"content": f"Mock internal doc about {query}", "metadata": {}}]
         def get_collection_stats(self):
             return 8
+    
+    def get_chroma_manager():
+        return ChromaManager()
+    
+    DEFAULT_DEPTH = "Standard"
+    
+    SemanticAnswerCache = None
+    
+    class ContextAssembler:
+        @classmethod
+        def for_depth(cls, depth):
+            return cls()
+        def assemble(self, web_results, internal_results):
+            return web_results, internal_results, {}
+    
+    def normalize_text(text):
+        return " ".join(text.lower().split())
+    
+    def priority(level):
+        return nullcontext()
+    
+    BATCH = 1
+    
+    def estimate_tokens(text):
+        return len(text.split())
+
+def dedupe_records(records):
+    """Drop web records that repeat an earlier URL or title"""
+    seen = set()
+    unique = []
+    for record in records:
+        key = record.get('url') or record.get('title', '').strip().lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(record)
+    return unique
+
+class StageTracker:
+    """Times pipeline stages and reports them to an optional on_event callback
+    
+    Events are dicts: {"stage": "intent"|"web"|"internal"|"synthesis",
+    "status": "start"|"done"|"failed"|"skipped", "seconds": ...}. They are
+    always emitted from the calling thread, so UI callbacks are safe.
+    
+    Every stage is also a tracing span under one "request" span, sharing
+    the tracker's trace_id. Clients add cache, byte and token details to
+    the active span; use activate() or bind() to run work inside a stage.
+    """
+    
+    def __init__(self, on_event=None, tracer=None):
+        self.on_event = on_event
+        self.timings = {}
+        self.started = {}
+        self.ended = {}
+        self.tracer = tracer or tracing.get_tracer()
+        self.trace_id = tracing.new_trace_id()
+        self.request_span = self.tracer.start_span("request", self.trace_id)
+        self.spans = {}
+    
+    def start(self, stage):
+        self.started[stage] = time.perf_counter()
+        self.spans[stage] = self.tracer.start_span(stage, parent=self.request_span)
+        self._emit({"stage": stage, "status": "start"})
+    
+    def mark_end(self, stage):
+        """Record when a stage really finished; safe to call from worker threads"""
+        self.ended.setdefault(stage, time.perf_counter())
+    
+    def finish(self, stage, status="done", **details):
+        elapsed = self.ended.pop(stage, time.perf_counter()) - self.started.get(stage, time.perf_counter())
+        seconds = round(elapsed, 3)
+        self.timings[stage] = seconds
+        span = self.spans.pop(stage, None)
+        if span is not None:
+            span.set(fallback=details.get('reason'), results=details.get('results'))
+            self.tracer.end_span(span, elapsed, "failed" if status == "failed" else "ok")
+        self._emit(dict({"stage": stage, "status": status, "seconds": seconds}, **details))
+    
+    def skip(self, stage):
+        self._emit({"stage": stage, "status": "skipped"})
+    
+    def activate(self, stage):
+        """Context manager making the stage's span the target of tracing.annotate"""
+        return tracing.activate(self.spans.get(stage))
+    
+    def bind(self, stage, function):
+        """Wrap function to run inside the stage's span, e.g. on a worker thread"""
+        return tracing.bind(self.spans.get(stage), function)
+    
+    def annotate(self, stage, **attributes):
+        span = self.spans.get(stage)
+        if span is not None:
+            span.set(**attributes)
+    
+    def close(self, status=None, **attributes):
+        """End the request span, and any stage spans still open as failed; later calls are ignored"""
+        if self.request_span is None:
+            return
+        for stage in list(self.spans):
+            self.tracer.end_span(self.spans.pop(stage), status="failed")
+        self.request_span.set(**attributes)
+        self.tracer.end_span(self.request_span, status=status)
+        self.request_span = None
+    
+    @contextmanager
+    def request(self, close=True):
+        """Close the request span as failed if the block raises, and (with close) when it ends"""
+        try:
+            yield self
+        except BaseException as e:
+            self.close(status="failed", error=str(e) or type(e).__name__)
+            raise
+        if close:
+            self.close()
+    
+    def _emit(self, event):
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(event)
+        except Exception as e:
+            print(f"⚠️ Progress callback failed: {e}")
 
 class FreeContextualAgent:
-    def __init__(self):
+    def __init__(self, searcher=None, ai=None, chroma=None, answer_cache=None):
         print("🔄 Initializing FreeContextualAgent...")
-        self.searcher = FreeSearchClient()
-        self.ai = FreeAIClient()
-        self.chroma = ChromaManager()
+        self.searcher = searcher or FreeSearchClient()
+        self.ai = ai or FreeAIClient()
+        self.chroma = chroma or get_chroma_manager()
+        # Agents on the real knowledge base get a semantic answer cache next to it;
+        # agents built from injected parts only use one if it is passed in
+        if answer_cache is None and chroma is None and SemanticAnswerCache and os.getenv('SEMANTIC_CACHE', '1') != '0':
+            try:
+                answer_cache = SemanticAnswerCache(getattr(self.chroma, 'db_path', None))
+            except Exception as e:
+                print(f"⚠️ Semantic answer cache unavailable: {e}")
+        self.answer_cache = answer_cache
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('AGENT_WORKERS', '8')),
+            thread_name_prefix="research"
+        )
+        self._request_limit = None
+        self._request_limit_loop = None
+        # Shared tracer; starts the /metrics endpoint when METRICS_PORT is set
+        self.tracer = tracing.get_tracer()
         print("✅ FreeContextualAgent initialized successfully!")
     
     def parse_intent_analysis(self, analysis_text):
@@ -58,45 +229,548 @@ class FreeContextualAgent:
             "internal_query": analysis_text[:100]
         }
     
-    def process_query(self, user_question):
-        """Main method to process user questions"""
+    def search_web(self, query):
+        """Web search step: structured records with duplicates removed"""
+        return dedupe_records(self.searcher.search(query))
+    
+    def search_internal(self, query, filters=None, boosts=None):
+        """Internal knowledge base step, narrowed by metadata filters and ranked by boosts when the intent has any"""
+        options = {key: value for key, value in (('filters', filters), ('boosts', boosts)) if value}
+        return self.chroma.hybrid_search(query, **options)
+    
+    def intent_filters(self, user_question, intent):
+        """Metadata filters from the intent, plus facets the question names with their field (e.g. project Ares)"""
+        filters = intent.get('filters')
+        filters = dict(filters) if isinstance(filters, dict) else {}
+        for field, value in self._question_facets('extract_filters', user_question).items():
+            filters.setdefault(field, value)
+        return {field: value for field, value in filters.items() if value}
+    
+    def intent_boosts(self, user_question, intent):
+        """Facet values the question only mentions (e.g. "quantum advances"); they rank results but never filter them"""
+        filters = intent.get('filters') or {}
+        return {
+            field: value for field, value in self._question_facets('extract_boosts', user_question).items()
+            if value and field not in filters
+        }
+    
+    def _question_facets(self, method, user_question):
+        extract = getattr(self.chroma, method, None)
+        if extract is None:
+            return {}
+        try:
+            facets = extract(user_question)
+            return facets if isinstance(facets, dict) else {}
+        except Exception as e:
+            print(f"⚠️ Could not extract metadata filters: {e}")
+            return {}
+    
+    def format_web_context(self, web_results):
+        """Compact plain-text rendering of web records for the synthesis prompt"""
+        if not web_results:
+            return ""
+        web_data = "Web Research:\n"
+        for i, record in enumerate(web_results, 1):
+            web_data += f"{i}. {record['title']}: {record['snippet']}"
+            web_data += f" (Source: {record['url']})\n" if record.get('url') else "\n"
+        return web_data
+    
+    def format_internal_context(self, internal_results):
+        """Plain-text rendering of internal hits for the synthesis prompt"""
+        if internal_results:
+            internal_data = "Internal Knowledge:\n"
+            for i, result in enumerate(internal_results, 1):
+                internal_data += f"{i}. {result['content']}\n"
+            return internal_data
+        return "No internal documents found."
+    
+    def build_context(self, intent, web_results, internal_results, depth=DEFAULT_DEPTH):
+        """Pack the retrieved passages into the depth's token budget and render them
+        
+        Returns (web_data, internal_data, context_stats).
+        """
+        web_selected, internal_selected, stats = ContextAssembler.for_depth(depth).assemble(web_results, internal_results)
+        web_data = self.format_web_context(web_selected)
+        internal_data = self.format_internal_context(internal_selected) if intent.get('needs_internal', True) else ""
+        return web_data, internal_data, stats
+    
+    def _build_result(self, intent, answer, web_results, internal_results, fallbacks, context_stats=None, timings=None, trace_id=None):
+        return {
+            "answer": answer,
+            "sources_used": {
+                "web": intent.get('needs_web', False) and 'web' not in fallbacks,
+                "internal": intent.get('needs_internal', False) and 'internal' not in fallbacks
+            },
+            "intent_analysis": intent,
+            "web_results": web_results,
+            "internal_results": internal_results,
+            "fallbacks": fallbacks,
+            "context_stats": context_stats or {},
+            "timings": timings if timings is not None else {},
+            "trace_id": trace_id
+        }
+    
+    def cached_result(self, user_question, depth, tracker):
+        """Result for a near-duplicate past question, or None to run the pipeline"""
+        if self.answer_cache is None:
+            return None
+        tracker.start('cache')
+        with tracker.activate('cache'):
+            entry = self._lookup_answer(user_question, depth)
+        return self._cache_outcome(entry, tracker)
+    
+    async def acached_result(self, user_question, depth, tracker):
+        """Async variant of cached_result; the lookup runs on a thread, stage events stay on the loop"""
+        if self.answer_cache is None:
+            return None
+        tracker.start('cache')
+        entry = await run_blocking(tracker.bind('cache', self._lookup_answer), user_question, depth)
+        return self._cache_outcome(entry, tracker)
+    
+    def _lookup_answer(self, user_question, depth):
+        try:
+            return self.answer_cache.lookup(user_question, depth)
+        except Exception as e:
+            print(f"⚠️ Semantic cache lookup failed: {e}")
+            return None
+    
+    def _cache_outcome(self, entry, tracker):
+        """Finish the cache stage; on a hit, close the request and build its result"""
+        tracker.annotate('cache', cache="miss" if entry is None else "hit")
+        if entry is None:
+            tracker.finish('cache', status="miss")
+            return None
+        tracker.finish('cache', similarity=entry['similarity'])
+        tracker.close(cache="hit")
+        print(f"♻️ Reusing report for similar question: {entry['question']}")
+        result = self._build_result(
+            entry['intent'], entry['answer'], entry.get('web_results', []), entry.get('internal_results', []), {},
+            timings=tracker.timings, trace_id=tracker.trace_id
+        )
+        result['sources_used'] = entry['sources_used']
+        result['cache'] = {key: entry[key] for key in ('question', 'similarity', 'age_seconds')}
+        return result
+    
+    def remember(self, user_question, depth, result):
+        """Add a completed result to the semantic cache; degraded answers are skipped"""
+        if self.answer_cache is None or result['fallbacks']:
+            return
+        try:
+            self.answer_cache.store(user_question, depth, result)
+        except Exception as e:
+            print(f"⚠️ Could not cache answer: {e}")
+    
+    def gather_sources(self, user_question, intent, tracker=None):
+        """Run web and internal retrieval concurrently, each with its own deadline
+        
+        Returns (web_results, internal_results, fallbacks) where fallbacks
+        maps a source that was late or failed to the reason it was dropped.
+        """
+        tracker = tracker or StageTracker()
+        start = time.monotonic()
+        tasks = {}
+        if intent.get('needs_web', True):
+            web_query = intent.get('web_query', user_question)
+            tracker.start('web')
+            tasks['web'] = (self.executor.submit(tracker.bind('web', self.search_web), web_query), WEB_SEARCH_TIMEOUT)
+        else:
+            tracker.skip('web')
+        if intent.get('needs_internal', True):
+            internal_query = intent.get('internal_query', user_question)
+            tracker.start('internal')
+            search_internal = tracker.bind('internal', self.search_internal)
+            tasks['internal'] = (
+                self.executor.submit(search_internal, internal_query, intent.get('filters'), intent.get('boosts')),
+                INTERNAL_SEARCH_TIMEOUT
+            )
+        else:
+            tracker.skip('internal')
+        for source, (future, _) in tasks.items():
+            future.add_done_callback(lambda _, source=source: tracker.mark_end(source))
+        
+        data = {'web': [], 'internal': []}
+        fallbacks = {}
+        for source, (future, timeout) in sorted(tasks.items(), key=lambda item: item[1][1]):
+            remaining = max(0.0, start + timeout - time.monotonic())
+            try:
+                data[source] = future.result(timeout=remaining)
+                tracker.finish(source, results=len(data[source]))
+            except FutureTimeout:
+                future.cancel()
+                fallbacks[source] = f"timed out after {timeout:.1f}s"
+                print(f"⚠️ {source} search {fallbacks[source]}, continuing without it")
+                tracker.finish(source, status="failed", reason=fallbacks[source])
+            except Exception as e:
+                fallbacks[source] = f"error: {e}"
+                print(f"⚠️ {source} search failed: {e}")
+                tracker.finish(source, status="failed", reason=fallbacks[source])
+        
+        return data['web'], data['internal'], fallbacks
+    
+    def analyze(self, user_question, tracker):
+        """Intent step, timed as the 'intent' stage"""
+        tracker.start('intent')
+        with tracker.activate('intent'):
+            intent = self.parse_intent_analysis(self.ai.analyze_intent(user_question))
+        intent['filters'] = self.intent_filters(user_question, intent)
+        intent['boosts'] = self.intent_boosts(user_question, intent)
+        tracker.finish('intent')
+        return intent
+    
+    def process_query(self, user_question, depth=DEFAULT_DEPTH, on_event=None):
+        """Main method to process user questions
+        
+        depth sets the context token budget; on_event, if given, receives a
+        stage event as intent, web, internal and synthesis start and finish.
+        """
         print(f"🔍 Processing: {user_question}")
+        tracker = StageTracker(on_event)
+        with tracker.request():
+            cached = self.cached_result(user_question, depth, tracker)
+            if cached:
+                return cached
+            
+            # Step 1: Analyze intent
+            intent = self.analyze(user_question, tracker)
+            
+            # Step 2: Gather data from both sources in parallel
+            web_results, internal_results, fallbacks = self.gather_sources(user_question, intent, tracker)
+            web_data, internal_data, context_stats = self.build_context(intent, web_results, internal_results, depth)
+            
+            # Step 3: Synthesize answer
+            tracker.start('synthesis')
+            with tracker.activate('synthesis'):
+                final_answer = self.ai.synthesize_answer(user_question, web_data, internal_data)
+            tracker.finish('synthesis')
+            tracker.close()
+        
+        result = self._build_result(intent, final_answer, web_results, internal_results, fallbacks, context_stats, tracker.timings, tracker.trace_id)
+        self.remember(user_question, depth, result)
+        return result
+
+    def stream_query(self, user_question, depth=DEFAULT_DEPTH, on_event=None):
+        """process_query with a streamed answer
         
-        # Step 1: Analyze intent
-        intent_analysis = self.ai.analyze_intent(user_question)
-        intent = self.parse_intent_analysis(intent_analysis)
+        Retrieval runs up front; the returned result has answer=None and an
+        'answer_stream' generator of report text. Once the stream is consumed
+        result['answer'] holds the full report.
+        """
+        print(f"🔍 Processing (streaming): {user_question}")
+        tracker = StageTracker(on_event)
+        # The request span stays open until the answer stream is consumed
+        with tracker.request(close=False):
+            cached = self.cached_result(user_question, depth, tracker)
+            if cached:
+                cached['answer_stream'] = iter([cached['answer']])
+                return cached
+            
+            intent = self.analyze(user_question, tracker)
+            web_results, internal_results, fallbacks = self.gather_sources(user_question, intent, tracker)
+            web_data, internal_data, context_stats = self.build_context(intent, web_results, internal_results, depth)
+        
+        result = self._build_result(intent, None, web_results, internal_results, fallbacks, context_stats, tracker.timings, tracker.trace_id)
         
-        # Step 2: Gather data
-        web_data = ""
-        internal_data = ""
+        def answer_stream():
+            with tracker.request():
+                parts = []
+                tracker.start('synthesis')
+                for chunk in self.ai.stream_answer(user_question, web_data, internal_data):
+                    if not parts:
+                        tracker.timings['first_chunk'] = round(time.perf_counter() - tracker.started['synthesis'], 3)
+                    parts.append(chunk)
+                    yield chunk
+                result['answer'] = "".join(parts)
+                self.annotate_stream(tracker, user_question, web_data, internal_data, result['answer'])
+                tracker.finish('synthesis')
+            self.remember(user_question, depth, result)
         
+        result['answer_stream'] = answer_stream()
+        return result
+    
+    def annotate_stream(self, tracker, user_question, web_data, internal_data, answer):
+        """Size of a streamed synthesis; the stream runs outside the span, so the agent records it"""
+        context = f"{user_question}{web_data}{internal_data}"
+        tracker.annotate(
+            'synthesis', first_chunk_seconds=tracker.timings.get('first_chunk'),
+            tokens_in=estimate_tokens(context), tokens_out=estimate_tokens(answer),
+            bytes_in=len(context.encode('utf-8')), bytes_out=len(answer.encode('utf-8'))
+        )
+    
+    def _async_limiter(self):
+        """Semaphore bounding concurrent aprocess_query and astream_query calls on the running loop"""
+        loop = asyncio.get_running_loop()
+        if self._request_limit_loop is not loop:
+            self._request_limit = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+            self._request_limit_loop = loop
+        return self._request_limit
+    
+    async def _agather_source(self, source, pending, timeout, fallbacks, tracker):
+        """Await one started source with its own deadline, recording why it was dropped"""
+        try:
+            results = await asyncio.wait_for(pending, timeout)
+            tracker.finish(source, results=len(results))
+            return results
+        except asyncio.TimeoutError:
+            fallbacks[source] = f"timed out after {timeout:.1f}s"
+            print(f"⚠️ {source} search {fallbacks[source]}, continuing without it")
+        except Exception as e:
+            fallbacks[source] = f"error: {e}"
+            print(f"⚠️ {source} search failed: {e}")
+        tracker.finish(source, status="failed", reason=fallbacks[source])
+        return []
+    
+    async def asearch_web(self, query):
+        """Async variant of search_web"""
+        return dedupe_records(await self.searcher.asearch(query))
+    
+    async def agather_sources(self, user_question, intent, tracker=None):
+        """Async variant of gather_sources"""
+        tracker = tracker or StageTracker()
+        loop = asyncio.get_running_loop()
+        fallbacks = {}
+        tasks = {}
         if intent.get('needs_web', True):
             web_query = intent.get('web_query', user_question)
-            web_data = self.searcher.query(web_query)
-        
+            tracker.start('web')
+            # The task copies the context, so the search runs inside the web span
+            with tracker.activate('web'):
+                web = asyncio.ensure_future(self.asearch_web(web_query))
+            tasks['web'] = self._agather_source('web', web, WEB_SEARCH_TIMEOUT, fallbacks, tracker)
+        else:
+            tracker.skip('web')
         if intent.get('needs_internal', True):
             internal_query = intent.get('internal_query', user_question)
-            internal_results = self.chroma.hybrid_search(internal_query)
+            tracker.start('internal')
+            internal = loop.run_in_executor(
+                self.executor, tracker.bind('internal', self.search_internal),
+                internal_query, intent.get('filters'), intent.get('boosts')
+            )
+            tasks['internal'] = self._agather_source('internal', internal, INTERNAL_SEARCH_TIMEOUT, fallbacks, tracker)
+        else:
+            tracker.skip('internal')
+        
+        results = dict(zip(tasks, await asyncio.gather(*tasks.values())))
+        return results.get('web', []), results.get('internal', []), fallbacks
+    
+    async def aanalyze(self, user_question, tracker):
+        """Async variant of analyze"""
+        tracker.start('intent')
+        with tracker.activate('intent'):
+            intent = self.parse_intent_analysis(await self.ai.aanalyze_intent(user_question))
+        intent['filters'] = self.intent_filters(user_question, intent)
+        intent['boosts'] = self.intent_boosts(user_question, intent)
+        tracker.finish('intent')
+        return intent
+    
+    async def aprocess_query(self, user_question, depth=DEFAULT_DEPTH, on_event=None):
+        """Asyncio-native process_query; concurrency is bounded by MAX_CONCURRENT_REQUESTS"""
+        async with self._async_limiter():
+            print(f"🔍 Processing: {user_question}")
+            tracker = StageTracker(on_event)
+            with tracker.request():
+                cached = await self.acached_result(user_question, depth, tracker)
+                if cached:
+                    return cached
+                
+                intent = await self.aanalyze(user_question, tracker)
+                
+                web_results, internal_results, fallbacks = await self.agather_sources(user_question, intent, tracker)
+                web_data, internal_data, context_stats = self.build_context(intent, web_results, internal_results, depth)
+                
+                tracker.start('synthesis')
+                with tracker.activate('synthesis'):
+                    final_answer = await self.ai.asynthesize_answer(user_question, web_data, internal_data)
+                tracker.finish('synthesis')
             
-            if internal_results:
-                internal_data = "Internal Knowledge:\n"
-                for i, result in enumerate(internal_results, 1):
-                    internal_data += f"{i}. {result['content']}\n"
-            else:
-                internal_data = "No internal documents found."
+            result = self._build_result(intent, final_answer, web_results, internal_results, fallbacks, context_stats, tracker.timings, tracker.trace_id)
+            await run_blocking(self.remember, user_question, depth, result)
+            return result
+
+    async def astream_query(self, user_question, depth=DEFAULT_DEPTH, on_event=None):
+        """Async variant of stream_query; 'answer_stream' is an async iterator
         
-        # Step 3: Synthesize answer
-        final_answer = self.ai.synthesize_answer(user_question, web_data, internal_data)
+        The request holds one of the MAX_CONCURRENT_REQUESTS slots until its
+        answer stream is exhausted, closed or garbage collected.
+        """
+        limiter = self._async_limiter()
+        await limiter.acquire()
+        released = False
         
-        return {
-            "answer": final_answer,
-            "sources_used": {
-                "web": intent.get('needs_web', False),
-                "internal": intent.get('needs_internal', False)
-            },
-            "intent_analysis": intent
-        }
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                limiter.release()
+        
+        print(f"🔍 Processing (streaming): {user_question}")
+        tracker = StageTracker(on_event)
+        try:
+            with tracker.request(close=False):
+                cached = await self.acached_result(user_question, depth, tracker)
+                if cached:
+                    release()
+                    async def replay():
+                        yield cached['answer']
+                    cached['answer_stream'] = replay()
+                    return cached
+                
+                intent = await self.aanalyze(user_question, tracker)
+                web_results, internal_results, fallbacks = await self.agather_sources(user_question, intent, tracker)
+                web_data, internal_data, context_stats = self.build_context(intent, web_results, internal_results, depth)
+        except BaseException:
+            release()
+            raise
+        
+        result = self._build_result(intent, None, web_results, internal_results, fallbacks, context_stats, tracker.timings, tracker.trace_id)
+        
+        async def answer_stream():
+            try:
+                with tracker.request():
+                    parts = []
+                    tracker.start('synthesis')
+                    async for chunk in self.ai.astream_answer(user_question, web_data, internal_data):
+                        if not parts:
+                            tracker.timings['first_chunk'] = round(time.perf_counter() - tracker.started['synthesis'], 3)
+                        parts.append(chunk)
+                        yield chunk
+                    result['answer'] = "".join(parts)
+                    self.annotate_stream(tracker, user_question, web_data, internal_data, result['answer'])
+                    tracker.finish('synthesis')
+                await run_blocking(self.remember, user_question, depth, result)
+            finally:
+                release()
+        
+        result['answer_stream'] = answer_stream()
+        # A stream that is never iterated still gives its slot back
+        weakref.finalize(result['answer_stream'], release)
+        return result
 
+    def search_internal_batch(self, queries, filters, boosts=None):
+        """Internal search for many queries, batched when the knowledge base supports it"""
+        boosts = boosts or [None] * len(queries)
+        batch_search = getattr(self.chroma, 'batch_hybrid_search', None)
+        if batch_search is None:
+            return [self.search_internal(*args) for args in zip(queries, filters, boosts)]
+        if any(boosts):
+            return batch_search(queries, filters=filters, boosts=boosts)
+        return batch_search(queries, filters=filters)
+    
+    def _batch_call(self, function, *args):
+        """Run a batch step at BATCH priority so interactive Gemini calls go first"""
+        with priority(BATCH):
+            return function(*args)
+    
+    def _batch_prepare(self, question, depth, tracker):
+        """Cached result for question, or its intent"""
+        with tracker.request(close=False):
+            cached = self.cached_result(question, depth, tracker)
+            if cached:
+                return cached, None
+            return None, self.analyze(question, tracker)
+    
+    def _batch_synthesize(self, question, depth, state):
+        intent, tracker = state['intent'], state['tracker']
+        with tracker.request(close=False):
+            web_data, internal_data, context_stats = self.build_context(intent, state['web'], state['internal'], depth)
+            tracker.start('synthesis')
+            with tracker.activate('synthesis'):
+                final_answer = self.ai.synthesize_answer(question, web_data, internal_data)
+            tracker.finish('synthesis')
+        tracker.close(batch=True)
+        result = self._build_result(intent, final_answer, state['web'], state['internal'], state['fallbacks'], context_stats, tracker.timings, tracker.trace_id)
+        self.remember(question, depth, result)
+        return result
+    
+    def process_batch(self, questions, depth=DEFAULT_DEPTH, max_concurrency=None):
+        """Research many questions with shared retrieval, yielding (index, result) as each finishes
+        
+        Intents are analysed concurrently, then every internal query is run
+        through one batched knowledge base search, identical web queries are
+        searched once, and each answer is synthesised as soon as its sources
+        are in. Network calls share a pool of max_concurrency threads
+        (BATCH_CONCURRENCY) and Gemini calls run at BATCH priority. Unlike
+        process_query there are no per-source deadlines; a failing source
+        still falls back.
+        """
+        questions = list(questions)
+        print(f"🔍 Processing batch of {len(questions)} questions")
+        states = {}
+        with ThreadPoolExecutor(max_workers=max_concurrency or BATCH_CONCURRENCY, thread_name_prefix="batch") as pool:
+            # Step 1: semantic cache and intent per question
+            prepared = {}
+            for index, question in enumerate(questions):
+                tracker = StageTracker()
+                prepared[pool.submit(self._batch_call, self._batch_prepare, question, depth, tracker)] = (index, tracker)
+            for future in as_completed(prepared):
+                index, tracker = prepared[future]
+                cached, intent = future.result()
+                if cached:
+                    yield index, cached
+                    continue
+                states[index] = {"intent": intent, "tracker": tracker, "web": [], "internal": [], "fallbacks": {}, "waiting": set()}
+            
+            # Step 2: shared retrieval; one internal batch, one search per distinct web query
+            retrieval = {}
+            
+            def submit(source, rows, function, *args):
+                for index in rows:
+                    states[index]['waiting'].add(source)
+                    states[index]['tracker'].start(source)
+                # Shared work is traced under the first question's span
+                retrieval[pool.submit(states[rows[0]]['tracker'].bind(source, function), *args)] = (source, rows)
+            
+            internal_rows = [index for index in states if states[index]['intent'].get('needs_internal', True)]
+            if internal_rows:
+                queries = [states[index]['intent'].get('internal_query', questions[index]) for index in internal_rows]
+                filters = [states[index]['intent'].get('filters') for index in internal_rows]
+                boosts = [states[index]['intent'].get('boosts') for index in internal_rows]
+                submit('internal', internal_rows, self.search_internal_batch, queries, filters, boosts)
+            web_rows = {}
+            for index in states:
+                if states[index]['intent'].get('needs_web', True):
+                    web_query = states[index]['intent'].get('web_query', questions[index])
+                    web_rows.setdefault(normalize_text(web_query), (web_query, []))[1].append(index)
+            for web_query, rows in web_rows.values():
+                submit('web', rows, self.search_web, web_query)
+            print(f"ℹ️  {len(web_rows)} distinct web queries, {len(internal_rows)} internal queries in one batch")
+            
+            # Step 3: synthesise each question once its sources are in
+            synthesis = {}
+            for index, state in states.items():
+                if not state['waiting']:
+                    synthesis[pool.submit(self._batch_call, self._batch_synthesize, questions[index], depth, state)] = index
+            pending = set(retrieval) | set(synthesis)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in synthesis:
+                        yield synthesis[future], future.result()
+                        continue
+                    source, rows = retrieval[future]
+                    try:
+                        results = future.result()
+                        error = None
+                    except Exception as e:
+                        error = f"error: {e}"
+                        print(f"⚠️ batch {source} search failed: {e}")
+                    for position, index in enumerate(rows):
+                        state = states[index]
+                        if error:
+                            state['fallbacks'][source] = error
+                            state['tracker'].finish(source, status="failed", reason=error)
+                        else:
+                            state[source] = results[position] if source == 'internal' else results
+                            state['tracker'].finish(source, results=len(state[source]))
+                        state['waiting'].discard(source)
+                        if not state['waiting']:
+                            next_future = pool.submit(self._batch_call, self._batch_synthesize, questions[index], depth, state)
+                            synthesis[next_future] = index
+                            pending.add(next_future)
+    
+    def get_metrics(self):
+        """Per-stage latency histograms and counters in Prometheus text format"""
+        return self.tracer.metrics.render()
+    
     def get_agent_info(self):
         """Get information about the agent's capabilities"""
         return {
@@ -0,0 +1,122 @@
+import os
+import threading
+import numpy as np
+from chroma_manager import get_embedder, embed_query, DEFAULT_EMBEDDING_MODEL
+
+# Minimum probability of the best route before we trust it over the LLM
+INTENT_ROUTER_THRESHOLD = float(os.getenv('INTENT_ROUTER_THRESHOLD', '0.6'))
+# Questions this far from every prototype are off-distribution; leave them to the LLM
+INTENT_ROUTER_MIN_SIMILARITY = float(os.getenv('INTENT_ROUTER_MIN_SIMILARITY', '0.3'))
+# Softmax temperature over cosine similarities; lower is more decisive
+INTENT_ROUTER_TEMPERATURE = float(os.getenv('INTENT_ROUTER_TEMPERATURE', '0.05'))
+
+# Example questions per route; each route's prototype is the mean of their embeddings
+PROTOTYPE_QUESTIONS = {
+    "web": [
+        "What are the latest developments in quantum computing?",
+        "Latest news about electric vehicle batteries",
+        "Current market trends in renewable energy",
+        "What happened this week in AI regulation?",
+        "Recent breakthroughs in solid-state battery technology",
+        "Who are the leading companies in the semiconductor market today?",
+        "New government policies on data privacy in 2024",
+        "What is the current price trend for lithium?"
+    ],
+    "internal": [
+        "What is the status of our internal battery research project?",
+        "Summarize our company documents on compliance",
+        "Which team owns project Ares?",
+        "What did our internal report conclude about energy density?",
+        "Show our team's research notes on quantum error correction",
+        "What resources are allocated to our project roadmap?",
+        "Find the internal file describing our testing methodology",
+        "What are the technical specifications of our prototype?"
+    ],
+    "both": [
+        "Compare our battery technology with recent market breakthroughs",
+        "How does our AI compliance readiness compare to new regulations?",
+        "Analyze current renewable energy trends and our investment position",
+        "Our quantum research versus the latest industry advances",
+        "Is our internal project competitive with what competitors announced?",
+        "Assess the impact of recent regulation on our company's projects",
+        "How do market trends affect our internal research priorities?",
+        "Benchmark our team's results against the latest published results"
+    ]
+}
+
+ROUTE_NEEDS = {
+    "web": (True, False),
+    "internal": (False, True),
+    "both": (True, True)
+}
+
+class IntentRouter:
+    """Local intent classifier over question embeddings
+
+    Uses the shared MiniLM embedder (see chroma_manager.get_embedder), so it
+    adds no model load of its own. route() returns the source flags when the
+    best prototype wins with enough probability, and None when the caller
+    should fall back to the LLM.
+    """
+
+    def __init__(self, model_name=DEFAULT_EMBEDDING_MODEL, threshold=INTENT_ROUTER_THRESHOLD,
+                 min_similarity=INTENT_ROUTER_MIN_SIMILARITY, temperature=INTENT_ROUTER_TEMPERATURE, prototypes=None):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.min_similarity = min_similarity
+        self.temperature = temperature
+        self.prototype_questions = prototypes or PROTOTYPE_QUESTIONS
+        self.labels = list(self.prototype_questions)
+        self.lock = threading.Lock()
+        self.prototypes = None
+        self.routed = 0
+        self.escalated = 0
+
+    def _prototype_matrix(self):
+        """Normalised prototype vectors, one row per label, built on first use"""
+        with self.lock:
+            if self.prototypes is None:
+                embedder = get_embedder(self.model_name)
+                rows = []
+                for label in self.labels:
+                    vectors = np.asarray(embedder.encode(self.prototype_questions[label]), dtype=np.float32)
+                    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+                    centroid = vectors.mean(axis=0)
+                    rows.append(centroid / max(np.linalg.norm(centroid), 1e-12))
+                self.prototypes = np.stack(rows)
+            return self.prototypes
+
+    def classify(self, question):
+        """Return (label, probability, similarity) for the closest prototype"""
+        prototypes = self._prototype_matrix()
+        vector = np.asarray(embed_query(question, self.model_name), dtype=np.float32)
+        vector /= max(np.linalg.norm(vector), 1e-12)
+        similarities = prototypes @ vector
+        logits = (similarities - similarities.max()) / self.temperature
+        probabilities = np.exp(logits) / np.exp(logits).sum()
+        best = int(probabilities.argmax())
+        return self.labels[best], float(probabilities[best]), float(similarities[best])
+
+    def route(self, question):
+        """Source flags for a confident route, or None to escalate"""
+        label, probability, similarity = self.classify(question)
+        if probability < self.threshold or similarity < self.min_similarity:
+            self.escalated += 1
+            return None
+        self.routed += 1
+        needs_web, needs_internal = ROUTE_NEEDS[label]
+        return {
+            "needs_web": needs_web,
+            "needs_internal": needs_internal,
+            "confidence": "high" if probability >= 0.85 else "medium",
+            "route": label,
+            "route_probability": round(probability, 3)
+        }
+
+    def stats(self):
+        decisions = self.routed + self.escalated
+        return {
+            "routed": self.routed,
+            "escalated": self.escalated,
+            "local_rate": self.routed / decisions if decisions else 0.0
+        }
@@ -0,0 +1,74 @@
+import os
+import json
+
+# Journal entries allowed before a save compacts them into the snapshot; the
+# effective limit is max(JOURNAL_COMPACT_MIN, documents in the index), so
+# compaction cost is amortized to O(1) rewritten entries per change.
+JOURNAL_COMPACT_MIN = int(os.getenv('JOURNAL_COMPACT_MIN', '1000'))
+
+class Journal:
+    """Append-only JSON-lines log of changes made since the last snapshot
+
+    Indexes keep a full JSON snapshot at `path` and append each save's
+    changes to `path`.log, so a save writes only what changed. Replaying
+    the log over the snapshot restores the latest state.
+    """
+
+    def __init__(self, snapshot_path):
+        self.snapshot_path = snapshot_path
+        self.path = f"{snapshot_path}.log" if snapshot_path else None
+        self.entries = 0
+
+    def replay(self):
+        """Yield logged entries in order
+
+        A torn final line from a crash is cut off, so later appends start on
+        a fresh line.
+        """
+        self.entries = 0
+        if not self.path or not os.path.exists(self.path):
+            return
+        good = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                good += len(line)
+                self.entries += 1
+                yield entry
+        if good < os.path.getsize(self.path):
+            with open(self.path, 'ab') as f:
+                f.truncate(good)
+
+    def should_compact(self, size):
+        """True once the log holds more entries than a snapshot of `size` documents"""
+        return self.entries > max(JOURNAL_COMPACT_MIN, size)
+
+    def append(self, entries):
+        """Append entries; one JSON object per line"""
+        if not self.path or not entries:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        self.entries += len(entries)
+
+    def write_snapshot(self, data):
+        """Atomically replace the snapshot, then empty the log it now contains
+
+        The log is only truncated after the snapshot is in place; a crash in
+        between replays entries the snapshot already holds, which is harmless
+        because each entry sets a document's final value.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.snapshot_path)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.entries = 0
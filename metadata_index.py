@@ -0,0 +1,186 @@
+import os
+import re
+import json
+import threading
+from journal import Journal
+
+# Metadata fields that are per-document identifiers rather than facets
+UNINDEXED_FIELDS = {"path", "filename", "added_date", "parent_id", "chunk_index", "chunk_count", "content_hash"}
+
+def to_where(filters):
+    """Translate {field: value or [values]} into a Chroma where clause"""
+    clauses = []
+    for field, value in sorted(filters.items()):
+        if isinstance(value, (list, tuple, set)):
+            values = sorted(value)
+            clauses.append({field: values[0]} if len(values) == 1 else {field: {"$in": values}})
+        else:
+            clauses.append({field: value})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+class MetadataIndex:
+    """Inverted index from metadata (field, value) to document ids
+
+    Kept next to the BM25 index so filtered queries can resolve their
+    candidate set without touching the collection. Saves are journaled
+    like BM25Index's. With path=None the index lives in memory only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.doc_facets = {}    # doc_id -> {field: value}
+        self.postings = {}      # field -> {value: set(doc_ids)}
+        self.journal = Journal(path)
+        self.changed = set()    # doc_ids added or removed since the last save
+        self.load()
+
+    def __len__(self):
+        return len(self.doc_facets)
+
+    def _facets(self, metadata):
+        return {
+            field: value for field, value in (metadata or {}).items()
+            if field not in UNINDEXED_FIELDS and isinstance(value, str)
+        }
+
+    def add(self, doc_id, metadata):
+        """Index (or re-index) a document's metadata"""
+        with self.lock:
+            self._set(doc_id, self._facets(metadata))
+            self.changed.add(doc_id)
+
+    def remove(self, doc_id):
+        """Drop a document from the index"""
+        with self.lock:
+            self._drop(doc_id)
+            self.changed.add(doc_id)
+
+    def _set(self, doc_id, facets):
+        if doc_id in self.doc_facets:
+            self._drop(doc_id)
+        self.doc_facets[doc_id] = facets
+        for field, value in facets.items():
+            self.postings.setdefault(field, {}).setdefault(value, set()).add(doc_id)
+
+    def _drop(self, doc_id):
+        facets = self.doc_facets.pop(doc_id, None)
+        if facets is None:
+            return
+        for field, value in facets.items():
+            docs = self.postings.get(field, {}).get(value)
+            if docs is not None:
+                docs.discard(doc_id)
+                if not docs:
+                    del self.postings[field][value]
+                    if not self.postings[field]:
+                        del self.postings[field]
+
+    def match(self, filters):
+        """Ids of documents matching every field; a list of values matches any of them"""
+        with self.lock:
+            candidates = None
+            for field, value in filters.items():
+                values = value if isinstance(value, (list, tuple, set)) else [value]
+                field_postings = self.postings.get(field, {})
+                matched = set()
+                for item in values:
+                    matched |= field_postings.get(str(item), set())
+                candidates = matched if candidates is None else candidates & matched
+                if not candidates:
+                    return set()
+            return set(self.doc_facets) if candidates is None else candidates
+
+    def values(self, field):
+        """Known values of a field"""
+        with self.lock:
+            return list(self.postings.get(field, {}))
+
+    def normalize_filters(self, filters):
+        """Keep only known fields and values, mapped to their stored spelling"""
+        normalized = {}
+        for field, value in (filters or {}).items():
+            known = {item.lower(): item for item in self.values(field)}
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            matched = [known[str(item).lower()] for item in values if str(item).lower() in known]
+            if matched:
+                normalized[field] = matched[0] if len(matched) == 1 else matched
+        return normalized
+
+    def _scan(self, text, fields):
+        """(explicit, mentioned) facet values found in text
+
+        A value is explicit when its field is named next to it ("project
+        Ares", "quarter: Q2", "Ares project"); any other occurrence is only
+        a mention. Short values such as IT or Q3 must match case-sensitively.
+        """
+        explicit, mentioned = {}, {}
+        for field in fields:
+            field_pattern = rf"(?i:{re.escape(field)})"
+            for value in self.values(field):
+                value_pattern = re.escape(value) if len(value) <= 3 else rf"(?i:{re.escape(value)})"
+                named = rf"(?<!\w)(?:{field_pattern}\s*[:=]?\s*{value_pattern}|{value_pattern}\s+{field_pattern})(?!\w)"
+                if re.search(named, text):
+                    explicit.setdefault(field, []).append(value)
+                elif re.search(rf"(?<!\w){value_pattern}(?!\w)", text):
+                    mentioned.setdefault(field, []).append(value)
+        collapse = lambda found: {field: values[0] if len(values) == 1 else values for field, values in found.items()}
+        return collapse(explicit), collapse(mentioned)
+
+    def extract_filters(self, text, fields):
+        """Filters for facet values named together with their field, e.g. 'project Ares' -> {'project': 'Ares'}
+
+        A bare value in prose ("quantum advances", "Q2 2024 report") is too
+        weak to exclude documents; see extract_boosts.
+        """
+        return self._scan(text, fields)[0]
+
+    def extract_boosts(self, text, fields):
+        """Facet values mentioned in text without their field, for ranking rather than filtering"""
+        explicit, mentioned = self._scan(text, fields)
+        return {field: value for field, value in mentioned.items() if field not in explicit}
+
+    def boosted(self, boosts):
+        """doc_id -> number of boost fields the document matches"""
+        counts = {}
+        for field, value in (boosts or {}).items():
+            for doc_id in self.match({field: value}):
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+        return counts
+
+    def save(self, compact=False):
+        """Persist changes since the last save; compact=True rewrites the snapshot"""
+        if not self.path:
+            return
+        with self.lock:
+            if not self.changed and not compact:
+                return
+            self.journal.append([{"id": doc_id, "facets": self.doc_facets.get(doc_id)} for doc_id in self.changed])
+            self.changed.clear()
+            if compact or self.journal.should_compact(len(self.doc_facets)):
+                self.journal.write_snapshot({"docs": self.doc_facets})
+
+    def load(self):
+        """Load the snapshot and replay the journal, if they exist"""
+        if not self.path:
+            return
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Could not load metadata index, rebuilding: {e}")
+                return
+        with self.lock:
+            self.doc_facets = {}
+            self.postings = {}
+            for doc_id, facets in data.get("docs", {}).items():
+                self._set(doc_id, facets)
+            for entry in self.journal.replay():
+                if entry["facets"] is None:
+                    self._drop(entry["id"])
+                else:
+                    self._set(entry["id"], entry["facets"])
@@ -0,0 +1,213 @@
+import os
+import time
+import heapq
+import asyncio
+import hashlib
+import threading
+import itertools
+import contextvars
+from contextlib import contextmanager
+
+# Gemini free-tier ceilings; requests beyond them wait in a queue instead of failing
+GEMINI_RPM = float(os.getenv('GEMINI_RPM', '60'))
+GEMINI_TPM = float(os.getenv('GEMINI_TPM', '32000'))
+# Requests allowed back to back before the per-minute rate kicks in
+GEMINI_BURST = float(os.getenv('GEMINI_BURST', '5'))
+# Longest a request may queue before the caller falls back
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '30'))
+
+INTERACTIVE = 0
+BATCH = 1
+
+# Priority of LLM calls made from the current context; see priority()
+request_priority = contextvars.ContextVar('request_priority', default=INTERACTIVE)
+
+@contextmanager
+def priority(level):
+    """Run the enclosed LLM calls at the given priority (INTERACTIVE or BATCH)"""
+    token = request_priority.set(level)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+class RateLimitTimeout(Exception):
+    """A request waited longer than its timeout for quota"""
+
+class TokenBucket:
+    """Refills at rate_per_minute up to capacity; balance may go negative after under-estimates"""
+
+    def __init__(self, rate_per_minute, capacity):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.balance = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.balance = min(self.capacity, self.balance + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount can be taken (0 if available now)"""
+        self._refill(now)
+        # Requests larger than the bucket only need it full
+        needed = min(amount, self.capacity)
+        if self.balance >= needed:
+            return 0.0
+        return (needed - self.balance) / self.rate
+
+    def take(self, amount):
+        self.balance -= amount
+
+class RateLimiter:
+    """Token-bucket limiter with a priority queue and per-key accounting
+
+    Each key (an API key hash) gets its own request and token buckets and
+    its own queue. Only the head of a queue may take quota, and interactive
+    requests are queued ahead of batch ones, so bursts are smoothed in
+    priority order instead of failing.
+    """
+
+    def __init__(self, rpm=GEMINI_RPM, tpm=GEMINI_TPM, burst=GEMINI_BURST, max_wait=RATE_LIMIT_MAX_WAIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst = burst
+        self.max_wait = max_wait
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.buckets = {}     # key -> (request bucket, token bucket)
+        self.queues = {}      # key -> heap of (priority, sequence)
+        self.accounts = {}    # key -> usage counters
+
+    def _state(self, key):
+        if key not in self.buckets:
+            token_burst = self.tpm * self.burst / self.rpm if self.rpm else self.tpm
+            self.buckets[key] = (TokenBucket(self.rpm, self.burst), TokenBucket(self.tpm, max(token_burst, 1.0)))
+            self.queues[key] = []
+            self.accounts[key] = {
+                "requests": 0, "tokens": 0, "queued": 0, "waited_seconds": 0.0,
+                "max_wait_seconds": 0.0, "timeouts": 0
+            }
+        return self.buckets[key], self.queues[key], self.accounts[key]
+
+    def _enqueue(self, key, level):
+        _, queue, account = self._state(key)
+        ticket = (level, next(self.sequence))
+        heapq.heappush(queue, ticket)
+        account["queued"] += 1
+        return ticket
+
+    def _poll(self, key, ticket, tokens):
+        """Take quota if ticket is at the head; returns seconds to wait, 0 once taken, None if not at head"""
+        (requests_bucket, tokens_bucket), queue, _ = self._state(key)
+        if queue[0] != ticket:
+            return None
+        now = time.monotonic()
+        wait = max(requests_bucket.wait_time(1, now), tokens_bucket.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        requests_bucket.take(1)
+        tokens_bucket.take(tokens)
+        heapq.heappop(queue)
+        return 0.0
+
+    def _settle(self, key, ticket, tokens, started, acquired):
+        _, queue, account = self._state(key)
+        waited = time.monotonic() - started
+        account["waited_seconds"] += waited
+        account["max_wait_seconds"] = max(account["max_wait_seconds"], waited)
+        if acquired:
+            account["requests"] += 1
+            account["tokens"] += tokens
+        else:
+            account["timeouts"] += 1
+            if ticket in queue:
+                queue.remove(ticket)
+                heapq.heapify(queue)
+        self.condition.notify_all()
+        return waited
+
+    def _withdraw(self, key, ticket):
+        """Drop a ticket whose waiter was cancelled, so it can't block the queue head"""
+        queue = self.queues.get(key, [])
+        if ticket in queue:
+            queue.remove(ticket)
+            heapq.heapify(queue)
+        self.condition.notify_all()
+
+    def acquire(self, tokens=1, key="default", level=None, timeout=None):
+        """Block until a request of `tokens` may be sent; returns seconds waited"""
+        level = request_priority.get() if level is None else level
+        timeout = self.max_wait if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        with self.condition:
+            ticket = self._enqueue(key, level)
+            try:
+                while True:
+                    wait = self._poll(key, ticket, tokens)
+                    if wait == 0:
+                        return self._settle(key, ticket, tokens, started, True)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._settle(key, ticket, tokens, started, False)
+                        raise RateLimitTimeout(f"no quota for {key} within {timeout:.1f}s")
+                    self.condition.wait(min(wait, remaining) if wait else remaining)
+            except BaseException:
+                self._withdraw(key, ticket)
+                raise
+
+    async def aacquire(self, tokens=1, key="default", level=None, timeout=None):
+        """Async variant of acquire; waits on the event loop instead of a thread"""
+        level = request_priority.get() if level is None else level
+        timeout = self.max_wait if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        with self.condition:
+            ticket = self._enqueue(key, level)
+        try:
+            while True:
+                with self.condition:
+                    wait = self._poll(key, ticket, tokens)
+                    if wait == 0:
+                        return self._settle(key, ticket, tokens, started, True)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._settle(key, ticket, tokens, started, False)
+                        raise RateLimitTimeout(f"no quota for {key} within {timeout:.1f}s")
+                # Not at the head yet: re-check shortly
+                await asyncio.sleep(min(wait or 0.01, remaining))
+        except BaseException:
+            # Cancelled (e.g. by asyncio.wait_for) or failed while queued
+            with self.condition:
+                self._withdraw(key, ticket)
+            raise
+
+    def record(self, tokens, reserved, key="default"):
+        """Charge the difference between actual and reserved tokens once a response is in"""
+        extra = tokens - reserved
+        if not extra:
+            return
+        with self.condition:
+            (_, tokens_bucket), _, account = self._state(key)
+            tokens_bucket.take(extra)
+            account["tokens"] += extra
+
+    def stats(self):
+        with self.condition:
+            return {key: dict(account, waiting=len(self.queues[key])) for key, account in self.accounts.items()}
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+def get_rate_limiter():
+    """Process-wide limiter, so every client draws on the same quota"""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
+
+def key_id(api_key):
+    """Short, non-reversible accounting key for an API key"""
+    return hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()[:12]
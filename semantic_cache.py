@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import threading
+from caching import normalize_text
+from chroma_manager import get_client, embed_query, content_hash, DEFAULT_EMBEDDING_MODEL
+
+# Minimum cosine similarity between questions for a cached report to be reused
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92'))
+# Seconds a cached report stays fresh
+SEMANTIC_CACHE_TTL = float(os.getenv('SEMANTIC_CACHE_TTL', str(6 * 3600)))
+ANSWER_CACHE_COLLECTION = 'answer_cache'
+# Nearest past questions checked per lookup, so an expired best match doesn't hide a fresh one
+LOOKUP_CANDIDATES = 5
+
+class SemanticAnswerCache:
+    """Past questions and their final reports in a dedicated Chroma collection
+
+    Questions are embedded with the shared embedder (and its query cache), so
+    a lookup costs one nearest-neighbour query. A report is reused when the
+    closest past question at the same research depth is within the cosine
+    threshold and the report is younger than the TTL.
+    """
+
+    def __init__(self, db_path=None, collection_name=ANSWER_CACHE_COLLECTION, model_name=DEFAULT_EMBEDDING_MODEL,
+                 threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL):
+        self.db_path = db_path or os.getenv('CHROMA_DB_PATH', './chroma_db')
+        self.model_name = model_name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.collection = get_client(self.db_path).get_or_create_collection(
+            collection_name, metadata={"hnsw:space": "cosine"}
+        )
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.collection.count()
+
+    def _entry_id(self, question, depth):
+        return "answer_" + content_hash(f"{depth}|{normalize_text(question)}")[:24]
+
+    def lookup(self, question, depth):
+        """Return the cached entry for a near-duplicate question, or None"""
+        entry = None
+        count = self.collection.count()
+        if count:
+            results = self.collection.query(
+                query_embeddings=[embed_query(question, self.model_name)],
+                n_results=min(LOOKUP_CANDIDATES, count),
+                where={"depth": depth},
+                include=["documents", "metadatas", "distances"]
+            )
+            expired = []
+            for i, entry_id in enumerate(results['ids'][0] if results['ids'] else []):
+                similarity = 1.0 - results['distances'][0][i]
+                metadata = results['metadatas'][0][i]
+                age = time.time() - metadata['created']
+                if age > self.ttl:
+                    expired.append(entry_id)
+                    continue
+                # Candidates come closest first, so the first fresh one decides
+                if similarity >= self.threshold:
+                    sources = json.loads(metadata.get('sources', '{}'))
+                    entry = {
+                        "answer": results['documents'][0][i],
+                        "question": metadata['question'],
+                        "similarity": round(similarity, 4),
+                        "age_seconds": round(age, 1),
+                        "intent": json.loads(metadata['intent']),
+                        "sources_used": {"web": metadata['used_web'], "internal": metadata['used_internal']},
+                        "web_results": sources.get('web', []),
+                        "internal_results": sources.get('internal', [])
+                    }
+                break
+            if expired:
+                self.collection.delete(ids=expired)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def store(self, question, depth, result):
+        """Remember the final report for a question"""
+        self.collection.upsert(
+            ids=[self._entry_id(question, depth)],
+            embeddings=[embed_query(question, self.model_name)],
+            documents=[result['answer']],
+            metadatas=[{
+                "question": question,
+                "depth": depth,
+                "created": time.time(),
+                "intent": json.dumps(result.get('intent_analysis', {})),
+                "used_web": bool(result['sources_used'].get('web')),
+                "used_internal": bool(result['sources_used'].get('internal')),
+                # Source records, so a cache hit still shows where the report came from
+                "sources": json.dumps({"web": result.get('web_results', []), "internal": result.get('internal_results', [])}, default=str)
+            }]
+        )
+
+    def clear(self):
+        ids = self.collection.get(include=[])['ids']
+        if ids:
+            self.collection.delete(ids=ids)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
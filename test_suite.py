@@ -2,7 +2,10 @@ import unittest
 import sys
 import os
 import json
-from unittest.mock import Mock, patch, MagicMock
+import shutil
+import tempfile
+import hashlib
+from unittest.mock import Mock, patch, MagicMock, AsyncMock
 import chromadb
 import numpy as np
 
@@ -11,8 +14,49 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from free_ai_client import FreeAIClient
 from free_search_client import FreeSearchClient
+import chroma_manager
 from chroma_manager import ChromaManager, initialize_sample_data
-from free_contextual_agent import FreeContextualAgent
+from free_contextual_agent import FreeContextualAgent, StageTracker
+
+class FakeEmbedder:
+    """Deterministic bag-of-words embedder so tests don't need to download models"""
+    dim = 64
+    
+    def __init__(self, model_name=None):
+        self.model_name = model_name
+        self.encode_calls = 0
+    
+    def encode(self, texts, **kwargs):
+        self.encode_calls += 1
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                bucket = int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim
+                vectors[row, bucket] += 1.0
+            norm = np.linalg.norm(vectors[row])
+            if norm:
+                vectors[row] /= norm
+        return vectors
+
+class ChromaTestCase(unittest.TestCase):
+    """Base class running ChromaManager against a temp DB and the fake embedder"""
+    
+    def setUp(self):
+        self.db_path = tempfile.mkdtemp(prefix="test_chroma_")
+        chroma_manager.reset_registry()
+        self.env_patch = patch.dict(os.environ, {
+            'CHROMA_DB_PATH': self.db_path,
+            'EMBEDDING_CACHE_PATH': os.path.join(self.db_path, 'embedding_cache')
+        })
+        self.env_patch.start()
+        self.embedder_patch = patch('chroma_manager.SentenceTransformer', side_effect=FakeEmbedder)
+        self.embedder_class = self.embedder_patch.start()
+    
+    def tearDown(self):
+        self.embedder_patch.stop()
+        self.env_patch.stop()
+        chroma_manager.reset_registry()
+        shutil.rmtree(self.db_path, ignore_errors=True)
 
 class TestFreeAIClient(unittest.TestCase):
     """Test cases for FreeAIClient"""
@@ -66,6 +110,309 @@ class TestFreeAIClient(unittest.TestCase):
         self.assertIsInstance(result, str)
         self.assertTrue(len(result) > 0)
 
+class TestIntentRouter(ChromaTestCase):
+    """Confident questions are routed locally; unsure ones escalate to the LLM"""
+    
+    def setUp(self):
+        super().setUp()
+        from intent_router import IntentRouter
+        self.router = IntentRouter()
+        self.ai_client = FreeAIClient()
+        self.ai_client.router = self.router
+        self.ai_client.use_api = True
+        self.ai_client.model = Mock()
+        self.ai_client.model.generate_content.return_value = Mock(text='{"needs_web": true, "needs_internal": false}')
+    
+    def test_routes_by_nearest_prototype(self):
+        self.assertEqual(self.router.classify("Latest news about quantum computing")[0], "web")
+        self.assertEqual(self.router.classify("Our internal research on batteries")[0], "internal")
+        self.assertEqual(self.router.classify("Compare our battery technology with market breakthroughs")[0], "both")
+    
+    def test_confident_route_skips_llm(self):
+        intent = json.loads(self.ai_client.analyze_intent("Our internal research on batteries"))
+        
+        self.assertFalse(intent['needs_web'])
+        self.assertTrue(intent['needs_internal'])
+        self.assertEqual(intent['route'], "internal")
+        self.ai_client.model.generate_content.assert_not_called()
+    
+    def test_unsure_route_escalates_to_llm(self):
+        self.router.threshold = 1.01
+        intent = self.ai_client.analyze_intent("Our internal research on batteries")
+        
+        self.ai_client.model.generate_content.assert_called_once()
+        self.assertIn('"needs_web": true', intent)
+        self.assertEqual(self.router.stats()['escalated'], 1)
+    
+    def test_router_shares_the_loaded_embedder(self):
+        ChromaManager()
+        self.router.classify("Latest news about quantum computing")
+        
+        self.assertEqual(self.embedder_class.call_count, 1)
+
+class TestLLMResponseCache(unittest.TestCase):
+    """Identical LLM calls are served from cache; intents are cached per question"""
+    
+    def setUp(self):
+        self.ai_client = self.make_client()
+    
+    def make_client(self):
+        client = FreeAIClient()
+        client.router = None
+        client.use_api = True
+        client.model = Mock()
+        client.model.generate_content.side_effect = lambda prompt, **kwargs: Mock(text='{"needs_web": true} report')
+        return client
+    
+    def test_rerun_is_served_from_cache(self):
+        first = self.ai_client.synthesize_answer("Question", "web", "internal")
+        second = self.ai_client.synthesize_answer("Question", "web", "internal")
+        
+        self.assertEqual(first, second)
+        self.assertEqual(self.ai_client.model.generate_content.call_count, 1)
+        self.assertEqual(self.ai_client.get_cache_stats()['response']['memory']['hit_rate'], 0.5)
+    
+    def test_settings_and_prompt_are_part_of_the_key(self):
+        self.ai_client.synthesize_answer("Question", "web", "internal")
+        self.ai_client.synthesize_answer("Question", "other web", "internal")
+        self.ai_client.generation_config = {"temperature": 0.2}
+        self.ai_client.synthesize_answer("Question", "web", "internal")
+        
+        self.assertEqual(self.ai_client.model.generate_content.call_count, 3)
+    
+    def test_intents_are_cached_by_normalized_question(self):
+        self.ai_client.analyze_intent("Latest  battery news")
+        self.ai_client.analyze_intent("latest battery news ")
+        
+        self.assertEqual(self.ai_client.model.generate_content.call_count, 1)
+        self.assertEqual(self.ai_client.get_cache_stats()['intent']['memory']['hits'], 1)
+    
+    def test_intent_prompt_is_part_of_the_key(self):
+        self.ai_client.analyze_intent("Latest battery news")
+        original = self.ai_client._create_intent_prompt
+        self.ai_client._create_intent_prompt = lambda question: original(question) + "\nAlso return filters."
+        self.ai_client.analyze_intent("Latest battery news")
+        
+        self.assertEqual(self.ai_client.model.generate_content.call_count, 2)
+    
+    def test_unparseable_intents_are_not_cached(self):
+        self.ai_client.model.generate_content.side_effect = lambda prompt, **kwargs: Mock(text="Sorry, I can't help with that")
+        self.ai_client.analyze_intent("Latest battery news")
+        self.ai_client.analyze_intent("Latest battery news")
+        
+        self.assertEqual(self.ai_client.model.generate_content.call_count, 2)
+    
+    def test_streamed_report_is_cached(self):
+        self.ai_client.model.generate_content.side_effect = None
+        self.ai_client.model.generate_content.return_value = iter([Mock(text="# Report"), Mock(text=" body")])
+        "".join(self.ai_client.stream_answer("Question", "web", "internal"))
+        
+        self.assertEqual(self.ai_client.synthesize_answer("Question", "web", "internal"), "# Report body")
+        self.assertEqual(self.ai_client.model.generate_content.call_count, 1)
+    
+    def test_sqlite_backend_survives_restart(self):
+        cache_dir = tempfile.mkdtemp(prefix="test_llm_cache_")
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        with patch('free_ai_client.LLM_CACHE_PATH', os.path.join(cache_dir, "llm.db")):
+            self.make_client().synthesize_answer("Question", "web", "internal")
+            restarted = self.make_client()
+            restarted.synthesize_answer("Question", "web", "internal")
+        
+        restarted.model.generate_content.assert_not_called()
+
+class FakeGemini:
+    """Stand-in for genai.GenerativeModel that records when it was called"""
+    
+    def __init__(self):
+        import time
+        self.time = time
+        self.calls = []
+    
+    def generate_content(self, prompt, **kwargs):
+        self.calls.append(self.time.monotonic())
+        return Mock(text=f"report {len(self.calls)}")
+
+class TestRateLimiter(unittest.TestCase):
+    """Token buckets smooth bursts, honour priority and account per key"""
+    
+    def setUp(self):
+        import time
+        import rate_limiter
+        self.time = time
+        self.rate_limiter = rate_limiter
+    
+    def limiter(self, **kwargs):
+        settings = dict(rpm=600, tpm=1e9, burst=1, max_wait=5)
+        settings.update(kwargs)
+        return self.rate_limiter.RateLimiter(**settings)
+    
+    def test_bursts_are_smoothed(self):
+        limiter = self.limiter(burst=2)
+        start = self.time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+        
+        self.assertGreaterEqual(self.time.monotonic() - start, 0.35)
+        self.assertEqual(limiter.stats()['default']['requests'], 6)
+    
+    def test_interactive_requests_jump_the_batch_queue(self):
+        import threading
+        limiter = self.limiter()
+        limiter.acquire()
+        order = []
+        
+        def request(name, level):
+            limiter.acquire(level=level)
+            order.append(name)
+        
+        batch = threading.Thread(target=request, args=("batch", self.rate_limiter.BATCH))
+        batch.start()
+        self.time.sleep(0.02)
+        interactive = threading.Thread(target=request, args=("interactive", self.rate_limiter.INTERACTIVE))
+        interactive.start()
+        batch.join()
+        interactive.join()
+        
+        self.assertEqual(order, ["interactive", "batch"])
+    
+    def test_priority_context_applies_to_calls(self):
+        with self.rate_limiter.priority(self.rate_limiter.BATCH):
+            self.assertEqual(self.rate_limiter.request_priority.get(), self.rate_limiter.BATCH)
+        self.assertEqual(self.rate_limiter.request_priority.get(), self.rate_limiter.INTERACTIVE)
+    
+    def test_keys_have_separate_quota(self):
+        limiter = self.limiter(rpm=60)
+        limiter.acquire(key="a")
+        start = self.time.monotonic()
+        limiter.acquire(key="b")
+        
+        self.assertLess(self.time.monotonic() - start, 0.05)
+        self.assertEqual(set(limiter.stats()), {"a", "b"})
+    
+    def test_token_ceiling_is_enforced(self):
+        limiter = self.limiter(tpm=600)
+        limiter.acquire(tokens=1)
+        limiter.acquire(tokens=5)
+        
+        self.assertGreaterEqual(limiter.acquire(tokens=1), 0.35)
+    
+    def test_timeout_leaves_the_queue(self):
+        limiter = self.limiter(rpm=6)
+        limiter.acquire()
+        
+        with self.assertRaises(self.rate_limiter.RateLimitTimeout):
+            limiter.acquire(timeout=0.05)
+        self.assertEqual(limiter.stats()['default']['timeouts'], 1)
+        self.assertEqual(limiter.stats()['default']['waiting'], 0)
+    
+    def test_cancelled_waiter_leaves_the_queue(self):
+        import asyncio
+        limiter = self.limiter(rpm=60)
+        limiter.acquire()
+        
+        async def cancelled():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(limiter.aacquire(), timeout=0.05)
+        
+        asyncio.run(cancelled())
+        self.assertEqual(limiter.stats()['default']['waiting'], 0)
+        self.assertLess(limiter.acquire(timeout=1.5), 1.5)
+    
+    def test_async_requests_are_paced(self):
+        import asyncio
+        limiter = self.limiter()
+        
+        async def burst():
+            await asyncio.gather(*(limiter.aacquire() for _ in range(3)))
+        
+        start = self.time.monotonic()
+        asyncio.run(burst())
+        self.assertGreaterEqual(self.time.monotonic() - start, 0.18)
+    
+    def test_client_queues_instead_of_falling_back(self):
+        client = FreeAIClient()
+        client.use_api = True
+        client.model = FakeGemini()
+        client.rate_limiter = self.limiter()
+        
+        answers = [client.synthesize_answer(f"Question {i}", "", "") for i in range(3)]
+        
+        self.assertEqual(answers, ["report 1", "report 2", "report 3"])
+        gaps = [later - earlier for earlier, later in zip(client.model.calls, client.model.calls[1:])]
+        self.assertTrue(all(gap >= 0.09 for gap in gaps))
+        self.assertEqual(client.get_rate_limit_stats()[client.rate_key]['requests'], 3)
+
+class TestStreamingSynthesis(unittest.TestCase):
+    """Reports are streamed chunk by chunk, from the API or the mock generator"""
+    
+    def setUp(self):
+        self.ai_client = FreeAIClient()
+    
+    def chunk(self, text):
+        return Mock(text=text)
+    
+    def test_mock_report_streams(self):
+        self.ai_client.use_api = False
+        chunks = list(self.ai_client.stream_answer("Test question", "web", "internal"))
+        
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual("".join(chunks), self.ai_client.synthesize_answer("Test question", "web", "internal"))
+    
+    def test_api_chunks_are_passed_through(self):
+        self.ai_client.use_api = True
+        self.ai_client.model = Mock()
+        self.ai_client.model.generate_content.return_value = iter([self.chunk("# Report"), self.chunk(" body")])
+        
+        self.assertEqual(list(self.ai_client.stream_answer("q", "", "")), ["# Report", " body"])
+        self.assertTrue(self.ai_client.model.generate_content.call_args.kwargs['stream'])
+
+    def test_abandoned_stream_is_charged_but_not_cached(self):
+        import asyncio
+        self.ai_client.use_api = True
+        self.ai_client.rest_transport = True
+        self.ai_client.model = Mock()
+        self.ai_client.model.generate_content.side_effect = lambda *args, **kwargs: iter([self.chunk("# Report"), self.chunk(" body")])
+        self.ai_client.rate_limiter = Mock()
+        self.ai_client.rate_limiter.acquire.return_value = 0
+        self.ai_client.rate_limiter.aacquire = AsyncMock(return_value=0)
+
+        stream = self.ai_client.stream_answer("q", "", "")
+        self.assertEqual(next(stream), "# Report")
+        stream.close()
+
+        async def first_chunk():
+            stream = self.ai_client.astream_answer("q", "", "")
+            chunk = await stream.__anext__()
+            await stream.aclose()
+            return chunk
+
+        self.assertEqual(asyncio.run(first_chunk()), "# Report")
+        self.assertEqual(self.ai_client.rate_limiter.record.call_count, 2)
+        self.assertEqual(self.ai_client.model.generate_content.call_count, 2)
+        self.assertEqual(list(self.ai_client.stream_answer("q", "", "")), ["# Report", " body"])
+        self.assertEqual(self.ai_client.model.generate_content.call_count, 3)
+    
+    def test_failure_before_first_chunk_falls_back_to_mock(self):
+        self.ai_client.use_api = True
+        self.ai_client.model = Mock()
+        self.ai_client.model.generate_content.side_effect = Exception("quota exceeded")
+        
+        report = "".join(self.ai_client.stream_answer("Test question", "", ""))
+        self.assertIn("Comprehensive Research Report: Test question", report)
+    
+    def test_agent_stream_fills_in_answer(self):
+        agent = FreeContextualAgent(searcher=Mock(), ai=self.ai_client, chroma=Mock())
+        agent.searcher.search.return_value = []
+        agent.chroma.hybrid_search.return_value = []
+        self.ai_client.use_api = False
+        
+        result = agent.stream_query("Latest battery news", depth="Quick")
+        self.assertIsNone(result['answer'])
+        first = next(result['answer_stream'])
+        streamed = first + "".join(result['answer_stream'])
+        
+        self.assertEqual(result['answer'], streamed)
+
 class TestFreeSearchClient(unittest.TestCase):
     """Test cases for FreeSearchClient"""
     
@@ -111,6 +458,213 @@ class TestFreeSearchClient(unittest.TestCase):
         self.assertIsInstance(result, str)
         self.assertTrue(len(result) > 0)
 
+class TestMockSearchIndex(unittest.TestCase):
+    """Indexed mock search backend loaded once from a data file"""
+    
+    def test_word_boundaries(self):
+        from free_search_client import MockSearchIndex
+        index = MockSearchIndex.load()
+        
+        self.assertEqual(index.search("how to maintain the plant"), [])
+        self.assertEqual(index.search("AI regulation")[0][0]['topic'], "ai regulation")
+        self.assertEqual(index.search("new solid-state battery")[0][0]['topic'], "solid-state batteries")
+    
+    def test_index_is_built_once(self):
+        from free_search_client import MockSearchIndex
+        self.assertIs(MockSearchIndex.load(), MockSearchIndex.load())
+    
+    def test_thousands_of_topics(self):
+        import time
+        from free_search_client import MockSearchIndex
+        topics = [
+            {
+                "topic": f"topic{i} sector",
+                "title": f"Topic {i} Overview",
+                "results": [{"title": f"Topic{i} headline", "snippet": f"Details about topic{i} growth.", "source": f"https://news.io/{i}"}]
+            }
+            for i in range(5000)
+        ]
+        data_dir = tempfile.mkdtemp(prefix="test_mock_search_")
+        path = os.path.join(data_dir, "mock.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"topics": topics}, f)
+        
+        try:
+            index = MockSearchIndex.load(path)
+            start = time.perf_counter()
+            hits = index.search("topic4321 growth", k=3)
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+        
+        self.assertEqual(hits[0][0]['source'], "https://news.io/4321")
+        self.assertLess(elapsed, 0.5)
+
+class TestStructuredSearchResults(unittest.TestCase):
+    """The search layer returns records; markdown is rendered only for display"""
+    
+    def setUp(self):
+        self.search_client = FreeSearchClient()
+    
+    def test_records_have_compact_fields(self):
+        records = self.search_client.search("solid-state batteries")
+        
+        self.assertGreater(len(records), 0)
+        for rank, record in enumerate(records, 1):
+            self.assertEqual(set(record), {"title", "snippet", "url", "rank", "score", "source"})
+            self.assertEqual(record['rank'], rank)
+        scores = [record['score'] for record in records]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+    
+    def test_serper_response_to_records(self):
+        raw = {"organic": [{"title": "A", "snippet": "one", "link": "https://a.io"}, {"title": "B", "snippet": "two"}]}
+        records = self.search_client.serper_records(raw)
+        
+        self.assertEqual([record['url'] for record in records], ["https://a.io", ""])
+        self.assertEqual(records[1]['score'], 0.5)
+    
+    def test_agent_prompt_context_is_plain(self):
+        from free_contextual_agent import dedupe_records
+        records = self.search_client.search("quantum computing")
+        context = FreeContextualAgent.format_web_context(None, dedupe_records(records + records))
+        
+        self.assertEqual(context.count("\n"), len(records) + 1)
+        self.assertNotIn("🔗", context)
+        self.assertNotIn("###", context)
+
+class TestSerperTransport(unittest.TestCase):
+    """Pooled session, retry/backoff and latency metrics for Serper calls"""
+    
+    def setUp(self):
+        self.client = FreeSearchClient()
+        self.client.use_serper = True
+        self.client.serper_key = "test-key"
+        self.client.cache = None
+    
+    def response(self, status, body=None, headers=None):
+        response = Mock(status_code=status, headers=headers or {})
+        response.json.return_value = body or {}
+        if status >= 400:
+            import requests
+            response.raise_for_status.side_effect = requests.exceptions.HTTPError(f"{status} error")
+        return response
+    
+    def test_session_is_shared(self):
+        self.assertIs(FreeSearchClient().session, self.client.session)
+    
+    @patch('free_search_client.time.sleep')
+    def test_transient_429_is_retried(self, sleep):
+        body = {"organic": [{"title": "Real result", "snippet": "Live data", "link": "https://example.com"}]}
+        self.client.session = Mock()
+        self.client.session.post.side_effect = [
+            self.response(429, headers={"Retry-After": "1"}),
+            self.response(503),
+            self.response(200, body)
+        ]
+        
+        result = self.client.search_serper("solid-state batteries")
+        
+        self.assertIn("Real result", result)
+        self.assertEqual(self.client.session.post.call_count, 3)
+        self.assertEqual(sleep.call_args_list[0][0][0], 1.0)
+        metrics = self.client.get_metrics()
+        self.assertEqual((metrics['requests'], metrics['retries'], metrics['failures']), (3, 2, 0))
+    
+    @patch('free_search_client.time.sleep')
+    def test_exhausted_retries_fall_back_to_mock(self, sleep):
+        self.client.session = Mock()
+        self.client.session.post.return_value = self.response(500)
+        
+        result = self.client.search_serper("quantum computing")
+        
+        self.assertIn("Mock data", result)
+        self.assertEqual(self.client.get_metrics()['failures'], 1)
+    
+    @patch('free_search_client.backoff_delay', return_value=1.0)
+    @patch('free_search_client.time.sleep')
+    def test_retries_stop_at_the_deadline(self, sleep, backoff):
+        import requests
+        clock = [0.0]
+        sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+        
+        def slow_timeout(*args, **kwargs):
+            clock[0] += min(kwargs['timeout'], 4)
+            raise requests.exceptions.Timeout("read timed out")
+        
+        self.client.session = Mock()
+        self.client.session.post.side_effect = slow_timeout
+        with patch('free_search_client.time.monotonic', side_effect=lambda: clock[0]), \
+             patch('free_search_client.SERPER_DEADLINE', 12), patch('free_search_client.SERPER_MAX_RETRIES', 5):
+            result = self.client.search_serper("quantum computing")
+        
+        self.assertIn("Mock data", result)
+        self.assertEqual(self.client.session.post.call_count, 3)
+        self.assertLessEqual(clock[0], 12)
+    
+    def test_backoff_is_bounded(self):
+        from free_search_client import backoff_delay, SERPER_BACKOFF_CAP
+        for attempt in range(10):
+            self.assertLessEqual(backoff_delay(attempt), SERPER_BACKOFF_CAP)
+
+class TestSearchResultCache(unittest.TestCase):
+    """Persistent Serper result cache with TTL, eviction and stale-while-revalidate"""
+    
+    def setUp(self):
+        from caching import SQLiteCache
+        self.cache_dir = tempfile.mkdtemp(prefix="test_search_cache_")
+        self.cache = SQLiteCache(os.path.join(self.cache_dir, "search.db"), ttl=60, stale_ttl=600, max_entries=3)
+        self.client = FreeSearchClient()
+        self.client.use_serper = True
+        self.client.serper_key = "test-key"
+        self.client.cache = self.cache
+        self.calls = []
+        
+        def request(params):
+            self.calls.append(params["q"])
+            return {"organic": [{"title": f"Result {len(self.calls)} for {params['q']}", "snippet": "s", "link": "https://x.io"}]}
+        
+        self.client._request_serper = request
+    
+    def tearDown(self):
+        self.cache.conn.close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+    
+    def test_repeated_query_uses_no_quota(self):
+        first = self.client.search_serper("Solid-state batteries")
+        second = self.client.search_serper("  solid-state   BATTERIES ")
+        
+        self.assertIn("Result 1 for Solid-state batteries", first)
+        self.assertIn("Result 1 for Solid-state batteries", second)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+    
+    def test_parameters_are_part_of_the_key(self):
+        self.client.fetch_serper_results("quantum", gl="us")
+        self.client.fetch_serper_results("quantum", gl="de")
+        self.assertEqual(len(self.calls), 2)
+    
+    def test_stale_entry_served_while_refreshing(self):
+        import time
+        self.client.fetch_serper_results("ai regulation")
+        real_time = time.time
+        with patch('caching.time.time', return_value=real_time() + 120):
+            stale = self.client.fetch_serper_results("ai regulation")
+            for _ in range(100):
+                if not self.client.refreshing:
+                    break
+                time.sleep(0.01)
+        
+        self.assertIn("Result 1", stale['organic'][0]['title'])
+        self.assertEqual(len(self.calls), 2)
+        fresh = self.client.fetch_serper_results("ai regulation")
+        self.assertIn("Result 2", fresh['organic'][0]['title'])
+    
+    def test_size_bounded_eviction(self):
+        for query in ["a", "b", "c", "d"]:
+            self.cache.set(query, {"q": query})
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get("a"))
+
 class TestChromaManager(unittest.TestCase):
     """Test cases for ChromaManager"""
     
@@ -171,6 +725,1096 @@ class TestChromaManager(unittest.TestCase):
         self.assertIsInstance(stats, int)
         self.assertGreaterEqual(stats, 0)
 
+class TestSharedRegistry(ChromaTestCase):
+    """The embedder and Chroma client are loaded once per process"""
+    
+    def test_embedder_loaded_once(self):
+        first = chroma_manager.get_chroma_manager(db_path=self.db_path)
+        second = chroma_manager.get_chroma_manager(db_path=self.db_path)
+        other = ChromaManager(db_path=self.db_path, collection_name="other")
+        
+        self.assertIs(first, second)
+        self.assertIs(first.embedder, other.embedder)
+        self.assertIs(first.client, other.client)
+        self.assertEqual(self.embedder_class.call_count, 1)
+    
+    def test_separate_models_get_separate_embedders(self):
+        default = chroma_manager.get_embedder()
+        other = chroma_manager.get_embedder("paraphrase-MiniLM-L3-v2")
+        
+        self.assertIsNot(default, other)
+        self.assertEqual(self.embedder_class.call_count, 2)
+
+    def test_concurrent_callers_build_one_manager(self):
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        built = []
+        init = ChromaManager.__init__
+
+        def slow_init(manager, *args, **kwargs):
+            built.append(threading.current_thread().name)
+            time.sleep(0.2)
+            init(manager, *args, **kwargs)
+
+        with patch.object(ChromaManager, '__init__', slow_init):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                managers = list(pool.map(lambda _: chroma_manager.get_chroma_manager(db_path=self.db_path), range(4)))
+
+        self.assertEqual(len(built), 1)
+        self.assertTrue(all(manager is managers[0] for manager in managers))
+
+class TestHybridSearch(ChromaTestCase):
+    """BM25 + vector fusion in ChromaManager.hybrid_search"""
+    
+    def setUp(self):
+        super().setUp()
+        self.manager = ChromaManager(db_path=self.db_path)
+        self.manager.add_documents(
+            [
+                "Project Ares solid state battery research reached 750 Wh/L.",
+                "Cloud infrastructure migration achieved 99.95% uptime.",
+                "Quantum computing initiative targets a 50-qubit processor.",
+                "Customer satisfaction improved to 94% this quarter."
+            ],
+            [{"source": "test", "project": "Ares"}, {"source": "test"}, {"source": "test"}, {"source": "test"}],
+            ids=["ares", "cloud", "quantum", "customer"]
+        )
+    
+    def test_exact_token_ranks_first(self):
+        for fusion in ("rrf", "weighted"):
+            results = self.manager.hybrid_search("Ares", n_results=2, fusion=fusion)
+            self.assertEqual(results[0]['id'], "ares")
+            self.assertGreater(results[0]['keyword_score'], 0)
+    
+    def test_scores_are_real_and_sorted(self):
+        results = self.manager.hybrid_search("99.95% uptime", n_results=4)
+        scores = [result['score'] for result in results]
+        
+        self.assertEqual(results[0]['id'], "cloud")
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertNotEqual(len(set(scores)), 1)
+    
+    def test_keyword_index_persisted(self):
+        from bm25_index import BM25Index
+        reloaded = BM25Index(self.manager.bm25.path)
+        
+        self.assertEqual(len(reloaded), 4)
+        self.assertEqual(reloaded.search("50-qubit")[0][0], "quantum")
+
+class TestMetadataFilters(ChromaTestCase):
+    """Structured filters narrow retrieval to the matching subset"""
+    
+    def setUp(self):
+        super().setUp()
+        self.manager = ChromaManager(db_path=self.db_path)
+        departments = ["R&D", "Finance", "IT", "Legal"]
+        self.manager.add_documents(
+            [f"Battery research update {i} from the {departments[i % 4]} team." for i in range(40)],
+            [{"source": "internal", "department": departments[i % 4], "project": "Ares" if i < 3 else "Helios",
+              "quarter": "Q3" if i % 2 else "Q2"} for i in range(40)],
+            ids=[f"doc{i}" for i in range(40)]
+        )
+    
+    def test_filtered_search_only_returns_matches(self):
+        results = self.manager.hybrid_search("battery research update", n_results=10, filters={"project": "Ares"})
+        
+        self.assertEqual({result['id'] for result in results}, {"doc0", "doc1", "doc2"})
+    
+    def test_filters_combine_and_accept_value_lists(self):
+        results = self.manager.hybrid_search(
+            "battery research", n_results=20, filters={"department": ["IT", "Legal"], "quarter": "Q3"}
+        )
+        
+        self.assertEqual(len(results), 10)
+        for result in results:
+            self.assertIn(result['metadata']['department'], ("IT", "Legal"))
+            self.assertEqual(result['metadata']['quarter'], "Q3")
+    
+    def test_keyword_side_only_touches_candidates(self):
+        candidates = self.manager.metadata_index.match({"project": "Ares"})
+        hits = self.manager.bm25.search("battery", 40, candidates)
+        
+        self.assertEqual({doc_id for doc_id, _ in hits}, candidates)
+    
+    def test_unknown_filters_are_ignored(self):
+        results = self.manager.hybrid_search("battery", n_results=5, filters={"project": "Nonexistent", "color": "red"})
+        self.assertEqual(len(results), 5)
+    
+    def test_index_tracks_deletes_and_restarts(self):
+        self.manager.delete_documents(["doc0"])
+        reloaded = ChromaManager(db_path=self.db_path)
+        
+        self.assertEqual(reloaded.metadata_index.match({"project": "Ares"}), {"doc1", "doc2"})
+    
+    def test_question_names_filters(self):
+        self.assertEqual(self.manager.extract_filters("Status of project ares for quarter: Q3?"), {"project": "Ares", "quarter": "Q3"})
+        self.assertEqual(self.manager.extract_filters("Status of the Ares project in Q3?"), {"project": "Ares"})
+        self.assertEqual(self.manager.extract_boosts("Status of the Ares project in Q3?"), {"quarter": "Q3"})
+        self.assertEqual(self.manager.extract_filters("what is it like in q3"), {})
+    
+    def test_boosts_rank_without_filtering(self):
+        results = self.manager.hybrid_search("battery research update", n_results=10, boosts={"project": "Ares"})
+        
+        self.assertEqual(len(results), 10)
+        self.assertEqual({result['id'] for result in results[:3]}, {"doc0", "doc1", "doc2"})
+    
+    def test_agent_intent_carries_filters(self):
+        agent = FreeContextualAgent(searcher=Mock(), chroma=self.manager)
+        agent.searcher.search.return_value = []
+        result = agent.process_query("What is our internal status on project Ares?")
+        
+        self.assertEqual(result['intent_analysis']['filters'], {"project": "Ares"})
+        self.assertTrue(all(doc['metadata']['project'] == "Ares" for doc in result['internal_results']))
+
+class TestFacetMentions(ChromaTestCase):
+    """Facet values in ordinary prose rank the sample data instead of filtering it"""
+    
+    def test_prose_mentions_do_not_filter(self):
+        initialize_sample_data()
+        agent = FreeContextualAgent(searcher=Mock())
+        cases = [
+            ("What did the AI Ethics Committee recommend in its Q2 2024 report?", {"quarter": "Q2"}, "AI Ethics Committee"),
+            ("Compare our battery research with quantum advances", {"project": "Quantum"}, "Project Ares"),
+        ]
+        for question, boosts, expected in cases:
+            intent = {"filters": agent.intent_filters(question, {})}
+            intent["boosts"] = agent.intent_boosts(question, intent)
+            results = agent.search_internal(question, intent["filters"], intent["boosts"])
+            
+            self.assertEqual(intent["filters"], {})
+            self.assertEqual(intent["boosts"], boosts)
+            self.assertTrue(any(expected in result['content'] for result in results), question)
+
+class TestRetrievalProfiles(ChromaTestCase):
+    """Named HNSW profiles set index parameters and the candidate over-fetch"""
+
+    def test_profile_sets_index_parameters_at_creation(self):
+        manager = ChromaManager(db_path=self.db_path, collection_name="fast_kb", profile="fast")
+        settings = manager.get_index_settings()
+
+        self.assertEqual(settings["built_with"], "fast")
+        self.assertEqual(settings["index"]["hnsw:M"], 8)
+        self.assertEqual(settings["index"]["hnsw:space"], "cosine")
+
+    def test_existing_collection_keeps_its_build_settings(self):
+        ChromaManager(db_path=self.db_path, profile="high-recall")
+        reopened = ChromaManager(db_path=self.db_path, profile="fast")
+
+        self.assertEqual(reopened.profile, "fast")
+        self.assertEqual(reopened.get_index_settings()["built_with"], "high-recall")
+
+    def test_candidate_count_follows_profile(self):
+        self.assertEqual(chroma_manager.candidate_count(5, 1000, "fast"), 10)
+        self.assertEqual(chroma_manager.candidate_count(5, 1000, "balanced"), 20)
+        self.assertEqual(chroma_manager.candidate_count(10, 1000, "high-recall"), 80)
+        self.assertEqual(chroma_manager.candidate_count(10, 30, "high-recall"), 30)
+        self.assertEqual(chroma_manager.get_profile("unknown")[0], "balanced")
+
+    def test_query_profile_overrides_over_fetch(self):
+        manager = ChromaManager(db_path=self.db_path, profile="fast")
+        manager.add_documents([f"Battery note {i}" for i in range(60)], ids=[f"doc{i}" for i in range(60)])
+
+        with patch.object(manager, 'search', wraps=manager.search) as search:
+            manager.hybrid_search("battery", n_results=5)
+            manager.hybrid_search("battery", n_results=5, profile="high-recall")
+
+        self.assertEqual([call.args[1] for call in search.call_args_list], [10, 50])
+
+    def test_registry_shares_one_manager_per_collection(self):
+        fast = chroma_manager.get_chroma_manager(db_path=self.db_path, profile="fast")
+
+        self.assertIs(chroma_manager.get_chroma_manager(db_path=self.db_path, profile="balanced"), fast)
+        self.assertEqual(fast.profile, "fast")
+
+    def test_rebuild_applies_profile_and_keeps_documents(self):
+        ChromaManager(db_path=self.db_path, profile="fast").add_documents(
+            [f"Battery note {i}" for i in range(30)], [{"source": "internal", "n": str(i)} for i in range(30)],
+            ids=[f"doc{i}" for i in range(30)]
+        )
+        manager = ChromaManager(db_path=self.db_path, profile="high-recall")
+        before = manager.search("Battery note 7", n_results=3)
+
+        settings = manager.rebuild_index()
+
+        self.assertEqual(settings["built_with"], "high-recall")
+        self.assertEqual(settings["index"]["hnsw:M"], 32)
+        self.assertEqual(manager.get_collection_stats(), 30)
+        self.assertEqual(manager.search("Battery note 7", n_results=3)['ids'], before['ids'])
+        reopened = ChromaManager(db_path=self.db_path)
+        self.assertEqual(reopened.get_index_settings()["built_with"], "high-recall")
+        self.assertEqual(reopened.get_collection_stats(), 30)
+
+    def test_failed_rebuild_swap_keeps_original(self):
+        from chromadb.api.models.Collection import Collection
+        manager = ChromaManager(db_path=self.db_path, profile="fast")
+        manager.add_documents([f"Battery note {i}" for i in range(30)], ids=[f"doc{i}" for i in range(30)])
+        modify = Collection.modify
+
+        def failing_modify(collection, name=None, metadata=None):
+            if collection.name.endswith("_rebuild"):
+                raise RuntimeError("rename failed")
+            return modify(collection, name=name, metadata=metadata)
+
+        with patch.object(Collection, 'modify', failing_modify):
+            with self.assertRaises(RuntimeError):
+                manager.rebuild_index("high-recall")
+
+        reopened = ChromaManager(db_path=self.db_path)
+        self.assertEqual(reopened.get_collection_stats(), 30)
+        self.assertEqual(reopened.get_index_settings()["built_with"], "fast")
+
+class TestStreamingIngestion(ChromaTestCase):
+    """Batched, streaming add_documents / add_custom_documents"""
+    
+    def setUp(self):
+        super().setUp()
+        self.manager = chroma_manager.get_chroma_manager(db_path=self.db_path)
+        self.batch_sizes = []
+        encode = self.manager.embedder.encode
+        
+        def recording_encode(texts, **kwargs):
+            self.batch_sizes.append(len(texts))
+            return encode(texts, **kwargs)
+        
+        self.manager.embedder.encode = recording_encode
+    
+    def test_generator_input_is_encoded_in_bounded_batches(self):
+        documents = (f"Streaming document number {i}" for i in range(25))
+        added = self.manager.add_documents(documents, batch_size=10)
+        
+        self.assertEqual(added, 25)
+        self.assertEqual(self.batch_sizes, [10, 10, 5])
+        self.assertEqual(self.manager.get_collection_stats(), 25)
+        self.assertEqual(len(self.manager.bm25), 25)
+    
+    def test_add_custom_documents_streams_files(self):
+        paths = []
+        for i in range(5):
+            path = os.path.join(self.db_path, f"report_{i}.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f"Custom report {i} about supply chain logistics")
+            paths.append(path)
+        paths.append(os.path.join(self.db_path, "missing.txt"))
+        
+        with patch.dict(os.environ, {'CHROMA_DB_PATH': self.db_path}):
+            added = chroma_manager.add_custom_documents(paths, batch_size=2)
+        
+        self.assertEqual(added, 5)
+        self.assertEqual(self.batch_sizes, [2, 2, 1])
+        stored = self.manager.collection.get(include=['metadatas'])
+        self.assertEqual(sorted(m['filename'] for m in stored['metadatas']), [f"report_{i}.txt" for i in range(5)])
+
+class TestIncrementalIngestion(ChromaTestCase):
+    """Content-addressed IDs, upserts and the skip-unchanged manifest"""
+    
+    def setUp(self):
+        super().setUp()
+        self.manager = ChromaManager(db_path=self.db_path)
+    
+    def test_ids_are_stable(self):
+        self.assertEqual(chroma_manager.make_document_id("same text"), chroma_manager.make_document_id("same text"))
+        self.assertNotEqual(chroma_manager.make_document_id("one"), chroma_manager.make_document_id("two"))
+        self.assertEqual(
+            chroma_manager.make_document_id("old", "/share/a.txt"),
+            chroma_manager.make_document_id("new", "/share/a.txt")
+        )
+    
+    def test_reingesting_unchanged_documents_is_skipped(self):
+        documents = ["First stable document", "Second stable document"]
+        self.assertEqual(self.manager.add_documents(documents), 2)
+        
+        encode_calls = self.manager.embedder.encode_calls
+        self.assertEqual(self.manager.add_documents(documents), 0)
+        self.assertEqual(self.manager.embedder.encode_calls, encode_calls)
+        self.assertEqual(self.manager.get_collection_stats(), 2)
+    
+    def test_samples_from_baseline_ids_are_not_duplicated(self):
+        manager = chroma_manager.get_chroma_manager(db_path=self.db_path)
+        add_documents = manager.add_documents
+        
+        def baseline_add(documents, metadatas=None, **kwargs):
+            documents = list(documents)
+            return add_documents(documents, metadatas, ids=[f"doc_{i}" for i in range(len(documents))])
+        
+        with patch.object(manager, 'add_documents', side_effect=baseline_add):
+            initialize_sample_data()
+        self.assertEqual(manager.get_collection_stats(), 25)
+        
+        initialize_sample_data()
+        results = manager.hybrid_search("Project Ares solid state battery", n_results=5)
+        
+        self.assertEqual(manager.get_collection_stats(), 25)
+        self.assertEqual(len(manager.bm25), 25)
+        self.assertEqual(len({result['content'] for result in results}), len(results))
+        self.assertFalse(manager.collection.get(ids=["doc_0"])['ids'])
+    
+    def test_manifest_survives_restart(self):
+        self.manager.add_documents(["Persisted manifest document"])
+        chroma_manager.reset_registry()
+        
+        restarted = ChromaManager(db_path=self.db_path)
+        self.assertEqual(restarted.add_documents(["Persisted manifest document"]), 0)
+    
+    def test_changed_file_is_upserted_in_place(self):
+        metadata = {"source": "custom", "path": "/share/report.txt"}
+        self.manager.add_documents(["Report draft"], [metadata])
+        added = self.manager.add_documents(["Report draft", "Report final version"], [metadata, metadata])
+        
+        stored = self.manager.collection.get()
+        self.assertEqual(added, 1)
+        self.assertEqual(stored['documents'], ["Report final version"])
+        self.assertEqual(self.manager.bm25.search("draft"), [])
+
+    def test_saves_append_to_journal_instead_of_rewriting(self):
+        self.manager.add_documents([f"Battery note {i}" for i in range(20)], ids=[f"doc{i}" for i in range(20)])
+        self.manager.rebuild_keyword_index()
+        snapshot = os.stat(self.manager.bm25.path)
+
+        self.manager.add_documents(["Quantum note"], [{"project": "Helios"}], ids=["quantum"])
+        self.manager.delete_documents(["doc3"])
+
+        self.assertEqual(os.stat(self.manager.bm25.path).st_mtime_ns, snapshot.st_mtime_ns)
+        with open(self.manager.bm25.journal.path, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 2)
+        chroma_manager.reset_registry()
+        restarted = ChromaManager(db_path=self.db_path)
+        self.assertEqual(len(restarted.bm25), 20)
+        self.assertEqual(restarted.bm25.search("quantum")[0][0], "quantum")
+        self.assertNotIn("doc3", restarted.bm25)
+        self.assertEqual(restarted.metadata_index.match({"project": "Helios"}), {"quantum"})
+        self.assertEqual(restarted.add_documents(["Quantum note"], [{"project": "Helios"}], ids=["quantum"]), 0)
+
+    def test_journal_compacts_and_survives_torn_line(self):
+        from bm25_index import BM25Index
+        path = os.path.join(self.db_path, "bm25_test.json")
+        index = BM25Index(path)
+        with patch('journal.JOURNAL_COMPACT_MIN', 3):
+            for i in range(6):
+                index.add(f"doc{i % 2}", f"note {i}")
+                index.save()
+            self.assertTrue(os.path.exists(path))
+            self.assertLessEqual(index.journal.entries, 3)
+            with open(index.journal.path, 'a', encoding='utf-8') as f:
+                f.write('{"id": "torn", "ter')
+
+            reloaded = BM25Index(path)
+            reloaded.add("doc2", "note 2")
+            reloaded.save()
+
+        restarted = BM25Index(path)
+        self.assertEqual(len(restarted), 3)
+        self.assertEqual(restarted.search("5")[0][0], "doc1")
+
+    def test_keyword_rebuild_pages_through_collection(self):
+        from chromadb.api.models.Collection import Collection
+        self.manager.add_documents([f"Battery note {i}" for i in range(25)], ids=[f"doc{i}" for i in range(25)])
+        limits = []
+        get = Collection.get
+
+        def recording_get(collection, *args, **kwargs):
+            limits.append(kwargs.get('limit'))
+            return get(collection, *args, **kwargs)
+
+        with patch.object(Collection, 'get', recording_get):
+            self.manager.rebuild_keyword_index(batch_size=10)
+
+        self.assertEqual(limits, [10, 10, 10])
+        self.assertEqual(len(self.manager.bm25), 25)
+
+class TestChunking(ChromaTestCase):
+    """Chunking long documents and collapsing chunk hits to their parent"""
+    
+    def write_report(self, name, paragraphs):
+        path = os.path.join(self.db_path, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n\n".join(paragraphs))
+        return path
+    
+    def test_chunks_respect_budget_and_overlap(self):
+        from chunker import chunk_text, estimate_tokens, split_sentences
+        text = "\n\n".join(
+            " ".join(f"Paragraph {p} sentence {i} covers battery research." for i in range(10))
+            for p in range(5)
+        )
+        chunks = chunk_text(text, max_tokens=50, overlap_tokens=10)
+        
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(estimate_tokens(chunk) <= 50 for chunk in chunks))
+        for previous, following in zip(chunks, chunks[1:]):
+            self.assertIn(split_sentences(previous)[-1], following)
+    
+    def test_overlap_is_never_a_chunk_of_its_own(self):
+        from chunker import chunk_text
+        summary = "Summary " + " ".join(f"finding{i}" for i in range(44)) + "."
+        text = "\n\n".join([
+            "Alpha cells passed the test. Beta cells failed the test. Gamma cells are pending.",
+            summary,
+            " ".join(f"Delta batch {i} shipped on time." for i in range(9))
+        ])
+        chunks = chunk_text(text, max_tokens=50, overlap_tokens=10)
+        
+        self.assertEqual(chunks[1], summary)
+        for previous, following in zip(chunks, chunks[1:]):
+            self.assertFalse(previous.endswith(following))
+    
+    def test_short_text_is_single_chunk(self):
+        from chunker import chunk_text
+        self.assertEqual(chunk_text("One short sentence."), ["One short sentence."])
+        self.assertEqual(chunk_text("   "), [])
+
+    def test_files_are_chunked_as_they_are_read(self):
+        from chunker import chunk_text, iter_chunks
+        paragraphs = ["\n".join(f"Part {p} line {i} covers cell chemistry. Results follow." for i in range(6)) for p in range(40)]
+        path = self.write_report("long_report.txt", paragraphs)
+        with open(path, encoding='utf-8') as f:
+            content = f.read()
+        lines = content.splitlines(keepends=True)
+        consumed = []
+
+        def reading():
+            for line in lines:
+                consumed.append(line)
+                yield line
+
+        first = next(iter_chunks(reading(), max_tokens=60, overlap_tokens=10))
+        chunks = list(chroma_manager.iter_text_files([path], max_tokens=60, overlap_tokens=10))
+
+        self.assertLess(len(consumed), len(lines) // 10)
+        self.assertEqual(first, chunk_text(content, 60, 10)[0])
+        self.assertEqual([chunk for chunk, _ in chunks], chunk_text(content, 60, 10))
+        self.assertTrue(all(metadata['chunk_count'] == len(chunks) for _, metadata in chunks))
+
+    def test_hybrid_search_collapses_chunks_to_parent(self):
+        filler = [" ".join(f"Section {p} line {i} discusses Ares cell chemistry." for i in range(8)) for p in range(4)]
+        path = self.write_report("ares_report.txt", filler)
+        other = self.write_report("cloud.txt", ["Cloud migration status report."])
+        manager = chroma_manager.get_chroma_manager(db_path=self.db_path)
+        
+        with patch.dict(os.environ, {'CHROMA_DB_PATH': self.db_path}):
+            added = chroma_manager.add_custom_documents([path, other], max_tokens=60, overlap_tokens=10)
+        
+        self.assertGreater(added, 2)
+        results = manager.hybrid_search("Ares cell chemistry", n_results=5)
+        parents = [result['metadata']['parent_id'] for result in results]
+        self.assertEqual(len(parents), len(set(parents)))
+        self.assertEqual(results[0]['metadata']['filename'], "ares_report.txt")
+        self.assertEqual(len(results), 2)
+    
+    def test_shrunk_document_prunes_stale_chunks(self):
+        long_text = [" ".join(f"Part {p} sentence {i} on logistics." for i in range(8)) for p in range(4)]
+        path = self.write_report("shrinking.txt", long_text)
+        manager = chroma_manager.get_chroma_manager(db_path=self.db_path)
+        with patch.dict(os.environ, {'CHROMA_DB_PATH': self.db_path}):
+            chroma_manager.add_custom_documents([path], max_tokens=60, overlap_tokens=10)
+            self.write_report("shrinking.txt", ["Now a single short paragraph."])
+            chroma_manager.add_custom_documents([path], max_tokens=60, overlap_tokens=10)
+        
+        self.assertEqual(manager.get_collection_stats(), 1)
+        self.assertEqual(len(manager.bm25), 1)
+
+class TestQueryEmbeddingCache(ChromaTestCase):
+    """LRU + TTL cache for query embeddings in ChromaManager.search"""
+    
+    def test_repeated_queries_skip_encoding(self):
+        manager = ChromaManager(db_path=self.db_path)
+        manager.add_documents(["Latest AI regulations and our compliance status"])
+        encode_calls = manager.embedder.encode_calls
+        
+        manager.search("Latest AI regulations and our compliance")
+        manager.search("  latest AI regulations   and our COMPLIANCE ")
+        
+        self.assertEqual(manager.embedder.encode_calls, encode_calls + 1)
+        stats = manager.get_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+    
+    def test_lru_eviction_and_ttl(self):
+        from caching import LRUCache
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        
+        expiring = LRUCache(maxsize=2, ttl=60)
+        expiring.set("q", [0.1])
+        with patch('caching.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(expiring.get("q"))
+
+class TestPersistentEmbeddingCache(ChromaTestCase):
+    """On-disk embedding cache consulted by add_documents"""
+    
+    def test_rebuilt_collection_reuses_cached_vectors(self):
+        documents = [f"Archive document {i} about quarterly results" for i in range(6)]
+        first = ChromaManager(db_path=self.db_path, collection_name="first")
+        first.add_documents(documents)
+        encode_calls = first.embedder.encode_calls
+        
+        # Same process, wiped registry: the store is reloaded from disk
+        chroma_manager.reset_registry()
+        rebuilt = ChromaManager(db_path=self.db_path, collection_name="rebuilt")
+        rebuilt.add_documents(documents + ["One genuinely new document"])
+        
+        self.assertEqual(rebuilt.embedder.encode_calls, 1)
+        self.assertEqual(rebuilt.get_collection_stats(), 7)
+        self.assertEqual(len(rebuilt.embedding_store), 7)
+        
+        original = first.collection.get(ids=[chroma_manager.make_document_id(documents[0])], include=['embeddings'])
+        copied = rebuilt.collection.get(ids=[chroma_manager.make_document_id(documents[0])], include=['embeddings'])
+        np.testing.assert_allclose(original['embeddings'][0], copied['embeddings'][0], rtol=1e-6)
+    
+    def test_store_recovers_from_partial_write(self):
+        from embedding_store import EmbeddingStore
+        directory = os.path.join(self.db_path, 'partial')
+        store = EmbeddingStore(directory, "model/name")
+        store.put_many(["a", "b"], np.eye(2, 4, dtype=np.float32))
+        with open(store.index_path, 'a', encoding='utf-8') as f:
+            f.write("c\n")
+        
+        reopened = EmbeddingStore(directory, "model/name")
+        self.assertEqual(len(reopened), 2)
+        np.testing.assert_array_equal(reopened.get_many(["x", "b"])[1], [0, 1, 0, 0])
+    
+    def test_missing_data_file_starts_empty(self):
+        from embedding_store import EmbeddingStore
+        directory = os.path.join(self.db_path, 'missing')
+        store = EmbeddingStore(directory, "model")
+        store.put_many(["a", "b"], np.eye(2, 4, dtype=np.float32))
+        os.remove(store.matrix_path)
+        
+        reopened = EmbeddingStore(directory, "model")
+        self.assertEqual(len(reopened), 0)
+        reopened.put_many(["c"], np.eye(1, 4, dtype=np.float32))
+        self.assertEqual(set(EmbeddingStore(directory, "model").rows), {"c"})
+
+class TestParallelGather(ChromaTestCase):
+    """Web and internal retrieval run concurrently with per-source deadlines"""
+    
+    def setUp(self):
+        super().setUp()
+        import time
+        self.time = time
+        self.agent = FreeContextualAgent()
+        self.intent = {"needs_web": True, "needs_internal": True}
+    
+    def slow(self, seconds, value):
+        def run(*args, **kwargs):
+            self.time.sleep(seconds)
+            return value
+        return run
+    
+    def test_sources_are_fetched_concurrently(self):
+        web_record = {"title": "Web result", "snippet": "s", "url": "https://a.io", "rank": 1, "score": 1.0}
+        self.agent.searcher.search = self.slow(0.3, [web_record])
+        self.agent.chroma.hybrid_search = self.slow(0.3, [{"content": "internal doc", "metadata": {}}])
+        
+        start = self.time.perf_counter()
+        web_results, internal_results, fallbacks = self.agent.gather_sources("question", self.intent)
+        elapsed = self.time.perf_counter() - start
+        
+        self.assertLess(elapsed, 0.55)
+        self.assertEqual(web_results, [web_record])
+        self.assertEqual(internal_results[0]['content'], "internal doc")
+        self.assertEqual(fallbacks, {})
+    
+    def test_failed_source_is_reported(self):
+        self.agent.searcher.search = Mock(side_effect=Exception("Search service down"))
+        result = self.agent.process_query("Latest news on our internal compliance status")
+        
+        self.assertIn("Search service down", result['fallbacks']['web'])
+        self.assertTrue(result['sources_used']['internal'])
+    
+    def test_late_source_is_dropped(self):
+        self.agent.searcher.search = self.slow(1.0, [])
+        with patch('free_contextual_agent.WEB_SEARCH_TIMEOUT', 0.1):
+            start = self.time.perf_counter()
+            result = self.agent.process_query("Latest news on our internal compliance status")
+            elapsed = self.time.perf_counter() - start
+        
+        self.assertLess(elapsed, 0.9)
+        self.assertIn('web', result['fallbacks'])
+        self.assertFalse(result['sources_used']['web'])
+    
+    def test_stage_events_carry_real_timings(self):
+        self.agent.searcher.search = self.slow(0.2, [])
+        events = []
+        result = self.agent.process_query("Latest news on our internal compliance status", on_event=events.append)
+        
+        finished = {event['stage']: event for event in events if event['status'] != 'start'}
+        self.assertEqual(set(finished), {"cache", "intent", "web", "internal", "synthesis"})
+        self.assertGreaterEqual(finished['web']['seconds'], 0.2)
+        self.assertLess(finished['internal']['seconds'], finished['web']['seconds'])
+        self.assertEqual(events[0], {"stage": "cache", "status": "start"})
+        self.assertEqual(events[-1]['stage'], "synthesis")
+        self.assertEqual(result['timings']['web'], finished['web']['seconds'])
+    
+    def test_unneeded_source_is_reported_skipped(self):
+        events = []
+        self.agent.gather_sources("q", {"needs_web": False, "needs_internal": True}, StageTracker(events.append))
+        
+        self.assertIn({"stage": "web", "status": "skipped"}, events)
+
+class TestBatchProcessing(ChromaTestCase):
+    """process_batch shares retrieval work across many questions"""
+
+    def setUp(self):
+        super().setUp()
+        self.manager = ChromaManager(db_path=self.db_path)
+        self.manager.add_documents(
+            [f"Research note {i} on battery cells and cloud costs" for i in range(20)],
+            ids=[f"doc{i}" for i in range(20)]
+        )
+        self.ai = Mock()
+        self.ai.analyze_intent.return_value = '{"needs_web": true, "needs_internal": true}'
+        self.ai.synthesize_answer.side_effect = lambda question, web, internal: f"Report: {question}"
+        self.searcher = Mock()
+        self.searcher.search.return_value = [{"title": "Web", "snippet": "s", "url": "https://a.io", "rank": 1, "score": 1.0}]
+        self.agent = FreeContextualAgent(searcher=self.searcher, ai=self.ai, chroma=self.manager)
+        self.questions = [f"Battery question {i % 3}" for i in range(9)]
+
+    def test_every_question_gets_its_result(self):
+        results = dict(self.agent.process_batch(self.questions))
+
+        self.assertEqual(sorted(results), list(range(9)))
+        for index, result in results.items():
+            self.assertEqual(result['answer'], f"Report: {self.questions[index]}")
+            self.assertTrue(result['internal_results'])
+            self.assertEqual(result['fallbacks'], {})
+
+    def test_internal_queries_share_one_encode_and_query(self):
+        embedder = chroma_manager.get_embedder()
+        encodes_before = embedder.encode_calls
+        collection = self.manager.collection
+        self.manager.collection = Mock(wraps=collection)
+        list(self.agent.process_batch([f"Distinct question number {i}" for i in range(6)]))
+
+        self.assertEqual(embedder.encode_calls - encodes_before, 1)
+        self.assertEqual(self.manager.collection.query.call_count, 1)
+        self.assertEqual(len(self.manager.collection.query.call_args.kwargs['query_embeddings']), 6)
+
+    def test_identical_web_queries_are_searched_once(self):
+        list(self.agent.process_batch(self.questions))
+
+        self.assertEqual(self.searcher.search.call_count, 3)
+
+    def test_failed_source_falls_back_for_its_questions(self):
+        self.searcher.search.side_effect = Exception("Search service down")
+        results = dict(self.agent.process_batch(self.questions))
+
+        for result in results.values():
+            self.assertIn("Search service down", result['fallbacks']['web'])
+            self.assertTrue(result['sources_used']['internal'])
+
+    def test_batch_search_matches_single_queries(self):
+        queries = ["battery cells", "cloud costs", "battery cells"]
+        batched = self.manager.batch_hybrid_search(queries, n_results=3)
+
+        self.assertEqual(batched, [self.manager.hybrid_search(query, n_results=3) for query in queries])
+
+class TestSemanticAnswerCache(ChromaTestCase):
+    """Reports are reused for near-duplicate questions while fresh"""
+    
+    def setUp(self):
+        super().setUp()
+        self.agent = FreeContextualAgent()
+        self.agent.gather_sources = Mock(wraps=self.agent.gather_sources)
+        self.question = "latest battery research status of our team"
+        self.paraphrase = "our team latest status of battery research"
+    
+    def test_paraphrase_skips_search_and_synthesis(self):
+        first = self.agent.process_query(self.question)
+        second = self.agent.process_query(self.paraphrase)
+        
+        self.assertEqual(self.agent.gather_sources.call_count, 1)
+        self.assertEqual(second['answer'], first['answer'])
+        self.assertEqual(second['cache']['question'], self.question)
+        self.assertGreaterEqual(second['cache']['similarity'], self.agent.answer_cache.threshold)
+        self.assertEqual(self.agent.answer_cache.stats()['hits'], 1)
+    
+    def test_cache_is_a_dedicated_cosine_collection(self):
+        self.agent.process_query(self.question)
+        
+        self.assertEqual(self.agent.answer_cache.collection.metadata["hnsw:space"], "cosine")
+        self.assertEqual(len(self.agent.answer_cache), 1)
+        self.assertNotEqual(self.agent.answer_cache.collection.name, self.agent.chroma.collection.name)
+    
+    def test_other_depth_or_unrelated_question_misses(self):
+        self.agent.process_query(self.question)
+        self.assertNotIn('cache', self.agent.process_query(self.paraphrase, depth="Comprehensive"))
+        self.assertNotIn('cache', self.agent.process_query("quantum computing market trends"))
+    
+    def test_stale_report_is_not_served(self):
+        self.agent.process_query(self.question)
+        self.agent.answer_cache.ttl = 0
+        
+        self.assertNotIn('cache', self.agent.process_query(self.paraphrase))
+    
+    def test_cache_hit_keeps_sources(self):
+        self.agent.chroma.add_documents(["Battery research status: our team reached 750 Wh/L."], [{"source": "internal"}])
+        first = self.agent.process_query(self.question)
+        second = self.agent.process_query(self.paraphrase)
+        
+        self.assertIn('cache', second)
+        self.assertTrue(second['internal_results'])
+        self.assertEqual(second['web_results'], first['web_results'])
+        self.assertEqual(second['internal_results'], first['internal_results'])
+    
+    def test_expired_best_match_does_not_hide_a_fresh_one(self):
+        import time
+        cache = self.agent.answer_cache
+        result = {"answer": "report", "sources_used": {"web": True, "internal": False}}
+        with patch('semantic_cache.time.time', return_value=time.time() - cache.ttl - 60):
+            cache.store(self.question, "Standard", dict(result, answer="old report"))
+        cache.store(self.question + " today", "Standard", dict(result, answer="fresh report"))
+        
+        entry = cache.lookup(self.question, "Standard")
+        
+        self.assertEqual(entry['answer'], "fresh report")
+        self.assertEqual(len(cache), 1)
+    
+    def test_async_cache_events_stay_on_the_calling_thread(self):
+        import asyncio
+        import threading
+        threads = set()
+        
+        async def ask_twice():
+            for question in (self.question, self.paraphrase):
+                await self.agent.aprocess_query(question, on_event=lambda event: threads.add(threading.get_ident()))
+        
+        asyncio.run(ask_twice())
+        self.assertEqual(threads, {threading.get_ident()})
+        self.assertEqual(self.agent.answer_cache.stats()['hits'], 1)
+    
+    def test_degraded_answers_are_not_cached(self):
+        self.agent.searcher.search = Mock(side_effect=Exception("Search service down"))
+        self.agent.chroma.hybrid_search = Mock(side_effect=Exception("Index unavailable"))
+        self.agent.process_query(self.question)
+        
+        self.assertEqual(len(self.agent.answer_cache), 0)
+
+class TestContextAssembler(unittest.TestCase):
+    """Retrieved passages are ranked, deduplicated and packed into a per-depth budget"""
+    
+    def setUp(self):
+        from context_assembler import ContextAssembler, budget_for_depth
+        self.ContextAssembler = ContextAssembler
+        self.budget_for_depth = budget_for_depth
+        self.web = [
+            {"title": f"Result {i}", "snippet": f"battery breakthrough number {i} " + "detail " * 40, "url": f"https://n.io/{i}", "rank": i, "score": 1.0 / i}
+            for i in range(1, 6)
+        ]
+        self.internal = [
+            {"content": f"Internal project note {i} " + "finding " * 60, "metadata": {}, "score": 0.05 / i}
+            for i in range(1, 6)
+        ]
+    
+    def test_budget_grows_with_depth(self):
+        budgets = [self.budget_for_depth(depth) for depth in ("Quick", "Standard", "Comprehensive")]
+        self.assertEqual(budgets, sorted(budgets))
+        self.assertEqual(self.budget_for_depth("Unknown"), self.budget_for_depth("Standard"))
+    
+    def test_context_fits_budget_and_keeps_best_passages(self):
+        web, internal, stats = self.ContextAssembler(300).assemble(self.web, self.internal)
+        
+        self.assertLessEqual(stats['used_tokens'], 300)
+        self.assertGreater(stats['dropped'], 0)
+        self.assertEqual(web[0]['title'], "Result 1")
+        self.assertTrue(internal[0]['content'].startswith("Internal project note 1"))
+    
+    def test_near_duplicates_are_dropped(self):
+        repeated = self.internal[:1] + [dict(self.internal[0], score=0.01)]
+        _, internal, stats = self.ContextAssembler(5000).assemble([], repeated)
+        
+        self.assertEqual(len(internal), 1)
+        self.assertEqual(stats['duplicates'], 1)
+    
+    def test_depth_drives_prompt_size(self):
+        agent = FreeContextualAgent(searcher=Mock(), ai=Mock(), chroma=Mock())
+        intent = {"needs_web": True, "needs_internal": True}
+        quick = agent.build_context(intent, self.web, self.internal, "Quick")
+        comprehensive = agent.build_context(intent, self.web, self.internal, "Comprehensive")
+        
+        self.assertLess(len(quick[0] + quick[1]), len(comprehensive[0] + comprehensive[1]))
+        self.assertLessEqual(quick[2]['used_tokens'], self.budget_for_depth("Quick"))
+
+class TestBenchmarkHarness(unittest.TestCase):
+    """Local Serper/Gemini stubs, percentile reporting and baseline comparison"""
+
+    def test_search_client_talks_to_serper_stub(self):
+        from benchmark_suite import local_stubs
+        with local_stubs(serper_latency=0, gemini_latency=0) as (serper, _):
+            client = FreeSearchClient()
+            serper.fail(1)
+            with patch('free_search_client.backoff_delay', return_value=0):
+                records = client.search("battery storage")
+
+        self.assertEqual(len(records), 5)
+        self.assertTrue(records[0]['url'].startswith("https://stub.local/"))
+        self.assertEqual(client.get_metrics()['retries'], 1)
+        self.assertEqual(serper.requests, 2)
+
+    def test_ai_client_talks_to_gemini_stub(self):
+        from benchmark_suite import local_stubs
+        with local_stubs(serper_latency=0, gemini_latency=0) as (_, gemini):
+            client = FreeAIClient()
+            client.router = None
+            intent = json.loads(client.analyze_intent("Compare our battery research with the market"))
+            report = client.synthesize_answer("Question", "web", "internal")
+            streamed = "".join(client.stream_answer("Other question", "web", "internal"))
+
+        self.assertTrue(client.use_api)
+        self.assertTrue(intent['needs_web'] and intent['needs_internal'])
+        self.assertIn("Benchmark stub report", report)
+        self.assertIn("Benchmark stub report", streamed)
+        self.assertEqual(gemini.requests, 3)
+
+    def test_async_ai_client_talks_to_gemini_stub(self):
+        import asyncio
+        from benchmark_suite import local_stubs
+
+        async def collect(stream):
+            return "".join([chunk async for chunk in stream])
+
+        with local_stubs(serper_latency=0, gemini_latency=0) as (_, gemini):
+            client = FreeAIClient()
+            client.router = None
+            intent = json.loads(asyncio.run(client.aanalyze_intent("Compare our battery research with the market")))
+            report = asyncio.run(client.asynthesize_answer("Question", "web", "internal"))
+            streamed = asyncio.run(collect(client.astream_answer("Other question", "web", "internal")))
+
+        self.assertEqual(intent['reasoning'], "Benchmark stub")
+        self.assertIn("Benchmark stub report", report)
+        self.assertIn("Benchmark stub report", streamed)
+        self.assertEqual(gemini.requests, 3)
+
+    def test_latency_summary_percentiles(self):
+        from benchmark_suite import latency_summary
+        summary = latency_summary([i / 1000 for i in range(1, 101)])
+
+        self.assertEqual((summary['p50_ms'], summary['p95_ms'], summary['p99_ms']), (50.0, 95.0, 99.0))
+
+    def test_baseline_comparison_flags_real_slowdowns(self):
+        from benchmark_suite import compare_to_baseline
+        baseline = {"results": {"search": {"p50_ms": 10.0, "p95_ms": 20.0, "p99_ms": 30.0}, "gone": {"p50_ms": 1.0}}}
+        report = {"results": {"search": {"p50_ms": 10.5, "p95_ms": 30.0, "p99_ms": 30.4}, "new": {"p50_ms": 5.0}}}
+
+        regressions = compare_to_baseline(report, baseline, tolerance=0.2)
+
+        self.assertEqual([(r['benchmark'], r['metric']) for r in regressions], [("search", "p95_ms")])
+        self.assertEqual(regressions[0]['change'], 0.5)
+
+class SpanCollector:
+    """In-memory span exporter"""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span.to_dict())
+
+class TestTracing(unittest.TestCase):
+    """Per-stage spans, client annotations and metrics export"""
+
+    def setUp(self):
+        import tracing
+        from benchmark_suite import StubSearcher, StubAI, StubChroma
+        self.tracing = tracing
+        self.collector = SpanCollector()
+        self.tracer = tracing.Tracer([self.collector])
+        self.tracer_patch = patch('tracing._tracer', self.tracer)
+        self.tracer_patch.start()
+        self.agent = FreeContextualAgent(searcher=StubSearcher(0.01), ai=StubAI(0.01, 0.02), chroma=StubChroma())
+
+    def tearDown(self):
+        self.tracer.stop_metrics_server()
+        self.tracer_patch.stop()
+
+    def spans_by_name(self):
+        return {span['name']: span for span in self.collector.spans}
+
+    def test_each_stage_is_a_span_of_the_request(self):
+        result = self.agent.process_query("Compare our batteries with the market")
+        spans = self.spans_by_name()
+
+        self.assertEqual(set(spans), {"request", "intent", "web", "internal", "synthesis"})
+        self.assertTrue(all(span['trace_id'] == result['trace_id'] for span in spans.values()))
+        self.assertEqual(spans['web']['parent_id'], spans['request']['span_id'])
+        self.assertGreaterEqual(spans['synthesis']['duration'], 0.02)
+        self.assertEqual(spans['web']['results'], 1)
+
+    def test_fallback_reason_is_recorded(self):
+        self.agent.searcher.search = Mock(side_effect=Exception("Search service down"))
+        self.agent.process_query("Compare our batteries with the market")
+
+        self.assertEqual(self.spans_by_name()['web']['status'], "failed")
+        self.assertIn("Search service down", self.spans_by_name()['web']['fallback'])
+        self.assertIn('research_fallbacks_total{stage="web"} 1', self.agent.get_metrics())
+
+    def test_failed_request_is_still_exported(self):
+        self.agent.ai.synthesize_answer = Mock(side_effect=RuntimeError("model crashed"))
+        with self.assertRaises(RuntimeError):
+            self.agent.process_query("Compare our batteries with the market")
+        spans = self.spans_by_name()
+
+        self.assertEqual(spans['request']['status'], "failed")
+        self.assertEqual(spans['request']['error'], "model crashed")
+        self.assertEqual(spans['synthesis']['status'], "failed")
+        self.assertIn('research_stage_total{stage="request",status="failed"} 1', self.agent.get_metrics())
+
+    def test_abandoned_stream_ends_the_request(self):
+        self.agent.ai.stream_answer = lambda *args: iter(["## Summary\n", "More text\n"])
+        result = self.agent.stream_query("Compare our batteries with the market")
+        next(result['answer_stream'])
+        result['answer_stream'].close()
+
+        self.assertEqual(self.spans_by_name()['request']['status'], "failed")
+
+    def test_clients_annotate_the_active_span(self):
+        client = FreeAIClient()
+        client.use_api = True
+        client.model = Mock()
+        client.model.generate_content.return_value = Mock(text="A short report")
+        with self.tracer.span("synthesis") as first:
+            client.synthesize_answer("Question", "web", "internal")
+        with self.tracer.span("synthesis") as second:
+            client.synthesize_answer("Question", "web", "internal")
+
+        self.assertEqual(first.attributes['cache'], "miss")
+        self.assertGreater(first.attributes['tokens_in'], 0)
+        self.assertEqual(first.attributes['bytes_out'], len("A short report"))
+        self.assertEqual(second.attributes['cache'], "hit")
+
+    def test_work_on_worker_threads_is_attributed(self):
+        def search(query):
+            self.tracing.annotate(bytes_out=123)
+            return []
+        self.agent.searcher.search = search
+        self.agent.process_query("Compare our batteries with the market")
+
+        self.assertEqual(self.spans_by_name()['web']['bytes_out'], 123)
+
+    def test_prometheus_histogram_and_endpoint(self):
+        import urllib.request
+        for duration in (0.004, 0.2, 3.0):
+            self.tracer.end_span(self.tracer.start_span("web"), duration)
+        port = self.tracer.start_metrics_server(0)
+
+        text = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+        self.assertIn('research_stage_duration_seconds_bucket{stage="web",le="0.005"} 1', text)
+        self.assertIn('research_stage_duration_seconds_bucket{stage="web",le="0.25"} 2', text)
+        self.assertIn('research_stage_duration_seconds_count{stage="web"} 3', text)
+        self.assertIn('research_stage_total{stage="web",status="ok"} 3', text)
+
+    def test_json_lines_export(self):
+        path = os.path.join(tempfile.mkdtemp(prefix="trace_"), "spans.jsonl")
+        exporter = self.tracing.JsonLinesExporter(path)
+        self.tracer.exporters.append(exporter)
+        result = self.agent.process_query("Compare our batteries with the market")
+        exporter.flush()
+
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        self.assertEqual(len(lines), 5)
+        self.assertEqual({line['trace_id'] for line in lines}, {result['trace_id']})
+
+class TestAsyncAgent(unittest.TestCase):
+    """aprocess_query serves many in-flight requests from one process"""
+    
+    def setUp(self):
+        from benchmark_suite import StubSearcher, StubAI, StubChroma
+        self.agent = FreeContextualAgent(
+            searcher=StubSearcher(0.05),
+            ai=StubAI(0.05, 0.2),
+            chroma=StubChroma()
+        )
+    
+    def test_requests_overlap(self):
+        import asyncio
+        import time
+        
+        async def run_all():
+            return await asyncio.gather(*(self.agent.aprocess_query(f"Question {i}") for i in range(20)))
+        
+        start = time.perf_counter()
+        results = asyncio.run(run_all())
+        elapsed = time.perf_counter() - start
+        
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(result['answer'].startswith("Report for") for result in results))
+        self.assertLess(elapsed, 2.0)
+    
+    def test_concurrency_is_bounded(self):
+        import asyncio
+        in_flight = []
+        peak = []
+        synthesize = self.agent.ai.asynthesize_answer
+        
+        async def tracking_synthesis(*args):
+            in_flight.append(1)
+            peak.append(len(in_flight))
+            try:
+                return await synthesize(*args)
+            finally:
+                in_flight.pop()
+        
+        self.agent.ai.asynthesize_answer = tracking_synthesis
+        
+        async def run_all():
+            return await asyncio.gather(*(self.agent.aprocess_query(f"Question {i}") for i in range(6)))
+        
+        with patch('free_contextual_agent.MAX_CONCURRENT_REQUESTS', 2):
+            asyncio.run(run_all())
+        self.assertEqual(max(peak), 2)
+
+    def test_blocking_calls_are_not_capped_by_default_executor(self):
+        import asyncio
+        import threading
+        import contextvars
+        import async_io
+
+        self.assertGreaterEqual(async_io.ASYNC_IO_WORKERS, async_io.MAX_CONCURRENT_REQUESTS)
+        # Every call must be running at once to get past the barrier
+        barrier = threading.Barrier(async_io.ASYNC_IO_WORKERS, timeout=5)
+        request_id = contextvars.ContextVar('request_id')
+
+        def blocking_call():
+            barrier.wait()
+            return threading.current_thread().name, request_id.get()
+
+        async def run_all():
+            request_id.set("req-1")
+            return await asyncio.gather(*(async_io.run_blocking(blocking_call) for _ in range(async_io.ASYNC_IO_WORKERS)))
+
+        results = asyncio.run(run_all())
+        self.assertTrue(all(name.startswith("async-io") for name, _ in results))
+        self.assertEqual({value for _, value in results}, {"req-1"})
+
+    def test_streams_hold_a_slot_until_consumed(self):
+        import asyncio
+        
+        async def stream_answer(*args):
+            yield "Report"
+        
+        self.agent.ai.astream_answer = stream_answer
+        
+        async def run():
+            first, second = await asyncio.gather(*(self.agent.astream_query(f"Question {i}") for i in range(2)))
+            third = asyncio.ensure_future(self.agent.astream_query("Question 2"))
+            await asyncio.sleep(0.3)
+            waiting = not third.done()
+            async for _ in first['answer_stream']:
+                pass
+            result = await asyncio.wait_for(third, 2.0)
+            return waiting, result
+        
+        with patch('free_contextual_agent.MAX_CONCURRENT_REQUESTS', 2):
+            waiting, result = asyncio.run(run())
+        self.assertTrue(waiting)
+        self.assertIn('answer_stream', result)
+
 class TestFreeContextualAgent(unittest.TestCase):
     """Test cases for FreeContextualAgent"""
     
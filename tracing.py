@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Append every finished span as one JSON line; empty disables the log
+TRACE_LOG_PATH = os.getenv('TRACE_LOG_PATH', '')
+# Serve Prometheus metrics on http://127.0.0.1:<port>/metrics; 0 disables the endpoint
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Attributes summed across calls within one span (e.g. several LLM calls)
+COUNTED_ATTRIBUTES = ("bytes_in", "bytes_out", "tokens_in", "tokens_out")
+
+# Span that annotate() writes to in the current thread or task
+current_span = contextvars.ContextVar('current_span', default=None)
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+class Span:
+    """One timed stage of a request
+
+    attributes holds cache ("hit"/"miss"), bytes_in/out, tokens_in/out,
+    fallback (why the stage degraded) and any stage-specific details.
+    """
+
+    def __init__(self, name, trace_id=None, parent=None):
+        self.name = name
+        self.trace_id = trace_id or (parent.trace_id if parent else None)
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.status = "ok"
+        self.attributes = {}
+        self.lock = threading.Lock()
+
+    def set(self, **attributes):
+        """Set attributes; bytes and token counts add up instead of overwriting"""
+        with self.lock:
+            for key, value in attributes.items():
+                if value is None:
+                    continue
+                if key in COUNTED_ATTRIBUTES:
+                    self.attributes[key] = self.attributes.get(key, 0) + value
+                else:
+                    self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.started, 6),
+            "duration": round(self.duration or 0.0, 6),
+            "status": self.status,
+            **self.attributes
+        }
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+class MetricsRegistry:
+    """Counters and latency histograms per stage, rendered in Prometheus text format"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.durations = {}    # stage -> [bucket counts..., +Inf count, sum]
+        self.spans = {}        # (stage, status) -> count
+        self.cache = {}        # (stage, result) -> count
+        self.bytes = {}        # (stage, direction) -> total
+        self.tokens = {}       # (stage, direction) -> total
+        self.fallbacks = {}    # stage -> count
+
+    def observe(self, span):
+        stage = span.name
+        attributes = span.attributes
+        with self.lock:
+            histogram = self.durations.setdefault(stage, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if span.duration <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += span.duration
+            self.spans[(stage, span.status)] = self.spans.get((stage, span.status), 0) + 1
+            if attributes.get("cache"):
+                key = (stage, attributes["cache"])
+                self.cache[key] = self.cache.get(key, 0) + 1
+            for direction in ("in", "out"):
+                if attributes.get(f"bytes_{direction}"):
+                    self.bytes[(stage, direction)] = self.bytes.get((stage, direction), 0) + attributes[f"bytes_{direction}"]
+                if attributes.get(f"tokens_{direction}"):
+                    self.tokens[(stage, direction)] = self.tokens.get((stage, direction), 0) + attributes[f"tokens_{direction}"]
+            if attributes.get("fallback"):
+                self.fallbacks[stage] = self.fallbacks.get(stage, 0) + 1
+
+    def render(self):
+        """Prometheus text exposition of everything observed so far"""
+        lines = []
+        with self.lock:
+            lines += ["# HELP research_stage_duration_seconds Latency of each pipeline stage",
+                      "# TYPE research_stage_duration_seconds histogram"]
+            for stage, histogram in sorted(self.durations.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f"research_stage_duration_seconds_bucket{_labels(stage=stage, le=bound)} {count}")
+                lines.append(f"research_stage_duration_seconds_bucket{_labels(stage=stage, le='+Inf')} {histogram[-2]}")
+                lines.append(f"research_stage_duration_seconds_sum{_labels(stage=stage)} {histogram[-1]:.6f}")
+                lines.append(f"research_stage_duration_seconds_count{_labels(stage=stage)} {histogram[-2]}")
+            counters = [
+                ("research_stage_total", "Finished stages by status", self.spans, ("stage", "status")),
+                ("research_cache_total", "Cache lookups by result", self.cache, ("stage", "result")),
+                ("research_bytes_total", "Bytes sent and received", self.bytes, ("stage", "direction")),
+                ("research_tokens_total", "Estimated LLM tokens in and out", self.tokens, ("stage", "direction")),
+            ]
+            for name, help_text, values, label_names in counters:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for key, value in sorted(values.items()):
+                    lines.append(f"{name}{_labels(**dict(zip(label_names, key)))} {value}")
+            lines += ["# HELP research_fallbacks_total Stages that degraded to a fallback",
+                      "# TYPE research_fallbacks_total counter"]
+            for stage, value in sorted(self.fallbacks.items()):
+                lines.append(f"research_fallbacks_total{_labels(stage=stage)} {value}")
+        return "\n".join(lines) + "\n"
+
+class JsonLinesExporter:
+    """Appends finished spans to a file, one JSON object per line
+
+    Lines go through a queue to a background writer, so ending a span (often
+    on the event loop) never waits on the disk. flush() blocks until every
+    queued line is written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = queue.Queue()
+        self.writer = threading.Thread(target=self._write, daemon=True, name="trace-writer")
+        self.writer.start()
+        atexit.register(self.flush)
+
+    def export(self, span):
+        self.lines.put(json.dumps(span.to_dict(), default=str))
+
+    def flush(self):
+        self.lines.join()
+
+    def _write(self):
+        try:
+            f = open(self.path, 'a', encoding='utf-8')
+        except OSError as e:
+            print(f"⚠️ Could not open trace log, dropping spans: {e}")
+            f = None
+        while True:
+            line = self.lines.get()
+            try:
+                if f is not None:
+                    f.write(line + "\n")
+                    if self.lines.empty():
+                        f.flush()
+            except OSError as e:
+                print(f"⚠️ Could not write span: {e}")
+            finally:
+                self.lines.task_done()
+
+class Tracer:
+    """Creates spans and hands finished ones to the metrics registry and exporters"""
+
+    def __init__(self, exporters=None):
+        self.metrics = MetricsRegistry()
+        self.exporters = list(exporters or [])
+        self.server = None
+
+    def start_span(self, name, trace_id=None, parent=None):
+        return Span(name, trace_id, parent)
+
+    def end_span(self, span, duration=None, status=None):
+        span.duration = time.perf_counter() - span.start if duration is None else duration
+        if status:
+            span.status = status
+        self.metrics.observe(span)
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                print(f"⚠️ Could not export span: {e}")
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the enclosed block as a child of the current span"""
+        span = self.start_span(name, parent=current_span.get())
+        span.set(**attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.set(error=str(e))
+            span.status = "failed"
+            raise
+        finally:
+            current_span.reset(token)
+            self.end_span(span)
+
+    def start_metrics_server(self, port=None, host=METRICS_HOST):
+        """Serve /metrics on a background thread and return the bound port (port 0 picks a free one)"""
+        if self.server is not None:
+            return self.server.server_port
+        port = METRICS_PORT if port is None else port
+        registry = self.metrics
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="metrics").start()
+        print(f"📈 Metrics at http://{host}:{self.server.server_port}/metrics")
+        return self.server.server_port
+
+    def stop_metrics_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+@contextmanager
+def activate(span):
+    """Make span the target of annotate() for the enclosed block"""
+    if span is None:
+        yield None
+        return
+    token = current_span.set(span)
+    try:
+        yield span
+    finally:
+        current_span.reset(token)
+
+def bind(span, function):
+    """Wrap function so it runs with span active, e.g. on an executor thread"""
+    if span is None:
+        return function
+
+    def run(*args, **kwargs):
+        with activate(span):
+            return function(*args, **kwargs)
+    return run
+
+def active():
+    """True inside a span, so callers can skip measuring sizes nobody will record"""
+    return current_span.get() is not None
+
+def annotate(**attributes):
+    """Add attributes to the active span; a no-op outside of one"""
+    span = current_span.get()
+    if span is not None:
+        span.set(**attributes)
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+def get_tracer():
+    """Process-wide tracer, configured from TRACE_LOG_PATH and METRICS_PORT on first use"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer([JsonLinesExporter(TRACE_LOG_PATH)] if TRACE_LOG_PATH else [])
+            if METRICS_PORT:
+                try:
+                    _tracer.start_metrics_server(METRICS_PORT)
+                except OSError as e:
+                    print(f"⚠️ Metrics endpoint unavailable: {e}")
+        return _tracer
+
+def span(name, **attributes):
+    """Time a block as a child of the current span on the shared tracer"""
+    return get_tracer().span(name, **attributes)